@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+"""
+Compare serializers of items on typical payloads:
+    python scripts/bench_serializers.py [rounds]
+
+It prints size of a serialized item and microseconds of dumps+loads for
+each codec and compressor (applied to pickle), then items per second of
+put_many/get_many through a local server.
+"""
+import logging
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from wukongqueue import WuKongQueue, WuKongQueueClient  # noqa: E402
+from wukongqueue import serializer  # noqa: E402
+from wukongqueue._item_wrapper import item_wrapper, item_unwrap  # noqa: E402
+
+PAYLOADS = {
+    "small str": "order:1234567",
+    "small dict": {"id": 1234567, "name": "wukong", "tags": ["a", "b"],
+                   "price": 12.5, "ok": True},
+    "int list": list(range(1000)),
+    "64KiB bytes": os.urandom(64 * 1024),
+    "64KiB json": [{"id": i, "name": "wukong", "tags": ["a", "b"]}
+                   for i in range(1500)],
+}
+
+
+def supports(s, item):
+    if s is None:
+        return True
+    try:
+        item_unwrap(item_wrapper(item, s))
+    except Exception:
+        return False
+    return True
+
+
+def codecs():
+    """yields (name, kwargs of item_wrapper)"""
+    for name in serializer.serializers():
+        yield name, {"serializer": serializer.get_serializer(name)}
+    for name in serializer.compressors():
+        yield "pickle+" + name, {
+            "compressor": serializer.get_compressor(name)
+        }
+
+
+def bench_codecs(rounds):
+    print("%-12s %-12s %10s %14s" % ("payload", "codec", "bytes", "us/item"))
+    for payload_name, item in PAYLOADS.items():
+        for name, kwargs in codecs():
+            if not supports(kwargs.get("serializer"), item):
+                continue
+            start = time.perf_counter()
+            for _ in range(rounds):
+                data = item_wrapper(item, **kwargs)
+                item_unwrap(data)
+            cost = (time.perf_counter() - start) / rounds * 1e6
+            print("%-12s %-12s %10d %14.2f" % (
+                payload_name, name, len(data), cost))
+
+
+def bench_server(rounds, batch=100):
+    svr = WuKongQueue(port=18848, log_level=logging.FATAL)
+    with svr.helper():
+        print("\n%-12s %-12s %14s" % ("payload", "codec", "items/s"))
+        for payload_name, item in PAYLOADS.items():
+            for name, kwargs in codecs():
+                if not supports(kwargs.get("serializer"), item):
+                    continue
+                if "compressor" in kwargs:
+                    kwargs = {"compression": kwargs["compressor"]}
+                with WuKongQueueClient(port=18848, log_level=logging.FATAL,
+                                       **kwargs) as client:
+                    items = [item] * batch
+                    start = time.perf_counter()
+                    for _ in range(max(rounds // batch, 1)):
+                        client.put_many(items)
+                        client.get_many(batch)
+                    cost = time.perf_counter() - start
+                print("%-12s %-12s %14d" % (
+                    payload_name, name,
+                    max(rounds // batch, 1) * batch / cost))
+
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    bench_codecs(n)
+    bench_server(n)
@@ -4,6 +4,12 @@ tests(){
     coverage run tests/server_tests.py -v
     coverage run tests/client_tests2.py -v
     coverage run tests/client_tests.py -v
+    coverage run tests/stress_tests.py -v
+    coverage run tests/async_client_tests.py -v
+    coverage run tests/async_server_tests.py -v
+    coverage run tests/wal_tests.py -v
+    coverage run tests/storage_tests.py -v
+    coverage run tests/serializer_tests.py -v
 }
 
 if tests; then
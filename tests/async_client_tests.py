@@ -0,0 +1,209 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import logging
+import sys
+from unittest import TestCase
+
+sys.path.append("../")
+try:
+    from wukongqueue.wukongqueue import *
+except ImportError:
+    from wukongqueue import *
+
+host = "127.0.0.1"
+default_port = 10200
+
+
+def new_svr(host=host, port=default_port, auth=None, max_size=0):
+    p = port
+    while 1:
+        try:
+            return WuKongQueue(
+                host=host, port=p, maxsize=max_size,
+                log_level=logging.FATAL, auth_key=auth
+            ), p
+        except OSError as e:
+            if 'already' in str(e.args) or '只允许使用一次' in str(e.args):
+                if p >= 65535:
+                    raise e
+                p += 1
+            else:
+                raise e
+
+
+def run(coro):
+    return asyncio.new_event_loop().run_until_complete(coro)
+
+
+class AsyncClientTests(TestCase):
+    def test_basic_method(self):
+        svr, port = new_svr(max_size=2)
+
+        async def main():
+            async with AsyncWuKongQueueClient(
+                    host=host, port=port, log_level=logging.FATAL) as client:
+                self.assertIs(await client.connected(), True)
+                self.assertIs(await client.empty(), True)
+                await client.put("1")
+                await client.put(b"2")
+                self.assertIs(await client.full(), True)
+                self.assertRaises(Full, svr.put, "3", block=False)
+                self.assertEqual(await client.realtime_qsize(), 2)
+                self.assertEqual(await client.realtime_maxsize(), 2)
+                self.assertEqual(await client.get(), "1")
+                self.assertEqual(await client.get(), b"2")
+                with self.assertRaises(Empty):
+                    await client.get(block=False)
+                self.assertEqual(
+                    await client.put_many(["a", "b", "c"], block=False), 2
+                )
+                self.assertEqual(await client.get_many(5), ["a", "b"])
+                # blocking gets were sent on a connection checked out
+                self.assertEqual(await client.connected_clients(), 2)
+                self.assertIs(await client.reset(10), True)
+                self.assertEqual(await client.realtime_maxsize(), 10)
+
+        with svr.helper():
+            run(main())
+
+    def test_concurrent_coroutines(self):
+        svr, port = new_svr()
+
+        async def main():
+            async with AsyncWuKongQueueClient(
+                    host=host, port=port, log_level=logging.FATAL,
+                    max_connections=2) as client:
+                await asyncio.gather(*[client.put(i) for i in range(1000)])
+                self.assertEqual(await client.realtime_qsize(), 1000)
+                items = await asyncio.gather(
+                    *[client.get() for _ in range(1000)]
+                )
+                self.assertEqual(sorted(items), list(range(1000)))
+                self.assertLessEqual(
+                    len(client.connection_pool._connections), 2
+                )
+
+        with svr.helper():
+            run(main())
+
+    def test_bounded_connections(self):
+        svr, port = new_svr()
+
+        async def main():
+            async with AsyncWuKongQueueClient(
+                    host=host, port=port, log_level=logging.FATAL) as client:
+                max_connections = client.connection_pool.max_connections
+                self.assertGreater(max_connections, 0)
+                await asyncio.gather(*[client.put(i) for i in range(1000)])
+                self.assertLessEqual(
+                    len(client.connection_pool._connections), max_connections
+                )
+                self.assertLessEqual(svr.connected_clients(), max_connections)
+
+            async with AsyncWuKongQueueClient(
+                    host=host, port=port, log_level=logging.FATAL,
+                    max_connections=1) as client:
+                await client.get_many(1000)
+                # parked getters never delay puts sharing a connection
+                getters = [asyncio.ensure_future(client.get(timeout=5))
+                           for _ in range(2)]
+                await asyncio.sleep(0.1)
+                await asyncio.wait_for(client.put("a"), 1)
+                await asyncio.wait_for(client.put("b"), 1)
+                self.assertEqual(sorted(await asyncio.gather(*getters)),
+                                 ["a", "b"])
+                self.assertLessEqual(svr.connected_clients(), 2)
+
+        with svr.helper():
+            run(main())
+
+    def test_auth(self):
+        svr, port = new_svr(auth="123")
+
+        async def main():
+            client = AsyncWuKongQueueClient(
+                host=host, port=port, log_level=logging.FATAL,
+                auth_key="1234")
+            with self.assertRaises(AuthenticationError):
+                await client.put("1")
+            client.close()
+
+            async with AsyncWuKongQueueClient(
+                    host=host, port=port, log_level=logging.FATAL,
+                    auth_key="123") as client:
+                await client.put("1")
+                self.assertEqual(await client.get(), "1")
+
+        with svr.helper():
+            run(main())
+
+    def test_task_done_join(self):
+        svr, port = new_svr()
+
+        async def main():
+            async with AsyncWuKongQueueClient(
+                    host=host, port=port, log_level=logging.FATAL) as client:
+                with self.assertRaises(ValueError):
+                    await client.task_done()
+                await client.put("1")
+                await client.get()
+                await client.task_done()
+                await client.join()
+
+        with svr.helper():
+            run(main())
+
+    def test_subscribe(self):
+        svr, port = new_svr()
+
+        async def main():
+            async with AsyncWuKongQueueClient(
+                    host=host, port=port, log_level=logging.FATAL) as client:
+                await client.put_many(range(5))
+                async with await client.subscribe(prefetch=2) as sub:
+                    got = []
+                    async for item in sub:
+                        got.append(item)
+                        if len(got) == 5:
+                            break
+                    self.assertEqual(got, [0, 1, 2, 3, 4])
+                    with self.assertRaises(Empty):
+                        await sub.get(timeout=0.1)
+                    await client.put("5")
+                    self.assertEqual(await sub.get(timeout=5), "5")
+                sub = await client.subscribe(prefetch=2, auto_ack=False)
+                await client.put_many(["6", "7"])
+                self.assertEqual(await sub.get(timeout=5), "6")
+                sub.close()
+                await asyncio.sleep(0.1)
+                # items not acked are put back once closed
+                self.assertEqual(await client.get_many(2), ["6", "7"])
+                for _ in range(2):
+                    await client.task_done()
+                await client.join()
+
+        with svr.helper():
+            run(main())
+
+    def test_disconnected(self):
+        svr, port = new_svr()
+
+        async def main():
+            client = AsyncWuKongQueueClient(
+                host=host, port=port, log_level=logging.FATAL,
+                silence_err=True)
+            self.assertIs(await client.connected(), True)
+            # requests in flight are resolved when disconnected
+            getter = asyncio.ensure_future(client.get())
+            await asyncio.sleep(0.1)
+            svr.close()
+            self.assertIs(await getter, None)
+            client.close()
+
+        run(main())
+
+
+if __name__ == "__main__":
+    import unittest
+
+    unittest.main()
@@ -0,0 +1,353 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import logging
+import sys
+import threading
+import time
+from unittest import TestCase
+
+sys.path.append("../")
+try:
+    from wukongqueue.wukongqueue import *
+except ImportError:
+    from wukongqueue import *
+
+host = "127.0.0.1"
+default_port = 10300
+
+
+def new_svr(host=host, port=default_port, auth=None, max_size=0,
+            max_clients=0, **kwargs):
+    p = port
+    while 1:
+        try:
+            return AsyncWuKongQueue(
+                host=host, port=p, maxsize=max_size, max_clients=max_clients,
+                log_level=logging.FATAL, auth_key=auth, **kwargs
+            ), p
+        except OSError as e:
+            if 'already' in str(e.args) or '只允许使用一次' in str(e.args):
+                if p >= 65535:
+                    raise e
+                p += 1
+            else:
+                raise e
+
+
+def new_client(port, **kwargs):
+    return WuKongQueueClient(host=host, port=port, log_level=logging.FATAL,
+                             **kwargs)
+
+
+class AsyncServerTests(TestCase):
+    def test_basic_method(self):
+        svr, port = new_svr(max_size=2)
+        with svr.helper():
+            with new_client(port).helper() as h:
+                client = h.inst
+                self.assertIs(client.connected(), True)
+                self.assertIs(client.empty(), True)
+                client.put("1")
+                client.put(b"2")
+                self.assertIs(client.full(), True)
+                self.assertRaises(Full, client.put, "3", block=False)
+                self.assertEqual(svr.get(), "1")
+                self.assertEqual(client.get(), b"2")
+                self.assertRaises(Empty, client.get, block=False)
+                self.assertEqual(client.put_many(["a", "b", "c"],
+                                                 block=False), 2)
+                self.assertEqual(client.get_many(5), ["a", "b"])
+                self.assertEqual(client.connected_clients(), 1)
+                self.assertIs(client.reset(10), True)
+                self.assertEqual(client.realtime_maxsize(), 10)
+
+    def test_blocking_get_put(self):
+        svr, port = new_svr(max_size=1)
+        with svr.helper():
+            client = new_client(port)
+            with client.helper():
+                start = time.time()
+                self.assertRaises(Empty, client.get, timeout=0.5)
+                self.assertGreaterEqual(time.time() - start, 0.5)
+                client.put("1")
+                self.assertRaises(Full, client.put, "2", timeout=0.5)
+
+                # a parked getter is woken by put of server side
+                svr.get()
+                new_thread(lambda: (time.sleep(0.2), svr.put("3")))
+                self.assertEqual(client.get(timeout=3), "3")
+
+                # a parked putter is woken by get of another client
+                client.put("4")
+                other = new_client(port)
+                with other.helper():
+                    new_thread(lambda: (time.sleep(0.2), other.get()))
+                    client.put("5", timeout=3)
+                    self.assertEqual(other.get(), "5")
+
+    def test_many_clients_share_loop(self):
+        svr, port = new_svr()
+        with svr.helper():
+            getters = [new_client(port) for _ in range(50)]
+            got = []
+            for client in getters:
+                new_thread(lambda c=client: got.append(c.get()))
+            time.sleep(0.2)
+            with new_client(port).helper() as h:
+                self.assertEqual(h.inst.put_many(list(range(50))), 50)
+            for _ in range(50):
+                if len(got) == 50:
+                    break
+                time.sleep(0.1)
+            self.assertEqual(sorted(got), list(range(50)))
+            for client in getters:
+                client.close()
+
+    def test_task_done_join(self):
+        svr, port = new_svr()
+        with svr.helper():
+            client = new_client(port)
+            with client.helper():
+                client.put("1")
+                joined = []
+                joiner = new_client(port)
+                new_thread(lambda: (joiner.join(), joined.append(1)))
+                time.sleep(0.2)
+                self.assertEqual(joined, [])
+                client.get()
+                client.task_done()
+                time.sleep(0.2)
+                self.assertEqual(joined, [1])
+                self.assertRaises(ValueError, client.task_done)
+                joiner.close()
+
+    def test_auth_and_max_clients(self):
+        svr, port = new_svr(auth="123", max_clients=1)
+        with svr.helper():
+            with new_client(port, auth_key="1234").helper() as h:
+                self.assertRaises(AuthenticationError, h.inst.put, "1")
+            client = new_client(port, auth_key="123")
+            with client.helper():
+                self.assertIs(client.connected(), True)
+                with new_client(port, auth_key="123").helper() as h:
+                    self.assertRaises(ConnectionError, h.inst.put, "1")
+
+    def test_async_client(self):
+        svr, port = new_svr()
+
+        async def main():
+            async with AsyncWuKongQueueClient(
+                    host=host, port=port, log_level=logging.FATAL,
+                    max_connections=2) as client:
+                await asyncio.gather(*[client.put(i) for i in range(100)])
+                items = await asyncio.gather(
+                    *[client.get() for _ in range(100)]
+                )
+                self.assertEqual(sorted(items), list(range(100)))
+
+        with svr.helper():
+            asyncio.new_event_loop().run_until_complete(main())
+
+    def test_close(self):
+        svr, port = new_svr()
+        client = new_client(port, silence_err=True)
+        with client.helper():
+            self.assertIs(client.connected(), True)
+            # a parked getter is disconnected too
+            getter = new_client(port, silence_err=True)
+            got = []
+            new_thread(lambda: got.append(getter.get()))
+            time.sleep(0.2)
+            svr.close()
+            self.assertIs(client.connected(), False)
+            time.sleep(0.2)
+            self.assertEqual(got, [None])
+            getter.close()
+
+            svr.run()
+            with new_client(port).helper() as h:
+                self.assertIs(h.inst.connected(), True)
+            svr.close()
+
+
+    def test_priority_mode(self):
+        svr, port = new_svr(mode="priority")
+        with svr.helper():
+            with new_client(port).helper() as h:
+                client = h.inst
+                client.put("1", priority=1)
+                client.put_many(["2", "3"], priority=0)
+                self.assertEqual(client.get(), "2")
+                self.assertEqual(client.get_many(2), ["3", "1"])
+
+
+    def test_ring_mode(self):
+        svr, port = new_svr(max_size=2, mode="ring")
+        with svr.helper():
+            with new_client(port).helper() as h:
+                client = h.inst
+                for i in range(4):
+                    client.put(i, timeout=0.1)
+                self.assertEqual(svr.dropped, 2)
+                self.assertEqual(client.get_many(5), [2, 3])
+
+    def test_delayed_items(self):
+        svr, port = new_svr()
+        with svr.helper():
+            with new_client(port).helper() as h:
+                client = h.inst
+                start = time.monotonic()
+                client.put_many(["2", "3"], delay=0.2)
+                client.put("1", not_before=time.time() + 0.1)
+                self.assertIs(client.empty(), True)
+                # parked getters wake up when items are due
+                self.assertEqual(client.get(), "1")
+                self.assertGreaterEqual(time.monotonic() - start, 0.1)
+                self.assertEqual(client.get_many(5), ["2", "3"])
+                svr.put("4", delay=0.1)
+                self.assertRaises(Empty, client.get, timeout=0.01)
+                self.assertEqual(client.get(timeout=1), "4")
+
+    def test_ttl(self):
+        svr, port = new_svr(ttl=0.05)
+
+        async def run():
+            async with AsyncWuKongQueueClient(
+                    host=host, port=port, log_level=logging.FATAL) as client:
+                await client.put_many(["1", "2"])
+                await client.put("3", ttl=60)
+                await asyncio.sleep(0.1)
+                self.assertEqual(await client.get_many(5), ["3"])
+                await client.task_done()
+                # no unfinished tasks left
+                await asyncio.wait_for(client.join(), 1)
+                self.assertEqual((await client.stats())["expired"], 2)
+
+        with svr.helper():
+            asyncio.new_event_loop().run_until_complete(run())
+
+    def test_lease(self):
+        svr, port = new_svr(visibility_timeout=0.1)
+
+        async def run():
+            async with AsyncWuKongQueueClient(
+                    host=host, port=port, log_level=logging.FATAL) as client:
+                await client.put_many(["1", "2"])
+                r1, _ = await client.lease()
+                r2, _ = await client.lease(visibility_timeout=60)
+                # parked getters wake up when the lease times out
+                self.assertEqual(await client.get(timeout=1), "1")
+                await client.nack(r2)
+                receipt, item = await client.lease()
+                self.assertEqual(item, "2")
+                await client.ack(receipt)
+                with self.assertRaises(InvalidReceipt):
+                    await client.ack(r1)
+                self.assertEqual(svr.unfinished_tasks, 1)
+
+        with svr.helper():
+            asyncio.new_event_loop().run_until_complete(run())
+
+    def test_disconnect(self):
+        svr, port = new_svr(on_disconnect="requeue")
+        with svr.helper():
+            svr.put_many(["1", "2", "3"])
+            with new_client(port).helper() as h:
+                client = h.inst
+                self.assertEqual(client.get_many(2), ["1", "2"])
+                client.lease()
+                client.task_done()
+                waiter = new_client(port)
+                # a parked getter gets the items requeued
+                got = []
+                t = threading.Thread(
+                    target=lambda: got.append(waiter.get_many(5, timeout=5)))
+                t.start()
+                time.sleep(0.1)
+            t.join()
+            self.assertEqual(sorted(got[0]), ["2", "3"])
+            self.assertEqual(svr.unfinished_tasks, 2)
+            waiter.close()
+
+    def test_named_queues(self):
+        svr, port = new_svr(queues={"jobs": {"mode": "lifo"}})
+        with svr.helper():
+            jobs = new_client(port, queue="jobs")
+            # a parked getter is woken by items put to its queue only
+            got = []
+            t = threading.Thread(
+                target=lambda: got.append(jobs.get_many(5, timeout=5)))
+            t.start()
+            time.sleep(0.1)
+            with new_client(port).helper() as h:
+                h.inst.put("default")
+            svr.queues["jobs"].put_many(["1", "2"])
+            t.join()
+            self.assertIn(got[0], (["1"], ["2", "1"]))
+            self.assertEqual(svr.get(), "default")
+
+            async def run():
+                async with AsyncWuKongQueueClient(
+                        host=host, port=port, log_level=logging.FATAL,
+                        queue="mails") as client:
+                    await client.put("a")
+                    self.assertEqual(await client.realtime_qsize(), 1)
+                    self.assertEqual(await client.get(), "a")
+
+            asyncio.new_event_loop().run_until_complete(run())
+            self.assertEqual(svr.queues["mails"].qsize(), 0)
+            jobs.close()
+
+    def test_topic(self):
+        svr, port = new_svr(mode="topic")
+        with svr.helper():
+            # parked getters of every group are woken by a put
+            clients = [new_client(port, group=group)
+                       for group in ("a", "a", "b")]
+            got = []
+            threads = [threading.Thread(
+                target=lambda c=c: got.append(c.get(timeout=5)))
+                for c in clients]
+            for t in threads:
+                t.start()
+            time.sleep(0.1)
+            svr.put_many(["1", "2"])
+            for t in threads:
+                t.join()
+            self.assertEqual(sorted(got), ["1", "1", "2"])
+            self.assertEqual(svr.stats()["groups"]["b"],
+                             {"lag": 1, "read": 1})
+            svr.remove_group("b")
+            svr.join()
+            for c in clients:
+                c.close()
+
+    def test_subscribe(self):
+        svr, port = new_svr()
+        with svr.helper():
+            client = new_client(port)
+            sub = client.subscribe(prefetch=3, auto_ack=False)
+            self.assertRaises(Empty, sub.get, timeout=0.1)
+            # pushed as soon as put
+            svr.put_many(range(5))
+            self.assertEqual([sub.get(timeout=5) for _ in range(3)],
+                             [0, 1, 2])
+            self.assertRaises(Empty, sub.get, block=False)
+            sub.ack(2)
+            self.assertEqual(sub.get(timeout=5), 3)
+            sub.close()
+            time.sleep(0.1)
+            # items not acked are put back
+            self.assertEqual(svr.qsize(), 3)
+            self.assertEqual(svr.unfinished_tasks, 3)
+            self.assertEqual(client.get_many(5), [2, 3, 4])
+            for _ in range(3):
+                client.task_done()
+            svr.join()
+            client.close()
+
+
+if __name__ == "__main__":
+    import unittest
+
+    unittest.main()
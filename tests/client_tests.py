@@ -279,6 +279,60 @@ class ClientTests(TestCase):
                         break
                 self.assertEqual(test_item, recv_items)
 
+    def test_put_many_get_many(self):
+        svr, mport = new_svr(max_size=0, log_level=logging.WARNING)
+        with svr.helper():
+            with WuKongQueueClient(host=host, port=mport,
+                                   log_level=logging.WARNING) as client:
+                items = list(range(10000)) + [None, b"1"]
+                self.assertEqual(client.put_many(items), len(items))
+                self.assertEqual(client.realtime_qsize(), len(items))
+                self.assertEqual(client.get_many(10000), items[:10000])
+                self.assertEqual(client.get_many(10, convert_method=str),
+                                 ["None", "b'1'"])
+                self.assertRaises(Empty, client.get_many, 1, timeout=0.1)
+
+                client.reset(maxsize=2)
+                self.assertEqual(client.put_many(["1", "2", "3"],
+                                                 block=False), 2)
+                self.assertIs(client.full(), True)
+
+    def test_pipeline(self):
+        svr, mport = new_svr(max_size=0, log_level=logging.WARNING)
+        with svr.helper():
+            with WuKongQueueClient(host=host, port=mport,
+                                   log_level=logging.WARNING) as client:
+                pipe = client.pipeline()
+                pipe.put_many(range(100))
+                for _ in range(100):
+                    pipe.get_many(1)
+                self.assertEqual(pipe.execute(),
+                                 [100] + [[i] for i in range(100)])
+
+                client.reset(2)
+                with client.pipeline() as pipe:
+                    pipe.put("1").put("2").realtime_qsize()
+                    pipe.put("3", block=False)
+                    pipe.get(convert_method=int).get_many(5)
+                    pipe.get(block=False)
+                    pipe.task_done()
+                    self.assertEqual(len(pipe), 8)
+                    results = pipe.execute(raise_on_error=False)
+                    self.assertEqual(len(pipe), 0)
+                self.assertEqual(results[:3], [None, None, 2])
+                self.assertIsInstance(results[3], Full)
+                self.assertEqual(results[4:6], [1, ["2"]])
+                self.assertIsInstance(results[6], Empty)
+                self.assertIs(results[7], None)
+
+                pipe = client.pipeline()
+                pipe.get(block=False).put("1")
+                self.assertRaises(Empty, pipe.execute)
+                # commands after the failed one were still executed
+                self.assertEqual(client.realtime_qsize(), 1)
+                self.assertEqual(pipe.execute(), [])
+
+
 
 if __name__ == "__main__":
     import unittest
@@ -0,0 +1,230 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import logging
+import sys
+from unittest import TestCase, main, skipUnless
+
+sys.path.append("../")
+try:
+    from wukongqueue.wukongqueue import *
+    from wukongqueue.wukongqueue import serializer
+    from wukongqueue.wukongqueue._item_wrapper import item_wrapper, item_unwrap
+    from wukongqueue.wukongqueue._item_wrapper import item_wrapper_parts
+except ImportError:
+    from wukongqueue import *
+    from wukongqueue import serializer
+    from wukongqueue._item_wrapper import item_wrapper, item_unwrap
+    from wukongqueue._item_wrapper import item_wrapper_parts
+
+host = "127.0.0.1"
+default_port = 10600
+
+
+def new_svr(port=default_port):
+    p = port
+    while 1:
+        try:
+            return WuKongQueue(host=host, port=p, log_level=logging.FATAL), p
+        except OSError as e:
+            if 'already' in str(e.args) or '只允许使用一次' in str(e.args):
+                if p >= 65535:
+                    raise e
+                p += 1
+            else:
+                raise e
+
+
+def new_client(port, **kwargs):
+    return WuKongQueueClient(host=host, port=port, log_level=logging.FATAL,
+                             **kwargs)
+
+
+class UpperSerializer(Serializer):
+    name = "upper"
+    codec_id = 100
+
+    def dumps(self, item) -> bytes:
+        return item.upper().encode()
+
+    def loads(self, payload):
+        return bytes(payload).decode()
+
+
+class SerializerTests(TestCase):
+    def test_codecs(self):
+        cases = {
+            "pickle": [None, b"1", "2", (3,), {"4": [4.0]}, {5}],
+            "bytes": [b"", b"1", bytearray(b"2"), memoryview(b"3")],
+            "json": [None, "1", 2, [3.0, True], {"4": {"5": None}}],
+            "marshal": [None, b"1", "2", (3,), {"4": [4.0]}, {5}],
+        }
+        for name, items in cases.items():
+            s = serializer.get_serializer(name)
+            for item in items:
+                data = item_wrapper(item, s)
+                got = item_unwrap(data)
+                self.assertEqual(got, bytes(item) if name == "bytes" else item)
+                # decoded from a memoryview like the wire protocol does
+                self.assertEqual(item_unwrap(memoryview(data)), got)
+
+        # items of old versions are plain pickles
+        import pickle
+        self.assertEqual(item_unwrap(pickle.dumps([1], protocol=2)), [1])
+        self.assertRaises(NotYetSupportType, item_wrapper, "1",
+                          serializer.get_serializer("bytes"))
+        self.assertRaises(ValueError, item_unwrap, b"\x7f123")
+        self.assertRaises(ValueError, serializer.get_serializer, "yaml")
+
+    def test_register(self):
+        s = UpperSerializer()
+        register_serializer(s)
+        self.assertIn("upper", serializer.serializers())
+        self.assertEqual(item_unwrap(item_wrapper("abc", s)), "ABC")
+        # name and codec id are unique
+        self.assertRaises(ValueError, register_serializer, s)
+        bad = UpperSerializer()
+        bad.name, bad.codec_id = "bad", serializer.JsonSerializer.codec_id
+        self.assertRaises(ValueError, register_serializer, bad)
+
+    @skipUnless("msgpack" in serializer.serializers(), "msgpack missing")
+    def test_msgpack(self):
+        s = serializer.get_serializer("msgpack")
+        for item in [None, b"1", "2", [3], {"4": 4.0}]:
+            self.assertEqual(item_unwrap(item_wrapper(item, s)), item)
+
+    def test_mixed_clients(self):
+        svr, port = new_svr()
+        with svr.helper():
+            producers = [new_client(port, serializer=name)
+                         for name in ("json", "bytes", "marshal")]
+            consumer = new_client(port)
+            producers[0].put({"1": [1]})
+            producers[1].put(b"2")
+            producers[2].put_many([(3,), 4])
+            with producers[0].pipeline() as pipe:
+                pipe.put("5").put_many([6])
+                pipe.execute()
+            self.assertEqual(consumer.get(), {"1": [1]})
+            self.assertEqual(svr.get(), b"2")
+            self.assertEqual(consumer.get_many(10), [(3,), 4, "5", 6])
+            self.assertRaises(NotYetSupportType, producers[1].put, "x")
+            for c in producers + [consumer]:
+                c.close()
+
+    def test_async_client(self):
+        svr, port = new_svr()
+
+        async def run():
+            async with AsyncWuKongQueueClient(
+                    host=host, port=port, log_level=logging.FATAL,
+                    serializer="json") as client:
+                await client.put([1, "2"])
+                await client.put_many([{"3": 3}])
+                self.assertEqual(await client.get_many(2),
+                                 [[1, "2"], {"3": 3}])
+
+        with svr.helper():
+            asyncio.new_event_loop().run_until_complete(run())
+
+    def test_compression(self):
+        blob = [{"id": i, "name": "wukong", "tags": ["a", "b"]}
+                for i in range(1000)]
+        for name in serializer.compressors():
+            c = serializer.get_compressor(name)
+            data = item_wrapper(blob, compressor=c, compress_threshold=1024)
+            self.assertEqual(data[0], c.codec_id)
+            self.assertLess(len(data) * 3, len(item_wrapper(blob)))
+            self.assertEqual(item_unwrap(data), blob)
+            self.assertEqual(item_unwrap(memoryview(data)), blob)
+
+        c = serializer.get_compressor("zlib")
+        # below threshold, or not smaller if compressed
+        self.assertEqual(item_wrapper("1", compressor=c), item_wrapper("1"))
+        import os
+        noise = os.urandom(4096)
+        self.assertEqual(item_wrapper(noise, compressor=c),
+                         item_wrapper(noise))
+        self.assertIs(serializer.get_compressor(None), None)
+        self.assertRaises(ValueError, serializer.get_compressor, "rar")
+
+    def test_compressed_items_on_server(self):
+        blob = ["wukong" * 1000, {"1": "queue" * 1000}]
+        svr, port = new_svr()
+        with svr.helper():
+            producer = new_client(port, serializer="json",
+                                  compression="zlib", compress_threshold=100)
+            consumer = new_client(port)
+            producer.put(blob[0])
+            producer.put_many(blob[1:] + ["small"])
+            # stored compressed, never decompressed by server
+            sizes = [len(item) for item in svr.queue]
+            self.assertLess(sizes[0] * 10, len(blob[0]))
+            self.assertEqual(svr.queue[1][0],
+                             serializer.ZlibCompressor.codec_id)
+            self.assertEqual(svr.queue[2][0],
+                             serializer.JsonSerializer.codec_id)
+            self.assertEqual(consumer.get(), blob[0])
+            self.assertEqual(consumer.get_many(5), blob[1:] + ["small"])
+            producer.close()
+            consumer.close()
+
+    def test_out_of_band(self):
+        big = bytearray(b"1" * 100000)
+        for item in [big, bytes(big), memoryview(big), {"1": bytes(big)}]:
+            parts = item_wrapper_parts(item)
+            if isinstance(item, dict):
+                # only items themselves are out-of-band, pickle copies
+                # bytes within items
+                self.assertEqual(len(parts), 1)
+            else:
+                self.assertEqual(parts[0][0], serializer.OUT_OF_BAND_CODEC_ID)
+                # the buffer of item is sent as it is
+                self.assertEqual(len(parts), 3)
+                self.assertTrue(parts[2].obj is item)
+            got = item_unwrap(item_wrapper(item))
+            self.assertIs(type(got), type(item))
+            self.assertEqual(bytes(got) if isinstance(got, memoryview)
+                             else got, bytes(big) if isinstance(
+                                 item, memoryview) else item)
+
+        # loaded from bytes without copying
+        got = item_unwrap(item_wrapper(memoryview(big)))
+        self.assertIsInstance(got.obj, bytes)
+        # a small buffer in a bytearray may be reused by next msg
+        data = bytearray(item_wrapper(memoryview(big)))
+        got = item_unwrap(memoryview(data))
+        data[-1:] = b"2"
+        self.assertEqual(bytes(got), bytes(big))
+
+        small = item_wrapper_parts(bytes(100))
+        self.assertEqual(len(small), 1)
+        no_oob = serializer.PickleSerializer(oob_threshold=None)
+        self.assertEqual(len(item_wrapper_parts(big, no_oob)), 1)
+
+    def test_out_of_band_on_server(self):
+        big = bytearray(b"1" * (5 * 1024 * 1024))
+        svr, port = new_svr()
+        with svr.helper():
+            client = new_client(port)
+            client.put(big)
+            client.put_many([memoryview(big), bytes(200000)])
+            self.assertEqual(svr.queue[0][0], serializer.OUT_OF_BAND_CODEC_ID)
+            self.assertEqual(client.get(), big)
+            self.assertEqual([bytes(i) for i in client.get_many(2)],
+                             [bytes(big), bytes(200000)])
+            svr.put(big)
+            self.assertEqual(client.get(), big)
+            client.close()
+
+            async def run():
+                async with AsyncWuKongQueueClient(
+                        host=host, port=port,
+                        log_level=logging.FATAL) as c:
+                    await c.put(big)
+                    self.assertEqual(await c.get(), big)
+
+            asyncio.new_event_loop().run_until_complete(run())
+
+
+if __name__ == "__main__":
+    main()
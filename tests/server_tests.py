@@ -1,5 +1,7 @@
 # -*- coding: utf-8 -*-
 import logging
+import threading
+import time
 import sys
 from unittest import TestCase, main
 
@@ -15,14 +17,15 @@ default_port = 10000
 
 
 def new_svr(host=host, port=default_port, auth=None, log_level=logging.DEBUG,
-            dont_change_port=False, max_size=max_size, max_clients=0):
+            dont_change_port=False, max_size=max_size, max_clients=0,
+            **kwargs):
     p = port
     while 1:
         try:
             return WuKongQueue(
                 host=host, port=p, maxsize=max_size, max_clients=max_clients,
                 log_level=log_level,
-                auth_key=auth
+                auth_key=auth, **kwargs
             ), p
         except OSError as e:
             if 'already' in str(e.args) or '只允许使用一次' in str(e.args):
@@ -96,6 +99,35 @@ class ServerTests(TestCase):
             self.assertRaises(OSError, new_svr, dont_change_port=True,
                               port=port)
 
+    def test_rerun_and_acceptors(self):
+        svr, mport = new_svr(log_level=logging.FATAL)
+        client = WuKongQueueClient(host=host, port=mport, silence_err=True,
+                                   log_level=logging.FATAL)
+        with client.helper():
+            client.put("1")
+            svr.close()
+            self.assertIs(client.connected(), False)
+            # connections of last run don't hold the port
+            svr.run()
+            with WuKongQueueClient(host=host, port=mport,
+                                   log_level=logging.FATAL) as client2:
+                self.assertIs(client2.connected(), True)
+            svr.close()
+
+        svr, mport = new_svr(log_level=logging.FATAL, acceptors=4,
+                             backlog=256, max_size=0)
+        with svr.helper():
+            self.assertEqual(len(svr._tcp_svrs), 4)
+            clients = [WuKongQueueClient(host=host, port=mport,
+                                         log_level=logging.FATAL)
+                       for _ in range(20)]
+            for i, client in enumerate(clients):
+                client.put(i)
+            self.assertEqual(svr.connected_clients(), 20)
+            self.assertEqual(sorted(svr.get_many(20)), list(range(20)))
+            for client in clients:
+                client.close()
+
     def test_max_clients(self):
         svr, mport = new_svr(max_clients=1,
                              log_level=logging.WARNING)
@@ -119,6 +151,38 @@ class ServerTests(TestCase):
                                            log_level=logging.WARNING):
                         pass
 
+    def test_handshake_off_accept_loop(self):
+        import socket
+        import time
+        svr, mport = new_svr(auth="123", log_level=logging.FATAL,
+                             socket_connect_timeout=5,
+                             max_pending_handshakes=2)
+        with svr.helper():
+            # a silent client never authenticates
+            slow = socket.create_connection((host, mport))
+            time.sleep(0.1)
+            start = time.time()
+            with WuKongQueueClient(host=host, port=mport, auth_key="123",
+                                   log_level=logging.FATAL) as client:
+                client.put("1")
+            self.assertLess(time.time() - start, 1)
+
+            slow2 = socket.create_connection((host, mport))
+            time.sleep(0.1)
+            # pending handshakes reach the limit
+            with WuKongQueueClient(host=host, port=mport, auth_key="123",
+                                   log_level=logging.FATAL) as client:
+                self.assertRaises(ConnectionError, client.put, "1")
+            stats = svr.handshake_stats()
+            self.assertEqual(stats["pending"], 2)
+            self.assertEqual(stats["completed"], 1)
+            self.assertEqual(stats["rejected"], 1)
+            self.assertGreater(stats["max_latency"], 0)
+            slow.close()
+            slow2.close()
+            time.sleep(0.1)
+            self.assertEqual(svr.handshake_stats()["failed"], 2)
+
     def test_join(self):
         join = False
         import time
@@ -142,6 +206,497 @@ class ServerTests(TestCase):
             self.assertIs(join, True)
             self.assertRaises(ValueError, svr.task_done)
 
+    def test_put_many_get_many(self):
+        svr, mport = new_svr(log_level=logging.WARNING, max_size=3)
+        with svr.helper():
+            self.assertEqual(svr.put_many(["1", "2", "3", "4"], block=False),
+                             3)
+            self.assertEqual(svr.put_many(["4"], timeout=0.1), 0)
+            self.assertEqual(svr.get_many(2), ["1", "2"])
+            self.assertEqual(svr.get_many(5, convert_method=int), [3])
+            self.assertRaises(Empty, svr.get_many, 1, block=False)
+            self.assertRaises(ValueError, svr.get_many, 0)
+
+            # producer blocks until consumer frees slots
+            def consume():
+                time.sleep(0.2)
+                svr.get_many(3)
+
+            new_thread(consume)
+            self.assertEqual(svr.put_many(range(5), timeout=2), 5)
+            self.assertEqual(svr.get_many(5), [3, 4])
+            self.assertEqual(svr.unfinished_tasks, 8)
+
+    def test_opaque_items(self):
+        from wukongqueue._item_wrapper import Serialized
+
+        svr, mport = new_svr(log_level=logging.WARNING, max_size=0)
+        with svr.helper():
+            with WuKongQueueClient(host=host, port=mport,
+                                   log_level=logging.WARNING) as client:
+                client.put({"1": [1]})
+                self.assertEqual(client.put_many([b"2", "3", 4]), 3)
+                # items of clients are stored as received
+                self.assertTrue(all(isinstance(i, Serialized)
+                                    for i in svr.queue))
+                self.assertEqual(svr.get(), {"1": [1]})
+                svr.put(5)
+                self.assertEqual(client.get(), b"2")
+                self.assertEqual(client.get_many(5), ["3", 4, 5])
+
+                client.put_many([[6], 7])
+                self.assertEqual(svr.get_many(5), [[6], 7])
+
+
+    def test_priority_mode(self):
+        svr, mport = new_svr(log_level=logging.WARNING, max_size=0,
+                             mode="priority")
+        with svr.helper():
+            svr.put("bulk1")
+            svr.put("urgent1", priority=-1)
+            svr.put("bulk2")
+            self.assertEqual(svr.put_many(["low1", "low2"], priority=5), 2)
+            with WuKongQueueClient(host=host, port=mport,
+                                   log_level=logging.WARNING) as client:
+                client.put("urgent2", priority=-1)
+                self.assertEqual(client.put_many(["low3"], priority=5), 1)
+                with client.pipeline() as pipe:
+                    pipe.put("top", priority=-9).execute()
+                self.assertEqual(client.get(), "top")
+                # same priority in order of put
+                self.assertEqual(svr.get_many(3),
+                                 ["urgent1", "urgent2", "bulk1"])
+                self.assertEqual(client.get_many(5),
+                                 ["bulk2", "low1", "low2", "low3"])
+
+        self.assertRaises(ValueError, new_svr, mode="stack")
+        import tempfile
+        with tempfile.TemporaryDirectory() as d:
+            self.assertRaises(ValueError, new_svr, mode="priority",
+                              persist_dir=d)
+
+    def test_priority_requeue(self):
+        svr, mport = new_svr(log_level=logging.WARNING, max_size=0,
+                             mode="priority", visibility_timeout=0.1,
+                             on_disconnect="requeue")
+        with svr.helper():
+            svr.put_many(["bulk1", "bulk2"])
+            svr.put("urgent", priority=-1)
+            with WuKongQueueClient(host=host, port=mport,
+                                   log_level=logging.WARNING) as client:
+                # nacked, the item keeps its priority
+                receipt, item = client.lease()
+                self.assertEqual(item, "urgent")
+                client.nack(receipt)
+                # timed out
+                self.assertEqual(client.lease()[1], "urgent")
+                time.sleep(0.2)
+                self.assertEqual(client.lease(visibility_timeout=60)[1],
+                                 "urgent")
+                self.assertEqual(svr.lease_timeouts, 1)
+            # the lease of the lost connection is nacked
+            self.wait_clients(svr, 0)
+
+            svr.put("urgent2", priority=-1)
+            getter = WuKongQueueClient(host=host, port=mport,
+                                       log_level=logging.WARNING)
+            self.assertEqual(getter.get_many(3), ["urgent", "urgent2", "bulk1"])
+            getter.close()
+            self.wait_clients(svr, 0)
+            # items requeued once the connection is lost are got first again
+            svr.put("urgent3", priority=-2)
+            subscriber = WuKongQueueClient(host=host, port=mport,
+                                           log_level=logging.WARNING)
+            with subscriber.subscribe(prefetch=1, auto_ack=False) as sub:
+                self.assertEqual(next(iter(sub)), "urgent3")
+            subscriber.close()
+            self.wait_clients(svr, 0)
+            self.assertEqual(svr.get(), "urgent3")
+            svr.put("bulk3")
+            self.assertEqual(svr.get_many(5),
+                             ["urgent", "urgent2", "bulk2", "bulk1", "bulk3"])
+
+
+    def test_lifo_and_ring_modes(self):
+        svr, mport = new_svr(log_level=logging.WARNING, max_size=0,
+                             mode="lifo")
+        with svr.helper():
+            with WuKongQueueClient(host=host, port=mport,
+                                   log_level=logging.WARNING) as client:
+                client.put("1")
+                client.put_many(["2", "3"])
+                self.assertEqual(client.get(), "3")
+                svr.put("4")
+                self.assertEqual(client.get_many(5), ["4", "2", "1"])
+
+        svr, mport = new_svr(log_level=logging.WARNING, max_size=3,
+                             mode="ring")
+        with svr.helper():
+            with WuKongQueueClient(host=host, port=mport,
+                                   log_level=logging.WARNING) as client:
+                for i in range(5):
+                    # never blocks or raises Full
+                    client.put(i, block=False)
+                self.assertEqual(svr.dropped, 2)
+                self.assertIs(client.full(), True)
+                self.assertEqual(client.get(), 2)
+                self.assertEqual(client.put_many(range(5, 10)), 5)
+                self.assertEqual(svr.dropped, 6)
+                self.assertEqual(client.get_many(5), [7, 8, 9])
+                # dropped items are not unfinished tasks
+                self.assertEqual(svr.unfinished_tasks, 4)
+
+        self.assertRaises(ValueError, new_svr, mode="ring", max_size=0)
+
+    def test_delayed_items(self):
+        svr, mport = new_svr(log_level=logging.WARNING, max_size=1)
+        with svr.helper():
+            with WuKongQueueClient(host=host, port=mport,
+                                   log_level=logging.WARNING) as client:
+                start = time.monotonic()
+                client.put("later", delay=0.3)
+                # not counted by maxsize, never blocks
+                self.assertEqual(client.put_many(["1", "2"], delay=0.2), 2)
+                svr.put("soon", not_before=time.time() + 0.1)
+                client.put("now")
+                self.assertEqual(client.realtime_qsize(), 1)
+                self.assertEqual(svr.delayed_qsize(), 4)
+                self.assertEqual(client.get(), "now")
+                self.assertRaises(Empty, client.get, block=False)
+                # a blocking get wakes up when the item is due
+                self.assertEqual(client.get(), "soon")
+                self.assertGreaterEqual(time.monotonic() - start, 0.1)
+                self.assertRaises(Empty, client.get, timeout=0.01)
+                with client.pipeline() as pipe:
+                    pipe.put("0", delay=0.5).execute()
+                # moved into the queue even if it's full
+                time.sleep(0.3)
+                self.assertEqual(svr.qsize(), 3)
+                self.assertEqual(client.get_many(5), ["1", "2", "later"])
+                self.assertEqual(svr.get(), "0")
+                self.assertEqual(svr.unfinished_tasks, 6)
+
+                svr.put_many(range(3), delay=60)
+                svr.reset()
+                self.assertEqual(svr.delayed_qsize(), 0)
+
+    def test_ttl(self):
+        svr, mport = new_svr(log_level=logging.WARNING, max_size=0,
+                             ttl=0.2, reap_interval=0.05)
+        with svr.helper():
+            with WuKongQueueClient(host=host, port=mport,
+                                   log_level=logging.WARNING) as client:
+                client.put("short", ttl=0.05)
+                client.put_many(["1", "2"])
+                client.put("long", ttl=60)
+                svr.put("3", ttl=0.05)
+                time.sleep(0.1)
+                # expired items are skipped by getters
+                self.assertEqual(client.get(), "1")
+                self.assertEqual(client.get_many(5), ["2", "long"])
+                self.assertEqual(svr.expired, 2)
+
+                client.put_many(range(3))
+                with client.pipeline() as pipe:
+                    pipe.put("4", delay=0.3).stats()
+                    stats = pipe.execute()[1]
+                self.assertEqual(stats["qsize"], 3)
+                self.assertEqual(stats["delayed"], 1)
+                # reaped in background
+                time.sleep(0.3)
+                self.assertEqual(len(svr.queue), 0)
+                self.assertEqual(client.get(), "4")
+                stats = client.stats()
+                self.assertEqual(stats["expired"], 5)
+                self.assertEqual(stats["unfinished_tasks"], 4)
+                self.assertEqual(stats["clients"], 1)
+                for _ in range(4):
+                    client.task_done()
+                client.put("5", ttl=0.01)
+                # expired items are not unfinished tasks
+                client.join()
+
+    def test_timeout_with_expired_items(self):
+        svr, mport = new_svr(log_level=logging.WARNING, max_size=0,
+                             mode="topic", groups=["a", "b"])
+        with svr.helper():
+            svr.put("alive")
+            self.assertEqual(svr.get(group="a"), "alive")
+            stop = []
+
+            def put_expired():
+                while not stop:
+                    svr.put("expired", ttl=0)
+                    time.sleep(0.02)
+
+            t = threading.Thread(target=put_expired)
+            t.start()
+            # items expired behind the head are skipped, the timeout isn't
+            # restarted by them
+            start = time.monotonic()
+            self.assertRaises(Empty, svr.get, timeout=0.2, group="a")
+            self.assertLess(time.monotonic() - start, 0.5)
+            stop.append(1)
+            t.join()
+
+    def test_lease(self):
+        svr, mport = new_svr(log_level=logging.WARNING, max_size=0,
+                             visibility_timeout=0.2)
+        with svr.helper():
+            with WuKongQueueClient(host=host, port=mport,
+                                   log_level=logging.WARNING) as client:
+                client.put_many(["1", "2", "3"])
+                r1, item = client.lease()
+                self.assertEqual(item, "1")
+                r2, item = client.lease(visibility_timeout=60)
+                self.assertEqual(item, "2")
+                r3, item = svr.lease(convert_method=int)
+                self.assertEqual(item, 3)
+                self.assertEqual(svr.stats()["leased"], 3)
+                client.ack(r2)
+                svr.nack(r3)
+                self.assertRaises(InvalidReceipt, client.ack, r2)
+                self.assertEqual(svr.unfinished_tasks, 2)
+                self.assertEqual(client.get(), "3")
+                # a blocking get wakes up when the lease times out
+                start = time.monotonic()
+                self.assertEqual(client.get(timeout=1), "1")
+                self.assertGreaterEqual(time.monotonic() - start, 0.1)
+                self.assertRaises(InvalidReceipt, client.nack, r1)
+                self.assertEqual(svr.lease_timeouts, 1)
+
+                with client.pipeline() as pipe:
+                    pipe.put("4").lease()
+                    receipt, item = pipe.execute()[1]
+                    self.assertEqual(item, "4")
+                    pipe.ack(receipt).ack(receipt)
+                    self.assertIsInstance(
+                        pipe.execute(raise_on_error=False)[1], InvalidReceipt)
+                self.assertRaises(Empty, client.lease, block=False)
+
+    def wait_clients(self, svr, n):
+        for _ in range(100):
+            if svr.connected_clients() == n:
+                return
+            time.sleep(0.01)
+
+    def test_disconnect(self):
+        svr, mport = new_svr(log_level=logging.WARNING, max_size=0,
+                             on_disconnect="release")
+        with svr.helper():
+            svr.put_many(range(5))
+            consumer = WuKongQueueClient(host=host, port=mport,
+                                         log_level=logging.WARNING)
+            self.assertEqual(consumer.get_many(3), [0, 1, 2])
+            consumer.task_done()
+            consumer.lease()
+            consumer.close()
+            self.wait_clients(svr, 0)
+            # tasks of items got are released, the leased item is requeued
+            self.assertEqual(svr.unfinished_tasks, 2)
+            self.assertEqual(svr.get_many(5), [4, 3])
+            svr.task_done()
+            svr.task_done()
+            svr.join()
+
+        svr, mport = new_svr(log_level=logging.WARNING, max_size=0,
+                             on_disconnect="requeue")
+        with svr.helper():
+            svr.put_many(range(5))
+            consumer = WuKongQueueClient(host=host, port=mport,
+                                         log_level=logging.WARNING)
+            self.assertEqual(consumer.get_many(3), [0, 1, 2])
+            self.assertEqual(consumer.get(), 3)
+            # done for the earliest item got
+            consumer.task_done()
+            consumer.close()
+            self.wait_clients(svr, 0)
+            self.assertEqual(svr.get_many(5), [4, 1, 2, 3])
+            self.assertEqual(svr.unfinished_tasks, 4)
+
+        self.assertRaises(ValueError, new_svr, on_disconnect="retry")
+
+    def test_task_done_by_other_client(self):
+        for on_disconnect in ("release", "requeue"):
+            svr, mport = new_svr(log_level=logging.WARNING, max_size=0,
+                                 on_disconnect=on_disconnect)
+            with svr.helper():
+                svr.put_many(["x1", "x2"])
+                getter = WuKongQueueClient(host=host, port=mport,
+                                           log_level=logging.WARNING)
+                acker = WuKongQueueClient(host=host, port=mport,
+                                          log_level=logging.WARNING)
+                self.assertEqual(getter.get(), "x1")
+                # done for the item got by getter, it's not released or
+                # requeued again once getter is lost
+                acker.task_done()
+                getter.close()
+                self.wait_clients(svr, 1)
+                self.assertEqual(svr.unfinished_tasks, 1)
+                self.assertEqual(svr.qsize(), 1)
+                self.assertEqual(acker.get(), "x2")
+                acker.task_done()
+                svr.join()
+                acker.close()
+
+        # by default tasks of a lost connection are kept for task_done of
+        # other clients
+        svr, mport = new_svr(log_level=logging.WARNING, max_size=0)
+        with svr.helper():
+            svr.put("x")
+            getter = WuKongQueueClient(host=host, port=mport,
+                                       log_level=logging.WARNING)
+            acker = WuKongQueueClient(host=host, port=mport,
+                                      log_level=logging.WARNING)
+            self.assertEqual(getter.get(), "x")
+            getter.close()
+            self.wait_clients(svr, 1)
+            self.assertEqual(svr.unfinished_tasks, 1)
+            acker.task_done()
+            svr.join()
+            self.assertRaises(ValueError, acker.task_done)
+            acker.close()
+
+    def test_named_queues(self):
+        svr, mport = new_svr(log_level=logging.WARNING, max_size=0,
+                             queues={"jobs": {"maxsize": 1,
+                                              "on_disconnect": "release"}})
+        with svr.helper():
+            jobs = WuKongQueueClient(host=host, port=mport, queue="jobs",
+                                     log_level=logging.WARNING)
+            mails = WuKongQueueClient(host=host, port=mport, queue="mails",
+                                      log_level=logging.WARNING)
+            default = WuKongQueueClient(host=host, port=mport,
+                                        log_level=logging.WARNING)
+            jobs.put("job")
+            self.assertRaises(Full, jobs.put, "job2", block=False)
+            # created on demand
+            self.assertEqual(mails.put_many(["a", "b"]), 2)
+            default.put("c")
+            self.assertEqual(sorted(svr.queues), ["jobs", "mails"])
+            self.assertEqual(svr.queues["mails"].qsize(), 2)
+            self.assertEqual(svr.qsize(), 1)
+
+            with mails.pipeline() as pipe:
+                pipe.get().realtime_qsize()
+                self.assertEqual(pipe.execute(), ["a", 1])
+            self.assertEqual(jobs.get(), "job")
+            jobs.task_done()
+            jobs.join()
+            self.assertEqual(jobs.stats()["clients"], 3)
+            self.assertIs(svr.declare_queue("jobs"), svr.queues["jobs"])
+
+            # items got without task_done are released on the queue
+            # declared to, and kept on the one created with defaults
+            jobs.put("job2")
+            self.assertEqual(jobs.get(), "job2")
+            self.assertEqual(mails.get(), "b")
+            jobs.close()
+            mails.close()
+            self.wait_clients(svr, 1)
+            self.assertEqual(svr.queues["jobs"].unfinished_tasks, 0)
+            self.assertEqual(svr.queues["mails"].unfinished_tasks, 2)
+            self.assertEqual(svr.unfinished_tasks, 1)
+            default.close()
+        self.assertIs(svr.queues["jobs"].closed, True)
+
+        svr, mport = new_svr(log_level=logging.WARNING, create_queues=False)
+        with svr.helper():
+            client = WuKongQueueClient(host=host, port=mport, queue="jobs",
+                                       log_level=logging.WARNING)
+            self.assertRaises(UnknownQueue, client.put, "1")
+            with client.pipeline() as pipe:
+                pipe.put("1")
+                self.assertIsInstance(pipe.execute(raise_on_error=False)[0],
+                                      UnknownQueue)
+            self.assertEqual(svr.queues, {})
+            client.close()
+            self.assertRaises(ValueError, svr.declare_queue, "")
+
+    def test_topic(self):
+        svr, mport = new_svr(log_level=logging.WARNING, max_size=3,
+                             mode="topic", groups=["indexer", "auditor"])
+        with svr.helper():
+            indexer = WuKongQueueClient(host=host, port=mport,
+                                        group="indexer",
+                                        log_level=logging.WARNING)
+            auditor = WuKongQueueClient(host=host, port=mport,
+                                        group="auditor",
+                                        log_level=logging.WARNING)
+            self.assertEqual(svr.put_many(range(5), block=False), 3)
+            # every group reads all items, getters of a group compete
+            self.assertEqual(indexer.get(), 0)
+            self.assertEqual(indexer.get_many(5), [1, 2])
+            self.assertRaises(Empty, indexer.get, block=False)
+            self.assertEqual(svr.qsize(), 3)
+            self.assertRaises(Full, svr.put, 3, block=False)
+            self.assertEqual(auditor.get_many(2), [0, 1])
+            self.assertEqual(svr.stats()["groups"], {
+                "indexer": {"lag": 0, "read": 3},
+                "auditor": {"lag": 1, "read": 2},
+            })
+            svr.put(3)
+            self.assertEqual(auditor.get_many(5), [2, 3])
+            self.assertEqual(indexer.get(), 3)
+            svr.join()
+
+            # a new group starts at the oldest item kept
+            svr.put_many([4, 5])
+            self.assertEqual(svr.get_many(5, group="cache"), [4, 5])
+            self.assertEqual(svr.get(), 4)
+            self.assertEqual(auditor.stats()["groups"]["auditor"]["lag"], 2)
+            svr.remove_group("auditor")
+            svr.remove_group("indexer")
+            self.assertEqual(svr.qsize(), 1)
+            self.assertRaises(ValueError, indexer.task_done)
+            self.assertRaises(ValueError, indexer.lease)
+            indexer.close()
+            auditor.close()
+
+        self.assertRaises(ValueError, new_svr, mode="topic",
+                          persist_dir="wal")
+
+    def test_subscribe(self):
+        svr, mport = new_svr(log_level=logging.WARNING, max_size=0)
+        with svr.helper():
+            client = WuKongQueueClient(host=host, port=mport,
+                                       log_level=logging.WARNING)
+            svr.put_many(range(10))
+            sub = client.subscribe(prefetch=4, auto_ack=False)
+            self.assertEqual([sub.get(timeout=5) for _ in range(4)],
+                             [0, 1, 2, 3])
+            # no more than `prefetch` items unacked
+            self.assertRaises(Empty, sub.get, timeout=0.2)
+            self.assertEqual(svr.qsize(), 6)
+            sub.ack(4)
+            self.assertEqual(sub.get(timeout=5), 4)
+            self.assertEqual(svr.qsize(), 2)
+            self.assertEqual(svr.unfinished_tasks, 6)
+            # items not acked are put back once closed, the one acked by
+            # credit sent on closing is not
+            sub.ack()
+            sub.close()
+            time.sleep(0.1)
+            self.assertEqual(client.get_many(10), [8, 9, 5, 6, 7])
+            for _ in range(5):
+                client.task_done()
+
+            with client.subscribe(prefetch=2) as sub:
+                # woken by put and by a delayed item due, not by polling
+                self.assertRaises(Empty, sub.get, timeout=0.1)
+                start = time.monotonic()
+                svr.put_many(["a", "b"])
+                svr.put("c", delay=0.3)
+                self.assertEqual([i for _, i in zip(range(2), sub)],
+                                 ["a", "b"])
+                self.assertLess(time.monotonic() - start, 0.2)
+                self.assertEqual(sub.get(timeout=5), "c")
+                self.assertLess(time.monotonic() - start, 0.6)
+            time.sleep(0.1)
+            svr.join()
+            self.assertRaises(ValueError, client.subscribe, prefetch=0)
+            client.close()
+
 
 if __name__ == "__main__":
     main()
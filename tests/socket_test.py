@@ -29,9 +29,34 @@ def svr():
         break
 
 
+def svr_legacy(s: TcpSvr, clients: int):
+    """a PROTO_V1 only server, it advertises nothing in QUEUE_HI and drops
+    the connection on cmds it doesn't know, like QUEUE_PROTO"""
+    for _ in range(clients):
+        conn, addr = s.accept()
+        write_wukong_data(conn, WuKongPkg(QUEUE_HI))
+        while 1:
+            pkg = read_wukong_data(conn)
+            if not pkg.is_valid() or pkg.cmd != QUEUE_SIZE:
+                break
+            write_wukong_data(conn, WuKongPkg(wrap_queue_msg(
+                QUEUE_DATA, data=7
+            )))
+        conn.close()
+    s.close()
+
+
+def svr_v2(s: TcpSvr, msg: bytes):
+    conn, addr = s.accept()
+    write_wukong_data(conn, WuKongPkg(msg), proto_version=PROTO_V2)
+    conn.close()
+    s.close()
+
+
 class SocketTest(unittest.TestCase):
     def test_1(self):
         new_thread(svr)
+        time.sleep(0.1)
         c = TcpClient(host, port, None)
         r = c.read()
         # if not r.is_valid():
@@ -40,6 +65,143 @@ class SocketTest(unittest.TestCase):
         self.assertEqual(r.raw_data, send_msg)
         c.close()
 
+    def test_v2_frame(self):
+        msg = b"bye 2019; hi 2020" * 88888
+        s = TcpSvr(host, port + 1)
+        new_thread(svr_v2, kw={"s": s, "msg": msg})
+        c = TcpClient(host, port + 1, None)
+        c.proto_version = PROTO_V2
+        r = c.read()
+        self.assertEqual(r.raw_data, msg)
+        c.close()
+
+    def test_legacy_client(self):
+        """a client never sending QUEUE_PROTO stays on PROTO_V1"""
+        from wukongqueue import WuKongQueue, WuKongQueueClient
+
+        with WuKongQueue(host, port + 2, log_level=50):
+            c = TcpClient(host, port + 2, None)
+            r = c.read()
+            self.assertEqual(r.raw_data, QUEUE_HI)
+            self.assertEqual(r.advertised_proto, PROTO_LATEST)
+            c.write(wrap_queue_msg(
+                QUEUE_PUT, args={"block": True, "timeout": None}, data="1"
+            ))
+            self.assertEqual(c.read().raw_data, QUEUE_OK)
+            c.write(wrap_queue_msg(
+                QUEUE_GET, args={"block": True, "timeout": None}
+            ))
+            r = c.read()
+            r.unwrap()
+            self.assertEqual(r.queue_params_object.data, "1")
+            c.close()
+
+            with WuKongQueueClient(host, port + 2, log_level=50,
+                                   single_connection_client=True) as client:
+                self.assertEqual(
+                    client.connection._tcp_client.proto_version, PROTO_LATEST
+                )
+                client.put("2")
+                self.assertEqual(client.get(), "2")
+
+    def test_legacy_server(self):
+        """a client stays on PROTO_V1 with a server advertising nothing"""
+        import asyncio
+        from wukongqueue import WuKongQueueClient, AsyncWuKongQueueClient
+
+        s = TcpSvr(host, port + 3)
+        new_thread(svr_legacy, kw={"s": s, "clients": 2})
+        with WuKongQueueClient(host, port + 3, log_level=50,
+                               single_connection_client=True) as client:
+            self.assertEqual(client.realtime_qsize(), 7)
+            self.assertEqual(
+                client.connection._tcp_client.proto_version, PROTO_V1
+            )
+
+        async def run():
+            async with AsyncWuKongQueueClient(host, port + 3,
+                                              log_level=50) as client:
+                self.assertEqual(await client.realtime_qsize(), 7)
+
+        asyncio.new_event_loop().run_until_complete(run())
+
+    def test_v2_envelope(self):
+        args = {"block": False, "timeout": 1.5, "auth_key": "键123"}
+        for data in [None, b"", b"123" * 1000, {"1": [1, 2]}]:
+            msg = wrap_queue_msg(
+                QUEUE_PUT, args=args, data=data, proto_version=PROTO_V2
+            )
+            ret = unwrap_queue_msg(msg, proto_version=PROTO_V2)
+            self.assertEqual(ret.cmd, QUEUE_PUT)
+            self.assertEqual(ret.args, args)
+            self.assertEqual(ret.data, data)
+            self.assertIs(ret.exception, None)
+            # the legacy envelope costs more for every message
+            self.assertLess(len(msg), len(wrap_queue_msg(
+                QUEUE_PUT, args=args, data=data
+            )))
+
+        # None args are omitted, bare cmd is a 4-byte header
+        msg = wrap_queue_msg(
+            QUEUE_GET, args={"timeout": None}, proto_version=PROTO_V2
+        )
+        self.assertEqual(len(msg), 4)
+        ret = unwrap_queue_msg(msg, proto_version=PROTO_V2)
+        self.assertEqual((ret.cmd, ret.args), (QUEUE_GET, {}))
+
+        msg = wrap_queue_msg(
+            QUEUE_FAIL, exception=ValueError("x"), proto_version=PROTO_V2
+        )
+        ret = unwrap_queue_msg(msg, proto_version=PROTO_V2)
+        self.assertIsInstance(ret.exception, ValueError)
+        self.assertIs(ret.data, None)
+
+    def test_item_batch(self):
+        from wukongqueue._item_wrapper import ItemBatch, Serialized, item_wrapper
+
+        items = ItemBatch([b"1", {"2": 2}, Serialized(item_wrapper([3]))])
+        msg = wrap_queue_msg(QUEUE_PUT_MANY, data=items,
+                             proto_version=PROTO_V2)
+        ret = unwrap_queue_msg(msg, proto_version=PROTO_V2)
+        self.assertEqual(ret.data, [b"1", {"2": 2}, [3]])
+        ret = unwrap_queue_msg(msg, proto_version=PROTO_V2, passthrough=True)
+        self.assertEqual(ret.data, [item_wrapper(i) for i in ret.data])
+        self.assertTrue(all(isinstance(i, Serialized) for i in ret.data))
+
+        # PROTO_V1 pickles the batch as a list of objects
+        ret = unwrap_queue_msg(wrap_queue_msg(QUEUE_PUT_MANY, data=items))
+        self.assertEqual(ret.data, [b"1", {"2": 2}, [3]])
+        self.assertIs(type(ret.data), list)
+
+    def test_recv_buffer_reuse(self):
+        import socket
+        a, b = socket.socketpair()
+        reader = TcpConn(sock=a)
+        reader.proto_version = PROTO_V2
+        small = b"1" * 100
+        large = b"2" * (RecvBuffer.INITIAL_SIZE * 2)
+        huge = b"3" * (RecvBuffer.MAX_KEPT_SIZE + 1)
+
+        def write_all():
+            for msg in [small, small, large, huge, small]:
+                write_wukong_data(b, WuKongPkg(msg), proto_version=PROTO_V2)
+
+        new_thread(write_all)
+        r = reader.read()
+        self.assertIsInstance(r.raw_data, memoryview)
+        self.assertEqual(r.raw_data, small)
+        buffer = reader._recv_buffer
+        self.assertEqual(reader.read().raw_data, small)
+        self.assertEqual(reader.read().raw_data, large)
+        grown = len(buffer)
+        self.assertGreaterEqual(grown, len(large))
+        # huge frame is read into a one-off buffer
+        self.assertEqual(reader.read().raw_data, huge)
+        self.assertEqual(len(buffer), grown)
+        self.assertEqual(reader.read().raw_data, small)
+        reader.close()
+        b.close()
+
 
 if __name__ == '__main__':
     unittest.main()
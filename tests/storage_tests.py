@@ -0,0 +1,186 @@
+# -*- coding: utf-8 -*-
+import logging
+import os
+import pickle
+import sys
+import tempfile
+from unittest import TestCase, main
+
+sys.path.append("../")
+try:
+    from wukongqueue.wukongqueue import *
+    from wukongqueue.wukongqueue._item_wrapper import item_value, Serialized
+    from wukongqueue.wukongqueue._storage import SpillQueue, PriorityQueue
+    from wukongqueue.wukongqueue._storage import Expiring, TopicQueue
+except ImportError:
+    from wukongqueue import *
+    from wukongqueue._item_wrapper import item_value, Serialized
+    from wukongqueue._storage import SpillQueue, PriorityQueue
+    from wukongqueue._storage import Expiring, TopicQueue
+
+host = "127.0.0.1"
+default_port = 10500
+
+
+def segment_files(spill_dir):
+    return [f for _, _, files in os.walk(spill_dir) for f in files]
+
+
+class SpillQueueTests(TestCase):
+    def test_fifo(self):
+        with tempfile.TemporaryDirectory() as d:
+            q = SpillQueue(d, memory_items=10, segment_size=256)
+            q.extend(range(1000))
+            self.assertEqual(len(q), 1000)
+            self.assertLessEqual(len(q._head) + len(q._tail), 10)
+            self.assertGreater(len(segment_files(d)), 1)
+            self.assertEqual([item_value(i) for i in q][:3], [0, 1, 2])
+
+            got = [q.popleft() for _ in range(500)]
+            q.extend(range(1000, 1100))
+            while q:
+                got.append(q.popleft())
+            self.assertEqual([item_value(i) for i in got], list(range(1100)))
+            self.assertRaises(IndexError, q.popleft)
+            # segments are removed once read
+            self.assertEqual(segment_files(d), [])
+
+    def test_big_item_and_clear(self):
+        with tempfile.TemporaryDirectory() as d:
+            q = SpillQueue(d, memory_items=2, segment_size=64)
+            items = [b"x" * 1000, "y", b"z" * 100, {"k": 1}]
+            q.extend(items)
+            self.assertEqual([item_value(q.popleft()) for _ in range(4)],
+                             items)
+
+            q.extend(range(100))
+            q.clear()
+            self.assertEqual(len(q), 0)
+            self.assertEqual(segment_files(d), [])
+            q.append(1)
+            self.assertEqual(q.popleft(), 1)
+            q.close()
+            self.assertEqual(os.listdir(d), [])
+
+    def test_pickled_items(self):
+        with tempfile.TemporaryDirectory() as d:
+            q = SpillQueue(d, memory_items=2, segment_size=64)
+            items = [Serialized(pickle.dumps(i)) for i in range(10)]
+            q.extend(items)
+            got = [q.popleft() for _ in range(10)]
+            # spilled as they are, never unpickled
+            self.assertEqual(got, items)
+            self.assertTrue(all(isinstance(i, Serialized) for i in got))
+            q.close()
+
+    def test_expiring_items(self):
+        with tempfile.TemporaryDirectory() as d:
+            q = SpillQueue(d, memory_items=2, segment_size=64)
+            q.extend(Expiring(i, float(i)) if i % 2 else i for i in range(10))
+            self.assertEqual(q.peek(), 0)
+            got = [q.popleft() for _ in range(10)]
+            # spilled with the deadline
+            self.assertEqual([type(i) is Expiring for i in got],
+                             [i % 2 == 1 for i in range(10)])
+            self.assertEqual([i.deadline for i in got if type(i) is Expiring],
+                             [1.0, 3.0, 5.0, 7.0, 9.0])
+            self.assertEqual([item_value(getattr(i, "item", i)) for i in got],
+                             list(range(10)))
+            self.assertRaises(IndexError, q.peek)
+            q.close()
+
+    def test_ttl(self):
+        with tempfile.TemporaryDirectory() as d:
+            svr = WuKongQueue(host=host, port=default_port,
+                              log_level=logging.FATAL, spill_dir=d,
+                              memory_items=4, ttl=60)
+            with svr.helper():
+                svr.put_many(range(50), ttl=0)
+                svr.put_many(range(50))
+                self.assertEqual(svr.get_many(100), list(range(50)))
+                self.assertEqual(svr.expired, 50)
+
+    def test_server(self):
+        with tempfile.TemporaryDirectory() as d:
+            svr = WuKongQueue(host=host, port=default_port,
+                              log_level=logging.FATAL, spill_dir=d,
+                              memory_items=4)
+            with svr.helper():
+                self.assertEqual(svr.put_many(list(range(100))), 100)
+                self.assertEqual(svr.qsize(), 100)
+                self.assertEqual(svr.get_many(60), list(range(60)))
+                svr.put("a")
+                self.assertEqual(svr.get_many(100), list(range(60, 100)) + ["a"])
+                self.assertIs(svr.empty(), True)
+
+    def test_close(self):
+        with tempfile.TemporaryDirectory() as d:
+            svr = WuKongQueue(host=host, port=default_port,
+                              log_level=logging.FATAL, spill_dir=d,
+                              memory_items=4,
+                              queues={"jobs": {"spill_dir": d,
+                                               "memory_items": 4}})
+            with svr.helper():
+                svr.put_many(range(100))
+                svr.queues["jobs"].put_many(range(100))
+                self.assertEqual(len(os.listdir(d)), 2)
+                self.assertGreater(len(segment_files(d)), 0)
+            # segment files of the server and of hosted queues are removed
+            self.assertEqual(os.listdir(d), [])
+
+            # or once the storage is garbage collected
+            q = SpillQueue(d, memory_items=2, segment_size=64)
+            q.extend(range(10))
+            self.assertGreater(len(segment_files(d)), 0)
+            del q
+            self.assertEqual(os.listdir(d), [])
+
+
+class PriorityQueueTests(TestCase):
+    def test_order(self):
+        q = PriorityQueue()
+        q.extend(range(1000), priority=1)
+        q.append("a", priority=0)
+        q.extend(["b", "c"], priority=2)
+        q.append({"unorderable": 1})
+        self.assertEqual(len(q), 1004)
+        self.assertEqual(list(q)[:2], ["a", {"unorderable": 1}])
+        got = [q.popleft() for _ in range(len(q))]
+        self.assertEqual(got, ["a", {"unorderable": 1}] + list(range(1000))
+                         + ["b", "c"])
+        self.assertRaises(IndexError, q.popleft)
+        q.append(1)
+        q.clear()
+        self.assertIs(bool(q), False)
+
+
+class TopicQueueTests(TestCase):
+    def test_groups(self):
+        q = TopicQueue()
+        q.extend(range(3000))
+        # kept until read if there are no groups
+        self.assertEqual(q.lag("a"), 3000)
+        q.add_group("b")
+        self.assertEqual(q.read("a", 2000), (list(range(2000)), 0))
+        self.assertEqual(q.lag("a"), 1000)
+        self.assertEqual(q.read("b", 10), (list(range(10)), 10))
+        self.assertEqual(q.read("a", 5000), (list(range(2000, 3000)), 0))
+        self.assertEqual(q.lag("b"), 2990)
+        q.append(3000)
+        self.assertEqual(q.groups(), {"a": {"lag": 1, "read": 3000},
+                                      "b": {"lag": 2991, "read": 10}})
+        # dropped for all groups
+        self.assertEqual(q.popleft(), 10)
+        self.assertEqual(q.peek(), 11)
+        self.assertEqual(q.lag("b"), 2990)
+        self.assertEqual(q.read("b", 1), ([11], 1))
+        self.assertEqual(q.remove_group("b"), 2988)
+        self.assertEqual(list(q), [3000])
+        q.clear()
+        self.assertEqual(q.lag("a"), 0)
+        self.assertEqual(q.read("a", 1), ([], 0))
+        self.assertRaises(IndexError, q.popleft)
+
+
+if __name__ == "__main__":
+    main()
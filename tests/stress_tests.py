@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+import logging
+import os
+import socket
+import sys
+import time
+from unittest import TestCase, main
+
+sys.path.append("../")
+try:
+    from wukongqueue.wukongqueue import *
+except ImportError:
+    from wukongqueue import *
+from wukongqueue._commu_proto import *
+
+host = "127.0.0.1"
+default_port = 10100
+MB = 1024 * 1024
+
+
+def new_svr(host=host, port=default_port, max_size=0):
+    p = port
+    while 1:
+        try:
+            return WuKongQueue(
+                host=host, port=p, maxsize=max_size, log_level=logging.FATAL
+            ), p
+        except OSError as e:
+            if 'already' in str(e.args) or '只允许使用一次' in str(e.args):
+                if p >= 65535:
+                    raise e
+                p += 1
+            else:
+                raise e
+
+
+class StressTests(TestCase):
+    def test_partial_socket_io(self):
+        """tiny socket buffers force partial send/recv on every frame"""
+        for proto_version in [PROTO_V1, PROTO_V2]:
+            a, b = socket.socketpair()
+            a.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4096)
+            b.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 4096)
+            msgs = [os.urandom(n) for n in [0, 1, 9999, 10000, 3 * MB]]
+
+            def write_all():
+                for msg in msgs:
+                    ok, err = write_wukong_data(
+                        b, WuKongPkg(msg), proto_version=proto_version
+                    )
+                    assert ok, err
+
+            new_thread(write_all)
+            reader = TcpConn(sock=a)
+            reader.proto_version = proto_version
+            for msg in msgs:
+                self.assertEqual(reader.read().raw_data, msg)
+            reader.close()
+            b.close()
+
+    def test_big_items(self):
+        svr, port = new_svr()
+        with svr.helper():
+            items = [os.urandom(n * MB) for n in [1, 8, 20]]
+            with WuKongQueueClient(host=host, port=port,
+                                   log_level=logging.FATAL) as client:
+                for item in items:
+                    client.put(item)
+                for item in items:
+                    self.assertEqual(client.get(), item)
+
+            # legacy client, never negotiates PROTO_V2
+            c = TcpClient(host, port, None)
+            self.assertEqual(c.read().raw_data, QUEUE_HI)
+            c.write_msg(
+                QUEUE_PUT, args={"block": True, "timeout": None},
+                data=items[1]
+            )
+            self.assertEqual(c.read().cmd, QUEUE_OK)
+            self.assertEqual(svr.get(), items[1])
+            c.close()
+
+    def test_concurrent_big_items(self):
+        svr, port = new_svr()
+        producers = 4
+        loop = 5
+        item = os.urandom(2 * MB)
+        got = []
+
+        def new_client():
+            # connect one by one, the accept loop handles them in turn
+            return WuKongQueueClient(host=host, port=port,
+                                     log_level=logging.FATAL,
+                                     single_connection_client=True)
+
+        def produce(c: WuKongQueueClient):
+            with c:
+                for _ in range(loop):
+                    c.put(item)
+
+        def consume(c: WuKongQueueClient):
+            with c:
+                for _ in range(loop):
+                    got.append(c.get(timeout=30) == item)
+
+        with svr.helper():
+            for _ in range(producers):
+                new_thread(produce, kw={"c": new_client()})
+                new_thread(consume, kw={"c": new_client()})
+            deadline = time.time() + 60
+            while len(got) < producers * loop and time.time() < deadline:
+                time.sleep(0.1)
+            self.assertEqual(got, [True] * producers * loop)
+
+
+if __name__ == "__main__":
+    main()
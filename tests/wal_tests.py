@@ -0,0 +1,269 @@
+# -*- coding: utf-8 -*-
+import logging
+import os
+import sys
+import tempfile
+import time
+from unittest import TestCase, main
+
+sys.path.append("../")
+try:
+    from wukongqueue.wukongqueue import *
+except ImportError:
+    from wukongqueue import *
+
+host = "127.0.0.1"
+default_port = 10400
+
+
+def new_svr(persist_dir, svr_cls=WuKongQueue, port=default_port, **kwargs):
+    p = port
+    while 1:
+        try:
+            return svr_cls(
+                host=host, port=p, log_level=logging.FATAL,
+                persist_dir=persist_dir, **kwargs
+            ), p
+        except OSError as e:
+            if 'already' in str(e.args) or '只允许使用一次' in str(e.args):
+                if p >= 65535:
+                    raise e
+                p += 1
+            else:
+                raise e
+
+
+def segments(persist_dir):
+    return sorted(n for n in os.listdir(persist_dir) if n.endswith(".wal"))
+
+
+class WalTests(TestCase):
+    def test_recover(self):
+        for fsync in ("always", "interval", "never"):
+            with tempfile.TemporaryDirectory() as d:
+                svr, port = new_svr(d, fsync=fsync)
+                with svr.helper():
+                    svr.put("1")
+                    self.assertEqual(svr.put_many(["2", b"3", 4]), 3)
+                    with WuKongQueueClient(host=host, port=port,
+                                           log_level=logging.FATAL) as c:
+                        c.put({"5": 5})
+                        self.assertEqual(c.get(), "1")
+                        c.task_done()
+                    self.assertEqual(svr.get_many(2), ["2", b"3"])
+
+                svr, port = new_svr(d, fsync=fsync)
+                with svr.helper():
+                    self.assertEqual(svr.get_many(5), [4, {"5": 5}])
+                    self.assertEqual(svr.unfinished_tasks, 4)
+                    svr.put("6")
+                    svr.reset()
+                    svr.task_done()
+
+                svr, port = new_svr(d, fsync=fsync)
+                with svr.helper():
+                    self.assertIs(svr.empty(), True)
+                    self.assertEqual(svr.unfinished_tasks, 4)
+
+    def test_segments(self):
+        with tempfile.TemporaryDirectory() as d:
+            svr, port = new_svr(d, segment_size=1024)
+            with svr.helper():
+                for _ in range(100):
+                    svr.put("x" * 100)
+                self.assertGreater(len(segments(d)), 5)
+                svr.get_many(90)
+                # segments whose items were all got are deleted
+                self.assertLessEqual(len(segments(d)), 3)
+                svr.put("y")
+                svr.put("y")
+
+            svr, port = new_svr(d, segment_size=1024)
+            with svr.helper():
+                self.assertEqual(svr.qsize(), 12)
+                self.assertEqual(svr.get_many(20)[-2:], ["y", "y"])
+
+    def test_fsync_interval(self):
+        with tempfile.TemporaryDirectory() as d:
+            svr, port = new_svr(d, fsync="interval", fsync_interval=0.01,
+                                segment_size=1024)
+            wal = svr._wal
+            with svr.helper():
+                for _ in range(100):
+                    svr.put("x" * 100)
+                self.assertGreater(len(segments(d)), 5)
+                thread = wal._sync_thread
+                # the thread survives rolling segments
+                for _ in range(100):
+                    if wal._synced_lsn == wal._written_lsn:
+                        break
+                    time.sleep(0.01)
+                self.assertEqual(wal._synced_lsn, wal._written_lsn)
+                self.assertIs(thread.is_alive(), True)
+                svr.put("y")
+            # close wakes and joins it
+            self.assertIs(thread.is_alive(), False)
+            self.assertIs(wal._sync_thread, None)
+
+    def test_torn_tail(self):
+        with tempfile.TemporaryDirectory() as d:
+            svr, port = new_svr(d)
+            with svr.helper():
+                svr.put("1")
+                svr.put("2")
+            with open(os.path.join(d, segments(d)[-1]), "ab") as f:
+                # a record half written by a crash
+                f.write(b"\x02\x00\x00\x00\x10")
+
+            svr, port = new_svr(d)
+            with svr.helper():
+                self.assertEqual(svr.get_many(5), ["1", "2"])
+                svr.put("3")
+
+            svr, port = new_svr(d)
+            with svr.helper():
+                self.assertEqual(svr.get_many(5), ["3"])
+
+    def test_async_engine(self):
+        with tempfile.TemporaryDirectory() as d:
+            svr, port = new_svr(d, svr_cls=AsyncWuKongQueue)
+            with svr.helper():
+                with WuKongQueueClient(host=host, port=port,
+                                       log_level=logging.FATAL) as c:
+                    c.put_many(["1", "2", "3"])
+                    self.assertEqual(c.get(), "1")
+
+            svr, port = new_svr(d, svr_cls=AsyncWuKongQueue)
+            with svr.helper():
+                self.assertEqual(svr.get_many(5), ["2", "3"])
+
+    def test_invalid_fsync(self):
+        with tempfile.TemporaryDirectory() as d:
+            self.assertRaises(ValueError, new_svr, d, fsync="sometimes")
+
+
+    def test_ring_mode(self):
+        with tempfile.TemporaryDirectory() as d:
+            svr, port = new_svr(d, maxsize=2, mode="ring")
+            with svr.helper():
+                svr.put_many(["1", "2", "3"])
+                svr.put("4")
+                self.assertEqual(svr.dropped, 2)
+
+            svr, port = new_svr(d, maxsize=2, mode="ring")
+            with svr.helper():
+                self.assertEqual(svr.get_many(5), ["3", "4"])
+                self.assertEqual(svr.unfinished_tasks, 2)
+
+    def test_delayed_items(self):
+        with tempfile.TemporaryDirectory() as d:
+            svr, port = new_svr(d)
+            with svr.helper():
+                svr.put_many(["1", "2"], delay=0.1)
+                svr.put("3", delay=60)
+                self.assertEqual(svr.get_many(5), ["1", "2"])
+                svr.task_done()
+
+            # logged when put, the pending one is recovered
+            svr, port = new_svr(d)
+            with svr.helper():
+                self.assertEqual(svr.qsize(), 0)
+                self.assertEqual(svr.delayed_qsize(), 1)
+                self.assertEqual(svr.unfinished_tasks, 2)
+
+    def test_restart_with_delayed_items(self):
+        with tempfile.TemporaryDirectory() as d:
+            svr, port = new_svr(d)
+            with svr.helper():
+                svr.put("now")
+                svr.put("later", delay=0.3)
+
+            svr, port = new_svr(d)
+            with svr.helper():
+                self.assertEqual(svr.unfinished_tasks, 2)
+                self.assertEqual(svr.qsize(), 1)
+                self.assertEqual(svr.delayed_qsize(), 1)
+                self.assertEqual(svr.get(), "now")
+                # due at the same wall time
+                self.assertEqual(svr.get(timeout=5), "later")
+                svr.task_done()
+                # the one due while the server was down is due on start
+                svr.put("down", delay=0.2)
+
+            time.sleep(0.3)
+            svr, port = new_svr(d)
+            with svr.helper():
+                self.assertEqual(svr.get(block=False), "down")
+                self.assertEqual(svr.unfinished_tasks, 2)
+
+            # delayed items survive segments deleted
+            svr, port = new_svr(d, segment_size=1024)
+            with svr.helper():
+                svr.put_many(["x" * 100, "y" * 100], delay=60)
+                for i in range(50):
+                    svr.put("%d" % i * 50)
+                    svr.get()
+                self.assertLess(len(segments(d)), 5)
+
+            svr, port = new_svr(d)
+            with svr.helper():
+                self.assertEqual(svr.delayed_qsize(), 2)
+                self.assertEqual(svr.unfinished_tasks, 54)
+                svr.reset()
+
+            svr, port = new_svr(d)
+            with svr.helper():
+                self.assertEqual(svr.delayed_qsize(), 0)
+
+    def test_lease(self):
+        with tempfile.TemporaryDirectory() as d:
+            svr, port = new_svr(d)
+            with svr.helper():
+                svr.put_many(["1", "2", "3"])
+                r1, _ = svr.lease()
+                r2, _ = svr.lease()
+                svr.ack(r1)
+                svr.nack(r2)
+
+            svr, port = new_svr(d)
+            with svr.helper():
+                # requeued item is not a new task
+                self.assertEqual(svr.get_many(5), ["3", "2"])
+                self.assertEqual(svr.unfinished_tasks, 2)
+
+    def test_released_tasks(self):
+        with tempfile.TemporaryDirectory() as d:
+            svr, port = new_svr(d, on_disconnect="release")
+            with svr.helper():
+                svr.put_many(["1", "2", "3"])
+                client = WuKongQueueClient(host=host, port=port,
+                                           log_level=logging.FATAL)
+                self.assertEqual(client.get_many(2), ["1", "2"])
+                client.close()
+                for _ in range(100):
+                    if not svr.connected_clients():
+                        break
+                    time.sleep(0.01)
+                self.assertEqual(svr.unfinished_tasks, 1)
+
+            svr, port = new_svr(d)
+            with svr.helper():
+                self.assertEqual(svr.unfinished_tasks, 1)
+
+    def test_ttl(self):
+        with tempfile.TemporaryDirectory() as d:
+            svr, port = new_svr(d)
+            with svr.helper():
+                svr.put_many(["1", "2"], ttl=0)
+                svr.put("3")
+                self.assertEqual(svr.get(), "3")
+
+            # expired items are dropped from the log
+            svr, port = new_svr(d, ttl=60)
+            with svr.helper():
+                self.assertEqual(svr.qsize(), 0)
+                self.assertEqual(svr.unfinished_tasks, 1)
+
+
+if __name__ == "__main__":
+    main()
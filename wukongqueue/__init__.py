@@ -1,8 +1,20 @@
 # -*- coding: utf-8 -*-
 
-from .client import WuKongQueueClient, WuKongPkg
+from .async_client import (
+    AsyncWuKongQueueClient,
+    AsyncConnectionPool,
+    AsyncSubscription,
+)
+from .async_server import AsyncWuKongQueue
+from .client import WuKongQueueClient, WuKongPkg, Pipeline, Subscription
 from .connection import Connection, ConnectionPool
 from .exceptions import *
+from .serializer import (
+    Serializer,
+    register_serializer,
+    Compressor,
+    register_compressor,
+)
 from .server import WuKongQueue
 from .utils import new_thread
 
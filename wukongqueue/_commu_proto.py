@@ -1,20 +1,47 @@
 # Protocol of communication
 
+import asyncio
 import json
+import os
 import socket
+import struct
 from base64 import b64encode, b64decode
-
-from ._item_wrapper import item_wrapper, item_unwrap
+from collections import deque
+from itertools import islice
+
+from ._item_wrapper import (
+    item_wrapper,
+    item_wrapper_parts,
+    item_unwrap,
+    item_value,
+    Serialized,
+    ItemBatch,
+)
+from .serializer import ZERO_COPY_MIN_SIZE
 from .utils import Unify_encoding
 
 __all__ = [
     "read_wukong_data",
+    "read_wukong_stream",
     "write_wukong_data",
+    "write_wukong_parts",
+    "write_wukong_msgs",
+    "recv_exactly",
+    "recv_exactly_into",
+    "sendall_buffers",
+    "parse_segment_header",
+    "segment_legacy_msg",
+    "FRAME_HEADER",
     "WuKongPkg",
+    "RecvBuffer",
     "TcpConn",
     "TcpSvr",
     "TcpClient",
     "wrap_queue_msg",
+    "wrap_queue_msg_parts",
+    "frame_msgs",
+    "frame_hi",
+    "BYTES_HEADER_LEN",
     "unwrap_queue_msg",
     "QUEUE_HI",
     "QUEUE_AUTH_KEY",
@@ -37,6 +64,18 @@ __all__ = [
     "QUEUE_CLIENTS",
     "QUEUE_TASK_DONE",
     "QUEUE_JOIN",
+    "QUEUE_PROTO",
+    "QUEUE_PUT_MANY",
+    "QUEUE_GET_MANY",
+    "QUEUE_STATS",
+    "QUEUE_LEASE",
+    "QUEUE_ACK",
+    "QUEUE_NACK",
+    "QUEUE_SUBSCRIBE",
+    "QUEUE_CREDIT",
+    "PROTO_V1",
+    "PROTO_V2",
+    "PROTO_LATEST",
 ]
 
 
@@ -44,11 +83,29 @@ class SupportBytesOnly(Exception):
     pass
 
 
+"""
+Every connection starts with PROTO_V1 so that old clients keep working.
+The server advertises the latest protocol it supports in the QUEUE_HI
+handshake, see `frame_hi`, a client can upgrade the connection by sending
+QUEUE_PROTO after it (and authentication if needed) only if the server
+advertised PROTO_V2, old servers know nothing about QUEUE_PROTO.
+"""
+
+# segmented frames, each segment has a fixed length ASCII header;
+# message is `*` joined base64 of cmd, json args, pickled data/exception
+PROTO_V1 = 1
+# single frame per message, prefixed with the 8-byte big-endian body length;
+# message is a binary envelope, see `_wrap_queue_msg_v2`
+PROTO_V2 = 2
+
+PROTO_LATEST = PROTO_V2
+
+
 class QueueParamsObject:
-    def __init__(self, cmd=b"", data=None, args={}, exception=None):
+    def __init__(self, cmd=b"", data=None, args=None, exception=None):
         self.cmd = cmd
         self.data = data
-        self.args = args
+        self.args = args if args is not None else {}
         self.exception = exception
 
 
@@ -60,8 +117,17 @@ _queue_msg_except_index = 3
 
 
 def wrap_queue_msg(
-    queue_cmd: bytes, args=None, data=None, exception=None
+    queue_cmd: bytes,
+    args=None,
+    data=None,
+    exception=None,
+    proto_version=PROTO_V1,
 ) -> bytes:
+    if proto_version >= PROTO_V2:
+        return b"".join(_wrap_queue_msg_v2(queue_cmd, args, data, exception))
+    if isinstance(data, ItemBatch):
+        # PROTO_V1 pickles the whole batch
+        data = [item_value(item) for item in data]
     # base64 does not contain `*`
     item_wrapped = item_wrapper(data)
     args = args or {}
@@ -75,7 +141,33 @@ def wrap_queue_msg(
     )
 
 
-def unwrap_queue_msg(msg: bytes) -> QueueParamsObject:
+def wrap_queue_msg_parts(
+    queue_cmd: bytes,
+    args=None,
+    data=None,
+    exception=None,
+    proto_version=PROTO_V1,
+):
+    """like `wrap_queue_msg`, but returns a list of parts in PROTO_V2, they
+    are written by scatter-gather I/O without joining, see `frame_msgs`.
+    In PROTO_V1, a bare cmd is returned as is, see `unwrap_queue_msg`
+    """
+    if proto_version >= PROTO_V2:
+        return _wrap_queue_msg_v2(queue_cmd, args, data, exception)
+    if not args and data is None and exception is None:
+        return queue_cmd
+    return wrap_queue_msg(queue_cmd, args=args, data=data, exception=exception)
+
+
+def unwrap_queue_msg(
+    msg: bytes, proto_version=PROTO_V1, passthrough=False
+) -> QueueParamsObject:
+    """
+    :param passthrough: used by server, items are not unpickled but kept
+    as Serialized, only in PROTO_V2
+    """
+    if proto_version >= PROTO_V2:
+        return _unwrap_queue_msg_v2(msg, passthrough)
     lst = msg.split(_queue_msg_delimiter)
     ret = QueueParamsObject(cmd=lst[_queue_msg_cmd_index])
     if len(lst) == 1:
@@ -89,20 +181,174 @@ def unwrap_queue_msg(msg: bytes) -> QueueParamsObject:
     return ret
 
 
+"""
+PROTO_V2 message envelope:
+    opcode(1 byte) | flags(1 byte) | args length(2 bytes) | args | data
+
+args is a sequence of `arg id(1 byte) | value`, the value format is fixed
+by `_ARG_FIELDS` and the arg is omitted if its value is None. The data
+section is present only if one of FLAG_DATA/FLAG_EXCEPTION/FLAG_ITEMS is
+set, so an absent item/exception costs nothing on the wire.
+
+FLAG_ITEMS data section is an ItemBatch:
+    count(4 bytes) | item size(4 bytes) | serialized item | item size | ...
+"""
+
+_ENVELOPE_HEADER = struct.Struct("!BBH")
+
+# data section holds a pickled item
+FLAG_DATA = 0x01
+# data section holds a pickled exception
+FLAG_EXCEPTION = 0x02
+# data section holds separately serialized items of an ItemBatch
+FLAG_ITEMS = 0x04
+
+_ITEMS_COUNT = struct.Struct("!I")
+
+# arg name -> (arg id, struct format of value),
+# "s" is a utf-8 str prefixed with its 2-byte length
+_ARG_FIELDS = {
+    "block": (1, "?"),
+    "timeout": (2, "d"),
+    "maxsize": (3, "q"),
+    "auth_key": (4, "s"),
+    "version": (5, "B"),
+    "max_items": (6, "I"),
+    "priority": (7, "q"),
+    "delay": (8, "d"),
+    "ttl": (9, "d"),
+    "receipt": (10, "Q"),
+    "visibility_timeout": (11, "d"),
+    "queue": (12, "s"),
+    "group": (13, "s"),
+    "prefetch": (14, "I"),
+    "credit": (15, "I"),
+}
+
+# arg name -> (arg id, is str, struct of `id | value`)
+_ARG_PACKERS = {}
+# arg id -> (arg name, is str, struct of value)
+_ARG_UNPACKERS = {}
+
+
+def _register_args():
+    for name, (arg_id, fmt) in _ARG_FIELDS.items():
+        is_str = fmt == "s"
+        fmt = "H" if is_str else fmt
+        _ARG_PACKERS[name] = (arg_id, is_str, struct.Struct("!B" + fmt))
+        _ARG_UNPACKERS[arg_id] = (name, is_str, struct.Struct("!" + fmt))
+
+
+_register_args()
+
+
+def _wrap_args(args: dict) -> bytes:
+    parts = []
+    for name, value in args.items():
+        if value is None:
+            continue
+        try:
+            arg_id, is_str, packer = _ARG_PACKERS[name]
+        except KeyError:
+            raise ValueError("unknown queue msg arg:%s" % name)
+        if is_str:
+            value = value.encode(Unify_encoding)
+            parts.append(packer.pack(arg_id, len(value)))
+            parts.append(value)
+        else:
+            parts.append(packer.pack(arg_id, value))
+    return b"".join(parts)
+
+
+def _unwrap_args(view: memoryview) -> dict:
+    args = {}
+    offset = 0
+    while offset < len(view):
+        name, is_str, unpacker = _ARG_UNPACKERS[view[offset]]
+        (value,) = unpacker.unpack_from(view, offset + 1)
+        offset += 1 + unpacker.size
+        if is_str:
+            end = offset + value
+            value = str(view[offset:end], Unify_encoding)
+            offset = end
+        args[name] = value
+    return args
+
+
+def _wrap_queue_msg_v2(queue_cmd: bytes, args, data, exception) -> list:
+    """returns parts of msg, they are written by scatter-gather I/O"""
+    flags = 0
+    body = [b""]
+    if exception is not None:
+        flags |= FLAG_EXCEPTION
+        body = [item_wrapper(exception)]
+    elif isinstance(data, ItemBatch):
+        flags |= FLAG_ITEMS
+        body = [_ITEMS_COUNT.pack(len(data))]
+        for item in data:
+            parts = item_wrapper_parts(item)
+            body.append(_ITEMS_COUNT.pack(sum(len(p) for p in parts)))
+            body.extend(parts)
+    elif data is not None:
+        flags |= FLAG_DATA
+        # big buffers of item are sent as they are
+        body = item_wrapper_parts(data)
+    args = _wrap_args(args) if args else b""
+    header = _ENVELOPE_HEADER.pack(_CMD_OPCODES[queue_cmd], flags, len(args))
+    return [header, args] + body
+
+
+def _unwrap_queue_msg_v2(msg, passthrough=False) -> QueueParamsObject:
+    """parse without copying `msg`, item is unpickled from a memoryview,
+    or copied as Serialized if `passthrough`"""
+    unwrap = Serialized if passthrough else item_unwrap
+    view = memoryview(msg)
+    opcode, flags, args_len = _ENVELOPE_HEADER.unpack_from(view)
+    offset = _ENVELOPE_HEADER.size
+    ret = QueueParamsObject(cmd=_OPCODE_CMDS.get(opcode))
+    if args_len:
+        ret.args = _unwrap_args(view[offset : offset + args_len])
+    body = view[offset + args_len :]
+    if flags & FLAG_EXCEPTION:
+        ret.exception = item_unwrap(body)
+    elif flags & FLAG_ITEMS:
+        (count,) = _ITEMS_COUNT.unpack_from(body)
+        offset = _ITEMS_COUNT.size
+        ret.data = []
+        for _ in range(count):
+            (size,) = _ITEMS_COUNT.unpack_from(body, offset)
+            offset += _ITEMS_COUNT.size
+            ret.data.append(unwrap(body[offset : offset + size]))
+            offset += size
+    elif flags & FLAG_DATA:
+        ret.data = unwrap(body)
+    return ret
+
+
 class WuKongPkg:
     """Customized socket communication message package"""
 
-    def __init__(self, msg: bytes = b"", err=None, is_socket_closed=False):
+    def __init__(
+        self,
+        msg: bytes = b"",
+        err=None,
+        is_socket_closed=False,
+        proto_version=PROTO_V1,
+    ):
         """
-        :param msg: raw bytes
+        :param msg: raw bytes, or memoryview into a RecvBuffer
         :param err: error encountered reading socket
         :param is_socket_closed: whether the socket is closed.
+        :param proto_version: wire protocol `msg` was read with
         """
-        if not isinstance(msg, bytes):
+        # latest protocol advertised by the peer, see `frame_hi`
+        self.advertised_proto = PROTO_V1
+        if not isinstance(msg, (bytes, memoryview)):
             raise SupportBytesOnly("Support bytes only")
         self.raw_data = msg
         self.err = err
         self.is_socket_closed = is_socket_closed
+        self.proto_version = proto_version
         self.queue_params_object = None
 
     def __repr__(self):
@@ -118,15 +364,30 @@ class WuKongPkg:
     def is_valid(self) -> bool:
         return any([self.is_socket_closed, self.err]) is False
 
-    def unwrap(self):
-        """unwrap raw data bytes to readable obj"""
-        self.queue_params_object = unwrap_queue_msg(self.raw_data)
+    def unwrap(self, passthrough=False):
+        """unwrap raw data bytes to readable obj, only once,
+        see `unwrap_queue_msg` for `passthrough`"""
+        if self.queue_params_object is not None:
+            return
+        self.queue_params_object = unwrap_queue_msg(
+            self.raw_data,
+            proto_version=self.proto_version,
+            passthrough=passthrough,
+        )
+
+    @property
+    def cmd(self) -> bytes:
+        if self.queue_params_object is None:
+            self.unwrap()
+        return self.queue_params_object.cmd
 
 
 """
 Stream READ/WRITE protocol for TCP communication
 """
 
+FRAME_HEADER = struct.Struct("!Q")
+
 # msg header delimiter
 HEADER_DELIMITER = b"\n"
 
@@ -144,89 +405,280 @@ BYTES_HEADER_LEN = len(__BYTES_EXAMPLE)
 HAS_NEXT_SEGMENT_INDEX = __BYTES_EXAMPLE.index(b"T")
 
 
-def read_wukong_data(
-    conn: socket.socket, ignore_socket_timeout=False,
-) -> WuKongPkg:
-    """Block read from tcp socket connection"""
-
-    buffer = bytearray()
-    msg_body_size = -1
-    has_next_segment = False
-
-    while True:
+class RecvBuffer:
+    """Growable receive buffer owned by a connection, frames are read into
+    it with `recv_into`, so a msg is copied only once from kernel.
+
+    NOTE: the memoryview returned by `reserve` is valid until the next
+    read on the same buffer, unwrap a msg before reading the next one.
+    """
+
+    # initial size, most queue msgs are small
+    INITIAL_SIZE = 16 * 1024
+    # never keep a buffer larger than this, bigger frames are read into
+    # a one-off buffer which is dropped with its msg, so out-of-band
+    # buffers of items are loaded from it without copying
+    MAX_KEPT_SIZE = ZERO_COPY_MIN_SIZE
+
+    def __init__(self, size=INITIAL_SIZE):
+        self._buf = bytearray(size)
+        self._view = memoryview(self._buf)
+
+    def __len__(self):
+        return len(self._buf)
+
+    def reserve(self, size: int) -> memoryview:
+        if size > len(self._buf):
+            if size > self.MAX_KEPT_SIZE:
+                return memoryview(bytearray(size))
+            # never resize in place, views of the old buffer may be alive
+            self._buf = bytearray(max(size, len(self._buf) * 2))
+            self._view = memoryview(self._buf)
+        return self._view[:size]
+
+
+def recv_exactly_into(
+    conn: socket.socket, view: memoryview, ignore_socket_timeout=False
+):
+    """Block read until `view` is filled, `recv` may return fewer bytes
+    than requested. Returns None, or WuKongPkg on error"""
+    received = 0
+    size = len(view)
+    while received < size:
         try:
-            if msg_body_size == -1:
-                # firstly, recv msg header
-                msg_header_bytes = conn.recv(BYTES_HEADER_LEN)
-                if len(msg_header_bytes) == 0:
-                    return WuKongPkg(is_socket_closed=True)
-                msg_body_size = int(
-                    msg_header_bytes[:4].replace(b"x", b"").decode()
-                )
-                if msg_body_size == 0:
-                    break
-                if msg_header_bytes[HAS_NEXT_SEGMENT_INDEX] == ord(b"T"):
-                    has_next_segment = True
-                else:
-                    has_next_segment = False
-
-            # then recv msg body
-            data = conn.recv(msg_body_size)
+            n = conn.recv_into(view[received:], size - received)
         except socket.timeout as e:
             if ignore_socket_timeout:
                 continue
             return WuKongPkg(err="%s,%s" % (socket.timeout, e.args))
         except socket.error as e:
             return WuKongPkg(err="%s,%s" % (e.__class__, e.args))
-
-        # if data is empty byte,that represents the conn was closed by peer.
-        if len(data) == 0:
+        if n == 0:
             return WuKongPkg(is_socket_closed=True)
+        received += n
+
+
+def recv_exactly(conn: socket.socket, size: int, ignore_socket_timeout=False):
+    """Block read exactly `size` bytes.
+    Returns (bytearray, None), or (None, WuKongPkg) on error"""
+    data = bytearray(size)
+    err_pkg = recv_exactly_into(conn, memoryview(data), ignore_socket_timeout)
+    if err_pkg is not None:
+        return None, err_pkg
+    return data, None
+
+
+# max buffers passed to one sendmsg call, IOV_MAX is 1024 on most systems
+_SENDMSG_MAX_BUFFERS = 1024
+
+
+def sendall_buffers(conn: socket.socket, buffers):
+    """Scatter-gather version of socket.sendall, sends all `buffers` in
+    order without joining them, `sendmsg` may send fewer bytes than given.
+    """
+    if not hasattr(conn, "sendmsg"):
+        # e.g. Windows
+        conn.sendall(b"".join(buffers))
+        return
+    views = deque(memoryview(b).cast("B") for b in buffers if len(b))
+    while views:
+        sent = conn.sendmsg(list(islice(views, _SENDMSG_MAX_BUFFERS)))
+        while sent:
+            first = views[0]
+            if sent >= len(first):
+                sent -= len(first)
+                views.popleft()
+            else:
+                views[0] = first[sent:]
+                sent = 0
+
+
+def _read_frame(
+    conn: socket.socket, ignore_socket_timeout=False, recv_buffer=None
+):
+    """Block read a single PROTO_V2 frame, raw data of returned WuKongPkg
+    is a memoryview into `recv_buffer`"""
+    recv_buffer = recv_buffer or RecvBuffer(FRAME_HEADER.size)
+
+    header = recv_buffer.reserve(FRAME_HEADER.size)
+    err_pkg = recv_exactly_into(conn, header, ignore_socket_timeout)
+    if err_pkg is not None:
+        return err_pkg
+    (msg_body_size,) = FRAME_HEADER.unpack(header)
+    if msg_body_size == 0:
+        return WuKongPkg()
+    body = recv_buffer.reserve(msg_body_size)
+    err_pkg = recv_exactly_into(conn, body, ignore_socket_timeout)
+    if err_pkg is not None:
+        return err_pkg
+    return WuKongPkg(body)
+
+
+def parse_segment_header(header) -> (int, bool):
+    """parse PROTO_V1 segment header,
+    returns (size of segment body, whether has next segment)"""
+    size = bytes(header[:__body_mark_length]).replace(b"x", b"")
+    return int(size.decode()), header[HAS_NEXT_SEGMENT_INDEX] == ord("T")
+
+
+def parse_advertised_proto(header) -> int:
+    """returns the protocol advertised by the header of the last PROTO_V1
+    segment of a msg, see `frame_hi`"""
+    flag = header[HAS_NEXT_SEGMENT_INDEX]
+    if ord("0") <= flag <= ord("9"):
+        return flag - ord("0")
+    return PROTO_V1
+
+
+def read_wukong_data(
+    conn: socket.socket,
+    ignore_socket_timeout=False,
+    proto_version=PROTO_V1,
+    recv_buffer=None,
+) -> WuKongPkg:
+    """Block read from tcp socket connection.
+    `recv_buffer` is a RecvBuffer reused by PROTO_V2 reads
+    """
+    if proto_version >= PROTO_V2:
+        return _read_frame(
+            conn,
+            ignore_socket_timeout=ignore_socket_timeout,
+            recv_buffer=recv_buffer,
+        )
+
+    buffer = bytearray()
+    while True:
+        # firstly, recv segment header
+        msg_header_bytes, err_pkg = recv_exactly(
+            conn, BYTES_HEADER_LEN, ignore_socket_timeout
+        )
+        if err_pkg is not None:
+            return err_pkg
+        msg_body_size, has_next_segment = parse_segment_header(
+            msg_header_bytes
+        )
+        if msg_body_size == 0:
+            break
+
+        # then recv segment body
+        data, err_pkg = recv_exactly(conn, msg_body_size, ignore_socket_timeout)
+        if err_pkg is not None:
+            return err_pkg
         buffer.extend(data)
 
         if not has_next_segment:
             break
-        # reset msg_body_size, then read it again from next segment
-        msg_body_size = -1
     ret = WuKongPkg(bytes(buffer))
+    ret.advertised_proto = parse_advertised_proto(msg_header_bytes)
     return ret
 
 
-def write_wukong_data(conn: socket.socket, msg: WuKongPkg) -> (bool, str):
+async def read_wukong_stream(
+    reader: asyncio.StreamReader, proto_version=PROTO_V1
+) -> WuKongPkg:
+    """asyncio version of `read_wukong_data`, read a msg from stream"""
+    try:
+        if proto_version >= PROTO_V2:
+            header = await reader.readexactly(FRAME_HEADER.size)
+            (size,) = FRAME_HEADER.unpack(header)
+            msg = await reader.readexactly(size) if size else b""
+        else:
+            buffer = bytearray()
+            while True:
+                header = await reader.readexactly(BYTES_HEADER_LEN)
+                size, has_next_segment = parse_segment_header(header)
+                if size == 0:
+                    break
+                buffer.extend(await reader.readexactly(size))
+                if not has_next_segment:
+                    break
+            pkg = WuKongPkg(bytes(buffer), proto_version=proto_version)
+            pkg.advertised_proto = parse_advertised_proto(header)
+            return pkg
+    except asyncio.IncompleteReadError:
+        return WuKongPkg(is_socket_closed=True, proto_version=proto_version)
+    except OSError as e:
+        return WuKongPkg(
+            err="%s,%s" % (e.__class__, e.args), proto_version=proto_version
+        )
+    return WuKongPkg(msg, proto_version=proto_version)
+
+
+def write_wukong_data(
+    conn: socket.socket, msg: WuKongPkg, proto_version=PROTO_V1
+) -> (bool, str):
     """NOTE: send an empty byte is allowed"""
+    return write_wukong_parts(conn, [msg.raw_data], proto_version)
+
+
+def write_wukong_parts(
+    conn: socket.socket, parts: list, proto_version=PROTO_V1
+) -> (bool, str):
+    """write a msg consisting of `parts`, all parts are sent as one
+    scatter-gather write, see `sendall_buffers`"""
+    return write_wukong_msgs(conn, [parts], proto_version=proto_version)
+
+
+def write_wukong_msgs(
+    conn: socket.socket, msgs: list, proto_version=PROTO_V1
+) -> (bool, str):
+    """write many msgs back-to-back within one scatter-gather write,
+    each msg is bytes or a list of parts"""
+    try:
+        sendall_buffers(conn, frame_msgs(msgs, proto_version))
+    except socket.error as e:
+        return False, "%s,%s" % (e.__class__, e.args)
+    return True, ""
+
+
+def frame_msgs(msgs: list, proto_version=PROTO_V1) -> list:
+    """returns buffers of framed msgs, each msg is bytes or a list of parts"""
+    buffers = []
+    for parts in msgs:
+        if not isinstance(parts, list):
+            parts = [parts]
+        if proto_version >= PROTO_V2:
+            buffers.append(FRAME_HEADER.pack(sum(len(p) for p in parts)))
+            buffers.extend(parts)
+        else:
+            buffers.extend(
+                segment_legacy_msg(
+                    parts[0] if len(parts) == 1 else b"".join(parts)
+                )
+            )
+    return buffers
 
-    _bytes_msg_len = len(msg.raw_data)
-    sent_index = -1
-    err = ""
 
-    def _send_bytes(msg: bytes):
-        try:
-            conn.send(msg)
-            return True
-        except socket.error as e:
-            nonlocal err
-            err = "%s,%s" % (e.__class__, e.args)
-            return False
+def frame_hi(proto_version=PROTO_LATEST) -> list:
+    """returns buffers of QUEUE_HI framed in PROTO_V1, the has-next flag of
+    its segment header is `proto_version` rather than "F". Old clients take
+    any flag but "T" as the last segment, and the msg is still the bare
+    QUEUE_HI they compare with, old servers send "F", i.e. PROTO_V1"""
+    return segment_legacy_msg(QUEUE_HI, last_flag=b"%d" % proto_version)
+
 
-    # split segment to send
-    while sent_index < _bytes_msg_len:
-        sent_index = 0 if sent_index == -1 else sent_index
-        has_next = b"F"
+def segment_legacy_msg(raw_data, last_flag=b"F") -> list:
+    """split PROTO_V1 msg into segments, each has a header, the has-next
+    flag of the last one is `last_flag`"""
+    raw_data = memoryview(raw_data)
+    _bytes_msg_len = len(raw_data)
+    buffers = []
+    sent_index = 0
+    while True:
+        has_next = last_flag
         end = sent_index + SEGMENT_MAX_SIZE
         if _bytes_msg_len > end:
             has_next = b"T"
-        part_raw_msg = msg.raw_data[sent_index:end]
+        part_raw_msg = raw_data[sent_index:end]
         msg_len = str(len(part_raw_msg)).encode()
 
         # fixed length
         msg_len = (4 - len(msg_len)) * b"x" + msg_len
-        header = HEADER_DELIMITER.join([msg_len, has_next])
-        need_send_bytes = b"".join([header, part_raw_msg])
-        if not _send_bytes(need_send_bytes):
-            return False, err
+        buffers.append(HEADER_DELIMITER.join([msg_len, has_next]))
+        buffers.append(part_raw_msg)
         sent_index += SEGMENT_MAX_SIZE
-
-    return True, err
+        if sent_index >= _bytes_msg_len:
+            return buffers
 
 
 class TcpConn:
@@ -236,43 +688,115 @@ class TcpConn:
             self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
             self.sock.settimeout(conn_timeout)
         self.err = None
+        # every connection speaks PROTO_V1 until it is upgraded
+        # by QUEUE_PROTO negotiation
+        self.proto_version = PROTO_V1
+        # created on first read, listening socket never needs it
+        self._recv_buffer = None
 
     def write(self, data) -> bool:
-        ok, self.err = write_wukong_data(self.sock, WuKongPkg(data))
+        """`data` is bytes, or parts of msg returned by `wrap_msg`"""
+        return self.write_many([data])
+
+    def write_many(self, msgs: list) -> bool:
+        """write msgs returned by `wrap_msg` within one write"""
+        ok, self.err = write_wukong_msgs(
+            self.sock, msgs, proto_version=self.proto_version
+        )
         return ok
 
+    def wrap_msg(
+        self, queue_cmd: bytes, args=None, data=None, exception=None
+    ):
+        """wrap a queue msg according to current protocol, the returned
+        value can be passed to `write`, see `wrap_queue_msg_parts`"""
+        return wrap_queue_msg_parts(
+            queue_cmd,
+            args=args,
+            data=data,
+            exception=exception,
+            proto_version=self.proto_version,
+        )
+
+    def write_msg(
+        self, queue_cmd: bytes, args=None, data=None, exception=None
+    ) -> bool:
+        return self.write(
+            self.wrap_msg(queue_cmd, args=args, data=data, exception=exception)
+        )
+
+    def write_hi(self) -> bool:
+        """greet a new connection, see `frame_hi`"""
+        try:
+            sendall_buffers(self.sock, frame_hi())
+        except socket.error as e:
+            self.err = "%s,%s" % (e.__class__, e.args)
+            return False
+        return True
+
     def read(self, ignore_socket_timeout=False):
-        return read_wukong_data(
-            self.sock, ignore_socket_timeout=ignore_socket_timeout
+        """NOTE: in PROTO_V2, the msg read is only valid until next read"""
+        if self._recv_buffer is None:
+            self._recv_buffer = RecvBuffer()
+        pkg = read_wukong_data(
+            self.sock,
+            ignore_socket_timeout=ignore_socket_timeout,
+            proto_version=self.proto_version,
+            recv_buffer=self._recv_buffer,
         )
+        pkg.proto_version = self.proto_version
+        return pkg
 
     def close(self):
+        # wake up the thread blocked in reading it, such as a subscribed
+        # connection waiting for credit
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
         self.sock.close()
 
 
 class TcpSvr(TcpConn):
-    def __init__(self, host, port):
+    def __init__(self, host, port, backlog=128, reuse_port=False):
         """
         :param host: ...
         :param port: ...
+        :param backlog: max number of connections not accepted yet, a
+        burst of reconnecting clients beyond it are refused
+        :param reuse_port: set SO_REUSEPORT, so that many TcpSvr can listen
+        to the same port, then the kernel distributes connections to them
         """
         super().__init__()
         try:
+            if os.name != "nt":
+                # rebind at once after restart, though connections of last
+                # run are still in TIME_WAIT. Windows allows to steal the
+                # port with SO_REUSEADDR, so not set there
+                self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            if reuse_port:
+                if not hasattr(socket, "SO_REUSEPORT"):
+                    raise OSError("SO_REUSEPORT is not supported")
+                self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
             self.sock.bind((host, port))
         except OSError:
             self.sock.close()
             raise
 
-        # the backlog parameter is commonly set a large value to
-        # handle High concurrent connection requests, It's enough
-        # to set 0 here.
-        # https://tangentsoft.net/wskfaq/advanced.html#backlog
-        # https://www.mkssoftware.com/docs/man3/listen.3.asp
-        self.sock.listen(0)
+        self.sock.listen(backlog)
 
     def accept(self):
         return self.sock.accept()
 
+    def close(self):
+        # wake up the thread blocked in accept(), otherwise it keeps the
+        # socket listening though closed
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.sock.close()
+
 
 class TcpClient(TcpConn):
     def __init__(self, host, port, conn_timeout):
@@ -331,5 +855,53 @@ QUEUE_RESET = b"RESET"
 QUEUE_CLIENTS = b"CLIENTS"
 QUEUE_TASK_DONE = b"TASK_DONE"
 QUEUE_JOIN = b"JOIN"
+QUEUE_PROTO = b"PROTO"
+# batch cmds, `PUT_MANY` would conflict with `PUT`, see _check_all_queue_cmds
+QUEUE_PUT_MANY = b"MPUT"
+QUEUE_GET_MANY = b"MGET"
+QUEUE_STATS = b"STATS"
+QUEUE_LEASE = b"LEASE"
+QUEUE_ACK = b"ACK"
+QUEUE_NACK = b"NACK"
+# a subscribed connection is pushed items by server, client replies
+# nothing but gives credit for more items, see WuKongQueue._push
+QUEUE_SUBSCRIBE = b"SUBSCRIBE"
+QUEUE_CREDIT = b"CREDIT"
 
 _check_all_queue_cmds()
+
+# opcodes of PROTO_V2 envelope, never reuse or renumber an opcode
+_CMD_OPCODES = {
+    QUEUE_HI: 1,
+    QUEUE_AUTH_KEY: 2,
+    QUEUE_NEED_AUTH: 3,
+    QUEUE_AUTH_FAIL: 4,
+    QUEUE_PUT: 5,
+    QUEUE_GET: 6,
+    QUEUE_DATA: 7,
+    QUEUE_FULL: 8,
+    QUEUE_EMPTY: 9,
+    QUEUE_NORMAL: 10,
+    QUEUE_QUERY_STATUS: 11,
+    QUEUE_OK: 12,
+    QUEUE_FAIL: 13,
+    QUEUE_PING: 14,
+    QUEUE_PONG: 15,
+    QUEUE_SIZE: 16,
+    QUEUE_MAXSIZE: 17,
+    QUEUE_RESET: 18,
+    QUEUE_CLIENTS: 19,
+    QUEUE_TASK_DONE: 20,
+    QUEUE_JOIN: 21,
+    QUEUE_PROTO: 22,
+    QUEUE_PUT_MANY: 23,
+    QUEUE_GET_MANY: 24,
+    QUEUE_STATS: 25,
+    QUEUE_LEASE: 26,
+    QUEUE_ACK: 27,
+    QUEUE_NACK: 28,
+    QUEUE_SUBSCRIBE: 29,
+    QUEUE_CREDIT: 30,
+}
+
+_OPCODE_CMDS = {v: k for k, v in _CMD_OPCODES.items()}
@@ -1,8 +1,7 @@
 # -*- coding: utf-8 -*-
-import pickle
 from typing import Any
 
-from .utils import Unify_encoding
+from .serializer import DEFAULT_SERIALIZER, Compressor, codec_of
 
 type_name_map = {
     bytes: b"byte",
@@ -30,14 +29,80 @@ type_name_map_reversed = {v: k for k, v in type_name_map.items()}
 #         self.encoding = Unify_encoding
 
 
-def item_wrapper(item: Any) -> bytes:
-    return pickle.dumps(item)
+class Serialized(bytes):
+    """An item serialized by item_wrapper, server keeps items put by
+    clients as Serialized, and item_wrapper returns it as is, so an item is
+    never deserialized/serialized by server on its way from producer to
+    consumer
+    """
 
 
-def item_unwrap(item_pickled: bytes) -> Any:
-    if len(item_pickled) == 0:
+class SerializedParts(list):
+    """An item serialized by item_wrapper_parts, it's a list of buffers
+    which are sent in order without joining them"""
+
+
+class ItemBatch(list):
+    """Items of batch cmds, each item is serialized separately rather than
+    pickling the list, so that server can keep them as Serialized"""
+
+
+def item_wrapper(
+    item: Any,
+    serializer=DEFAULT_SERIALIZER,
+    compressor=None,
+    compress_threshold=0,
+) -> bytes:
+    """serialize with codec id, see wukongqueue.serializer, then compress
+    it by `compressor` if its size is at least `compress_threshold`, the
+    compressed one is used only if it's smaller"""
+    parts = item_wrapper_parts(item, serializer, compressor, compress_threshold)
+    return parts[0] if len(parts) == 1 else b"".join(parts)
+
+
+def item_wrapper_parts(
+    item: Any,
+    serializer=DEFAULT_SERIALIZER,
+    compressor=None,
+    compress_threshold=0,
+) -> list:
+    """like item_wrapper, but returns buffers of the serialized item,
+    big buffers of the item may be some of them, see PickleSerializer"""
+    if isinstance(item, Serialized):
+        return [item]
+    if isinstance(item, SerializedParts):
+        return item
+    parts = serializer.encode_parts(item)
+    if compressor is not None:
+        if sum(len(p) for p in parts) >= compress_threshold:
+            data = parts[0] if len(parts) == 1 else b"".join(parts)
+            compressed = compressor.encode(data)
+            if len(compressed) < len(data):
+                return [compressed]
+            return [data]
+    return parts
+
+
+def item_unwrap(item_serialized: bytes) -> Any:
+    """decompress and deserialize by the codec of its codec id"""
+    if len(item_serialized) == 0:
         return b""
-    return pickle.loads(item_pickled, encoding=Unify_encoding)
+    codec = codec_of(item_serialized[0])
+    if codec is DEFAULT_SERIALIZER:
+        # pickle has no codec id prefixed
+        return codec.loads(item_serialized)
+    payload = memoryview(item_serialized)[1:]
+    if isinstance(codec, Compressor):
+        return item_unwrap(codec.decompress(payload))
+    return codec.loads(payload)
+
+
+def item_value(item: Any) -> Any:
+    """returns the object of an item which may be Serialized or
+    SerializedParts"""
+    if isinstance(item, (Serialized, SerializedParts)):
+        return item_unwrap(item_wrapper(item))
+    return item
 
 
 # def item_wrapper(item: Any, encoding) -> ItemWrapped:
@@ -0,0 +1,393 @@
+# -*- coding: utf-8 -*-
+"""
+Storage of WuKongQueue items, see `FifoQueue`, `SpillQueue`,
+`PriorityQueue`, `LifoQueue` and `TopicQueue`. Besides the apis of collections.deque used
+by WuKongQueue, each has `peek` returning the item popped next.
+"""
+import heapq
+import mmap
+import os
+import shutil
+import struct
+import tempfile
+import weakref
+from collections import deque
+from itertools import count
+
+from ._item_wrapper import item_wrapper, Serialized
+
+__all__ = [
+    "Expiring",
+    "FifoQueue",
+    "SpillQueue",
+    "PriorityQueue",
+    "LifoQueue",
+    "TopicQueue",
+]
+
+# size of item, deadline of Expiring or 0
+_ITEM_HEADER = struct.Struct("!Id")
+
+
+class Expiring:
+    """an item with a ttl, it expires at the monotonic time `deadline`"""
+
+    __slots__ = ("item", "deadline")
+
+    def __init__(self, item, deadline):
+        self.item = item
+        self.deadline = deadline
+
+
+class _Segment:
+    """a memory-mapped file of `size | deadline | pickled item` records,
+    written once from the beginning and read once in the same order"""
+
+    def __init__(self, path, size):
+        self.path = path
+        with open(path, "w+b") as f:
+            f.truncate(size)
+            self._mm = mmap.mmap(f.fileno(), size)
+        self.size = size
+        self.write_offset = 0
+        self.read_offset = 0
+        # number of items written and not read yet
+        self.items = 0
+
+    def free(self) -> int:
+        return self.size - self.write_offset - _ITEM_HEADER.size
+
+    def write(self, data: bytes, deadline=0.0):
+        offset = self.write_offset
+        _ITEM_HEADER.pack_into(self._mm, offset, len(data), deadline)
+        offset += _ITEM_HEADER.size
+        self._mm[offset : offset + len(data)] = data
+        self.write_offset = offset + len(data)
+        self.items += 1
+
+    def read(self):
+        """returns the item as Serialized, or Expiring of it"""
+        size, deadline = _ITEM_HEADER.unpack_from(self._mm, self.read_offset)
+        offset = self.read_offset + _ITEM_HEADER.size
+        self.read_offset = offset + size
+        self.items -= 1
+        return _loaded(self._mm[offset : offset + size], deadline)
+
+    def remove(self):
+        self._mm.close()
+        os.remove(self.path)
+
+
+def _loaded(data, deadline):
+    item = Serialized(data)
+    return Expiring(item, deadline) if deadline else item
+
+
+class FifoQueue(deque):
+    """A deque with `peek`"""
+
+    def peek(self):
+        # IndexError if empty like popleft
+        return self[0]
+
+
+class SpillQueue:
+    """A FIFO with the same apis as collections.deque used by WuKongQueue,
+    it keeps at most `memory_items` items in memory: the head is popped
+    from memory, the tail is appended in memory, and the middle of the
+    queue is spilled to memory-mapped segment files, so a big backlog
+    costs page cache rather than heap.
+
+    Items spilled are serialized, they are popped as Serialized rather than
+    the objects appended, Serialized items are spilled as they are. The
+    item of an Expiring is spilled with its deadline.
+    """
+
+    def __init__(
+        self, spill_dir, memory_items=100000, segment_size=64 * 1024 * 1024
+    ):
+        """
+        :param spill_dir: segment files are created in a private
+        sub-directory of it, they are not kept after the process exits
+        :param memory_items: max number of items kept in memory
+        :param segment_size: size in bytes of a segment file, an item
+        larger than it gets a segment of its own
+        """
+        if memory_items < 2:
+            raise ValueError("'memory_items' must be at least 2")
+        os.makedirs(spill_dir, exist_ok=True)
+        self._dir = tempfile.mkdtemp(prefix="wukongqueue-", dir=spill_dir)
+        # removes the directory once closed, garbage collected or at exit
+        self._remove_dir = weakref.finalize(
+            self, shutil.rmtree, self._dir, ignore_errors=True
+        )
+        self.memory_items = memory_items
+        self.segment_size = segment_size
+        self._head = deque()
+        self._tail = deque()
+        self._segments = deque()
+        self._spilled = 0
+        self._segment_id = 0
+
+    def __len__(self):
+        return len(self._head) + self._spilled + len(self._tail)
+
+    def __bool__(self):
+        return len(self) > 0
+
+    def __iter__(self):
+        yield from self._head
+        for segment in self._segments:
+            offset = segment.read_offset
+            for _ in range(segment.items):
+                size, deadline = _ITEM_HEADER.unpack_from(segment._mm, offset)
+                offset += _ITEM_HEADER.size
+                yield _loaded(segment._mm[offset : offset + size], deadline)
+                offset += size
+        yield from self._tail
+
+    def append(self, item):
+        self._tail.append(item)
+        if len(self._head) + len(self._tail) > self.memory_items:
+            self._spill()
+
+    def extend(self, items):
+        for item in items:
+            self.append(item)
+
+    def popleft(self):
+        if not self._head:
+            if self._spilled:
+                self._load()
+            elif self._tail:
+                return self._tail.popleft()
+        # IndexError if empty like deque
+        return self._head.popleft()
+
+    def peek(self):
+        if not self._head:
+            if self._spilled:
+                self._load()
+            elif self._tail:
+                return self._tail[0]
+        # IndexError if empty like popleft
+        return self._head[0]
+
+    def clear(self):
+        self._head.clear()
+        self._tail.clear()
+        while self._segments:
+            self._segments.popleft().remove()
+        self._spilled = 0
+
+    def _spill(self):
+        """move the tail to the middle, or to the head if nothing spilled
+        so far, half of `memory_items` is left for the head"""
+        if not self._spilled and len(self._head) < self.memory_items // 2:
+            while self._tail and len(self._head) < self.memory_items // 2:
+                self._head.append(self._tail.popleft())
+            return
+        while self._tail:
+            item = self._tail.popleft()
+            deadline = 0.0
+            if type(item) is Expiring:
+                item, deadline = item.item, item.deadline
+            data = item_wrapper(item)
+            segment = self._segments[-1] if self._segments else None
+            if segment is None or segment.free() < len(data):
+                segment = self._new_segment(len(data))
+            segment.write(data, deadline)
+            self._spilled += 1
+
+    def _load(self):
+        """load items of the middle into the head"""
+        n = max(self.memory_items // 2 - len(self._head), 1)
+        while n and self._spilled:
+            segment = self._segments[0]
+            self._head.append(segment.read())
+            self._spilled -= 1
+            n -= 1
+            if not segment.items:
+                segment.remove()
+                self._segments.popleft()
+
+    def _new_segment(self, min_size) -> _Segment:
+        path = os.path.join(self._dir, "%d.seg" % self._segment_id)
+        self._segment_id += 1
+        segment = _Segment(
+            path, max(self.segment_size, min_size + _ITEM_HEADER.size)
+        )
+        self._segments.append(segment)
+        return segment
+
+    def close(self):
+        """remove all segment files and their directory, items spilled are
+        dropped"""
+        self.clear()
+        self._remove_dir()
+
+
+class PriorityQueue:
+    """A heap with the same apis as collections.deque used by WuKongQueue,
+    `append`/`extend` take a priority and `popleft` pops the item of the
+    lowest priority, items of the same priority are popped in the order
+    they were appended. Both cost O(log n).
+    """
+
+    def __init__(self):
+        # (priority, seq, item), seq is unique, so items never compared
+        self._heap = []
+        self._seq = count()
+
+    def __len__(self):
+        return len(self._heap)
+
+    def __bool__(self):
+        return len(self._heap) > 0
+
+    def __iter__(self):
+        """items in the order of popping"""
+        for entry in sorted(self._heap):
+            yield entry[2]
+
+    def append(self, item, priority=0):
+        heapq.heappush(self._heap, (priority, next(self._seq), item))
+
+    def extend(self, items, priority=0):
+        for item in items:
+            heapq.heappush(self._heap, (priority, next(self._seq), item))
+
+    def popleft(self):
+        # IndexError if empty like deque
+        return heapq.heappop(self._heap)[2]
+
+    def popleft_with_priority(self):
+        """returns (item, priority) of the item popped by popleft"""
+        priority, _, item = heapq.heappop(self._heap)
+        return item, priority
+
+    def peek(self):
+        return self._heap[0][2]
+
+    def clear(self):
+        self._heap.clear()
+
+
+class LifoQueue(deque):
+    """A deque whose `popleft` pops the item appended last"""
+
+    popleft = deque.pop
+
+    def peek(self):
+        return self[-1]
+
+
+class TopicQueue:
+    """An append-only buffer read by consumer groups, each group has its
+    own cursor, so an item is stored once and read by every group. It has
+    the same apis as collections.deque used by WuKongQueue, `popleft` drops
+    the oldest item for all groups, and items read by all groups are
+    dropped by `read`. A new group starts at the oldest item, items are
+    kept until read if there are no groups.
+    """
+
+    def __init__(self):
+        # items from index `_head` are kept, the list is compacted once
+        # half of it is dropped, so an item is accessed by seq in O(1)
+        self._items = []
+        self._head = 0
+        # seq of the oldest item kept
+        self._base = 0
+        # group -> seq of the next item it reads, it may be behind _base
+        # once items are dropped by popleft
+        self._cursors = {}
+        # group -> number of items read
+        self._read = {}
+
+    def __len__(self):
+        return len(self._items) - self._head
+
+    def __bool__(self):
+        return len(self) > 0
+
+    def __iter__(self):
+        return iter(self._items[self._head :])
+
+    def append(self, item):
+        self._items.append(item)
+
+    def extend(self, items):
+        self._items.extend(items)
+
+    def popleft(self):
+        if not self:
+            raise IndexError("pop from an empty TopicQueue")
+        item = self._items[self._head]
+        self._drop(1)
+        return item
+
+    def peek(self):
+        if not self:
+            raise IndexError("peek from an empty TopicQueue")
+        return self._items[self._head]
+
+    def clear(self):
+        self._drop(len(self))
+
+    def _drop(self, n):
+        items = self._items
+        for i in range(self._head, self._head + n):
+            items[i] = None
+        self._head += n
+        self._base += n
+        if self._head > 1024 and self._head * 2 > len(items):
+            del items[: self._head]
+            self._head = 0
+
+    def add_group(self, group):
+        """the group starts at the oldest item, nothing is done if it
+        exists"""
+        if group not in self._cursors:
+            self._cursors[group] = self._base
+            self._read[group] = 0
+
+    def remove_group(self, group) -> int:
+        """returns number of items dropped since only the group hadn't
+        read them"""
+        self._cursors.pop(group, None)
+        self._read.pop(group, None)
+        return self._trim()
+
+    def lag(self, group) -> int:
+        """number of items `group` hasn't read"""
+        cursor = self._cursors.get(group, self._base)
+        return self._base + len(self) - max(cursor, self._base)
+
+    def read(self, group, max_items) -> (list, int):
+        """read up to `max_items` items at the cursor of `group`, the group
+        is added if not existing. Returns (items, number of items dropped
+        since all groups have read them)"""
+        self.add_group(group)
+        cursor = max(self._cursors[group], self._base)
+        start = self._head + cursor - self._base
+        items = self._items[start : start + max_items]
+        self._cursors[group] = cursor + len(items)
+        self._read[group] += len(items)
+        return items, self._trim()
+
+    def _trim(self) -> int:
+        if not self._cursors:
+            return 0
+        n = min(self._cursors.values()) - self._base
+        if n <= 0:
+            return 0
+        self._drop(n)
+        return n
+
+    def groups(self) -> dict:
+        """group -> {"lag": number of items not read, "read": number of
+        items read}"""
+        return {
+            group: {"lag": self.lag(group), "read": self._read[group]}
+            for group in self._cursors
+        }
@@ -0,0 +1,454 @@
+# -*- coding: utf-8 -*-
+"""
+Write-ahead log of WuKongQueue contents, see `WriteAheadLog`.
+
+The log is a directory of segment files named by sequence number, each
+is a sequence of records:
+    type(1 byte) | payload length(4 bytes) | crc32 of payload(4 bytes) | payload
+
+Every put item gets a sequence number (seq), a segment starts with a
+STATE record holding (head seq, next seq, unfinished tasks), so a segment
+is deleted once all items put in it have been got, and recovery replays
+only the segments left.
+
+A delayed item is logged by a DELAY record with an id and its due time as
+a unix timestamp, it gets a seq once due by a DUE record. Delayed items not
+due yet are logged again after STATE of every new segment, so they survive
+the deletion of the segment they were put in.
+"""
+import os
+import struct
+import threading
+import zlib
+from collections import deque
+
+from ._item_wrapper import item_wrapper, Serialized
+from .utils import new_thread
+
+__all__ = [
+    "WriteAheadLog",
+    "FSYNC_ALWAYS",
+    "FSYNC_INTERVAL",
+    "FSYNC_NEVER",
+]
+
+# fsync before the mutating api returns, concurrent callers share an fsync
+FSYNC_ALWAYS = "always"
+# fsync by a background thread every `fsync_interval` seconds
+FSYNC_INTERVAL = "interval"
+# never fsync, the log survives a crash of process but not of OS
+FSYNC_NEVER = "never"
+
+_RECORD_HEADER = struct.Struct("!BII")
+_STATE = struct.Struct("!QQq")
+_COUNT = struct.Struct("!I")
+# id, due unix timestamp
+_DELAY = struct.Struct("!Qd")
+
+_REC_STATE = 1
+_REC_PUT = 2
+_REC_GET = 3
+_REC_TASK_DONE = 4
+_REC_RESET = 5
+_REC_DROP = 6
+# put back an item got, it's still an unfinished task
+_REC_REQUEUE = 7
+# put a delayed item, and ids of delayed items moved into the queue
+_REC_DELAY = 8
+_REC_DUE = 9
+# a delayed item not due at the start of segment, it's part of STATE
+_REC_DELAYED = 10
+
+_SEGMENT_SUFFIX = ".wal"
+
+
+def _record(rec_type, payload=b"") -> bytes:
+    return (
+        _RECORD_HEADER.pack(rec_type, len(payload), zlib.crc32(payload))
+        + payload
+    )
+
+
+def _read_records(path):
+    """yields (record type, payload) of a segment, a torn or corrupted
+    tail left by a crash is truncated"""
+    with open(path, "rb") as f:
+        data = f.read()
+    offset = 0
+    while offset < len(data):
+        end = offset + _RECORD_HEADER.size
+        if end > len(data):
+            break
+        rec_type, size, crc = _RECORD_HEADER.unpack_from(data, offset)
+        payload = data[end : end + size]
+        if len(payload) != size or zlib.crc32(payload) != crc:
+            break
+        yield rec_type, payload
+        offset = end + size
+    if offset < len(data):
+        with open(path, "r+b") as f:
+            f.truncate(offset)
+
+
+def _ids(payload) -> tuple:
+    return struct.unpack("!%dQ" % (len(payload) // 8), payload)
+
+
+class WriteAheadLog:
+    def __init__(
+        self,
+        persist_dir,
+        fsync=FSYNC_ALWAYS,
+        fsync_interval=0.1,
+        segment_size=64 * 1024 * 1024,
+    ):
+        """
+        :param persist_dir: directory of segment files, created if missing
+        :param fsync: FSYNC_ALWAYS, FSYNC_INTERVAL or FSYNC_NEVER
+        :param fsync_interval: seconds between fsync of FSYNC_INTERVAL
+        :param segment_size: a new segment is started once the current one
+        is larger than it
+        """
+        if fsync not in (FSYNC_ALWAYS, FSYNC_INTERVAL, FSYNC_NEVER):
+            raise ValueError("invalid fsync policy:%s" % fsync)
+        self.persist_dir = persist_dir
+        self.fsync = fsync
+        self.fsync_interval = fsync_interval
+        self.segment_size = segment_size
+        os.makedirs(persist_dir, exist_ok=True)
+
+        # seq of the item got next
+        self.head_seq = 0
+        # seq of the item put next
+        self.next_seq = 0
+        self.unfinished_tasks = 0
+        # id -> (due unix timestamp, item) of delayed items not due yet
+        self._delayed = {}
+        self._next_delay_id = 1
+        # (first seq, path) of segments, the last one is being written
+        self._segments = deque()
+        self._file = None
+        self._file_size = 0
+
+        # lock of writing, must be held whenever appending records
+        self._lock = threading.Lock()
+        # lock of fsync, it's separate, so others append meanwhile
+        self._sync_lock = threading.Lock()
+        # log sequence number, count of records written and synced
+        self._written_lsn = 0
+        self._synced_lsn = 0
+        # thread of FSYNC_INTERVAL, it exits once `_closed` is set
+        self._sync_thread = None
+        self._closed = threading.Event()
+
+    def recover(self) -> (list, list, int):
+        """replay segments, returns (items in queue, delayed items not due
+        yet, unfinished tasks), then starts a new segment for writing.
+        Delayed items are (due unix timestamp, id, item) in order of
+        putting, items are returned as Serialized, they are unpickled by
+        whoever gets them"""
+        segments = []
+        for name in os.listdir(self.persist_dir):
+            if name.endswith(_SEGMENT_SUFFIX):
+                segments.append(int(name[: -len(_SEGMENT_SUFFIX)]))
+            elif name.endswith(_SEGMENT_SUFFIX + ".tmp"):
+                # left by a crash while rolling segment
+                os.remove(os.path.join(self.persist_dir, name))
+        segments.sort()
+        items = deque()
+        for first_seq in segments:
+            path = self._segment_path(first_seq)
+            self._segments.append((first_seq, path))
+            for rec_type, payload in _read_records(path):
+                if rec_type == _REC_STATE:
+                    # same as replaying the segments before, but the
+                    # records of a segment replaced by this one are lost
+                    (
+                        self.head_seq,
+                        self.next_seq,
+                        self.unfinished_tasks,
+                    ) = _STATE.unpack(payload)
+                    # followed by DELAYED records of them
+                    self._delayed.clear()
+                elif rec_type == _REC_PUT:
+                    items.append((self.next_seq, payload))
+                    self.next_seq += 1
+                    self.unfinished_tasks += 1
+                elif rec_type == _REC_REQUEUE:
+                    items.append((self.next_seq, payload))
+                    self.next_seq += 1
+                elif rec_type == _REC_GET:
+                    (n,) = _COUNT.unpack(payload)
+                    self.head_seq += n
+                elif rec_type == _REC_TASK_DONE:
+                    # the count is omitted if it's 1
+                    self.unfinished_tasks -= (
+                        _COUNT.unpack(payload)[0] if payload else 1
+                    )
+                elif rec_type in (_REC_DELAY, _REC_DELAYED):
+                    delay_id, due = _DELAY.unpack_from(payload)
+                    self._delayed[delay_id] = (due, payload[_DELAY.size :])
+                    self._next_delay_id = max(
+                        self._next_delay_id, delay_id + 1
+                    )
+                    if rec_type == _REC_DELAY:
+                        self.unfinished_tasks += 1
+                elif rec_type == _REC_DUE:
+                    for delay_id in _ids(payload):
+                        item = self._delayed.pop(delay_id, None)
+                        if item is not None:
+                            items.append((self.next_seq, item[1]))
+                            self.next_seq += 1
+                elif rec_type == _REC_RESET:
+                    self.head_seq = self.next_seq
+                    self._delayed.clear()
+                elif rec_type == _REC_DROP:
+                    (n,) = _COUNT.unpack(payload)
+                    self.head_seq += n
+                    self.unfinished_tasks -= n
+                # items of segments already deleted are never in `items`
+                while items and items[0][0] < self.head_seq:
+                    items.popleft()
+
+        with self._lock:
+            self._open()
+        delayed = [
+            (due, delay_id, Serialized(payload))
+            for delay_id, (due, payload) in sorted(self._delayed.items())
+        ]
+        return (
+            [Serialized(payload) for _, payload in items],
+            delayed,
+            self.unfinished_tasks,
+        )
+
+    def _segment_path(self, first_seq):
+        return os.path.join(
+            self.persist_dir, "%020d%s" % (first_seq, _SEGMENT_SUFFIX)
+        )
+
+    def _roll_segment(self):
+        """must be called with `_lock` held, start a new segment with
+        STATE, and delete old segments whose items were all got"""
+        if self._file is not None:
+            self._close_file()
+        path = self._segment_path(self.next_seq)
+        # the new segment may replace the last one if nothing was put
+        # since, so it's written aside then renamed atomically
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(
+                _record(
+                    _REC_STATE,
+                    _STATE.pack(
+                        self.head_seq, self.next_seq, self.unfinished_tasks
+                    ),
+                )
+            )
+            for delay_id, (due, payload) in self._delayed.items():
+                f.write(
+                    _record(
+                        _REC_DELAYED, _DELAY.pack(delay_id, due) + payload
+                    )
+                )
+            f.flush()
+            self._sync_file(f)
+        os.replace(tmp_path, path)
+        self._sync_dir()
+        if self._segments and self._segments[-1][1] == path:
+            self._segments.pop()
+        self._segments.append((self.next_seq, path))
+        self._file = open(path, "ab", buffering=0)
+        self._file_size = self._file.tell()
+        self._drop_consumed_segments()
+
+    def _drop_consumed_segments(self):
+        """must be called with `_lock` held, delete segments whose items
+        were all got, the next segment starts with STATE for recovery"""
+        while len(self._segments) > 1 and self._segments[1][0] <= self.head_seq:
+            os.remove(self._segments.popleft()[1])
+
+    def _open(self):
+        """must be called with `_lock` held"""
+        self._roll_segment()
+        if self.fsync == FSYNC_INTERVAL:
+            self._closed.clear()
+            self._sync_thread = new_thread(self._sync_periodically)
+
+    def _append(self, records) -> int:
+        """must be called with `_lock` held, returns lsn of the last one"""
+        if self._file is None:
+            # reopened after close
+            self._open()
+        elif self._file_size >= self.segment_size:
+            self._roll_segment()
+        data = b"".join(records)
+        self._file.write(data)
+        self._file_size += len(data)
+        self._written_lsn += len(records)
+        return self._written_lsn
+
+    #
+    # Records of queue operations, they must be appended in the order of
+    # the operations, i.e. with the mutex of queue held. Pickling items is
+    # slow, it should be done by `encode_items` before taking the mutex.
+    #
+
+    @staticmethod
+    def encode_items(items) -> list:
+        return [_record(_REC_PUT, item_wrapper(item)) for item in items]
+
+    def log_put(self, records) -> int:
+        """`records` is returned by `encode_items`, returns lsn"""
+        with self._lock:
+            if not records:
+                return self._written_lsn
+            lsn = self._append(records)
+            self.next_seq += len(records)
+            self.unfinished_tasks += len(records)
+            return lsn
+
+    def log_delay(self, due, records) -> (list, int):
+        """`records` is returned by `encode_items`, the items are due at
+        the unix timestamp `due`, returns (ids of them, lsn)"""
+        with self._lock:
+            ids = []
+            delay_records = []
+            for record in records:
+                delay_id = self._next_delay_id
+                self._next_delay_id += 1
+                payload = bytes(record[_RECORD_HEADER.size :])
+                self._delayed[delay_id] = (due, payload)
+                ids.append(delay_id)
+                delay_records.append(
+                    _record(_REC_DELAY, _DELAY.pack(delay_id, due) + payload)
+                )
+            lsn = self._append(delay_records) if delay_records else 0
+            self.unfinished_tasks += len(ids)
+            return ids, lsn
+
+    def log_due(self, ids) -> int:
+        """delayed items of `ids` were moved into the queue"""
+        with self._lock:
+            if not ids:
+                return self._written_lsn
+            lsn = self._append(
+                [_record(_REC_DUE, struct.pack("!%dQ" % len(ids), *ids))]
+            )
+            for delay_id in ids:
+                del self._delayed[delay_id]
+            self.next_seq += len(ids)
+            return lsn
+
+    def log_requeue(self, items) -> int:
+        """put back `items` got, they are not new tasks"""
+        records = [_record(_REC_REQUEUE, item_wrapper(item)) for item in items]
+        with self._lock:
+            lsn = self._append(records)
+            self.next_seq += len(records)
+            return lsn
+
+    def log_get(self, n=1) -> int:
+        with self._lock:
+            lsn = self._append([_record(_REC_GET, _COUNT.pack(n))])
+            self.head_seq += n
+            self._drop_consumed_segments()
+            return lsn
+
+    def log_drop(self, n) -> int:
+        """`n` items got without being tasks any more"""
+        with self._lock:
+            lsn = self._append([_record(_REC_DROP, _COUNT.pack(n))])
+            self.head_seq += n
+            self.unfinished_tasks -= n
+            self._drop_consumed_segments()
+            return lsn
+
+    def log_task_done(self, n=1) -> int:
+        with self._lock:
+            lsn = self._append(
+                [_record(_REC_TASK_DONE, _COUNT.pack(n) if n != 1 else b"")]
+            )
+            self.unfinished_tasks -= n
+            return lsn
+
+    def log_reset(self) -> int:
+        with self._lock:
+            lsn = self._append([_record(_REC_RESET)])
+            self.head_seq = self.next_seq
+            self._delayed.clear()
+            self._drop_consumed_segments()
+            return lsn
+
+    #
+    # fsync
+    #
+
+    def sync(self, lsn=None):
+        """called before a mutating api returns, make records up to `lsn`
+        (all written by default) durable if fsync policy is FSYNC_ALWAYS"""
+        if self.fsync == FSYNC_ALWAYS:
+            self._sync_to(self._written_lsn if lsn is None else lsn)
+
+    def needs_sync(self) -> bool:
+        """whether `sync` would fsync"""
+        return (
+            self.fsync == FSYNC_ALWAYS
+            and self._synced_lsn < self._written_lsn
+        )
+
+    def _sync_to(self, lsn):
+        """group commit: callers arriving during an fsync are covered by
+        the next single fsync"""
+        if self._synced_lsn >= lsn:
+            return
+        with self._sync_lock:
+            if self._synced_lsn >= lsn:
+                # covered by the fsync of another thread
+                return
+            with self._lock:
+                if self._file is None:
+                    return
+                written = self._written_lsn
+                fd = os.dup(self._file.fileno())
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+            self._synced_lsn = max(self._synced_lsn, written)
+
+    def _sync_periodically(self):
+        # exits once closed
+        while not self._closed.wait(self.fsync_interval):
+            self._sync_to(self._written_lsn)
+
+    def _sync_file(self, f):
+        if self.fsync != FSYNC_NEVER:
+            os.fsync(f.fileno())
+
+    def _close_file(self):
+        """must be called with `_lock` held"""
+        self._sync_file(self._file)
+        self._file.close()
+        self._file = None
+        if self.fsync != FSYNC_NEVER:
+            self._synced_lsn = max(self._synced_lsn, self._written_lsn)
+
+    def _sync_dir(self):
+        if self.fsync == FSYNC_NEVER or os.name == "nt":
+            return
+        fd = os.open(self.persist_dir, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def close(self):
+        """close the segment file, it's reopened by next record"""
+        with self._lock:
+            if self._file is not None:
+                self._close_file()
+            self._closed.set()
+            thread, self._sync_thread = self._sync_thread, None
+        if thread is not None:
+            thread.join()
@@ -0,0 +1,862 @@
+# -*- coding: utf-8 -*-
+"""
+asyncio client of WuKongQueue, thousands of coroutines can share a few
+connections: requests of a connection are written back-to-back, and the
+server replies to them in order, so each reply resolves the oldest request
+in flight.
+"""
+import asyncio
+import logging
+import time
+from collections import deque
+
+from ._commu_proto import *
+from .client import _ReplyParser, _delay_arg
+from .exceptions import (
+    Empty,
+    WuKongError,
+    ConnectionTimeout,
+    ConnectionError,
+    ClientsFull,
+    UnknownResponse,
+    AuthenticationError,
+    NotYetSupportType,
+)
+from .serializer import get_serializer, get_compressor
+from .utils import Unify_encoding, get_logger, md5
+
+
+class AsyncConnection:
+    """Tcp connection on asyncio streams, shared by coroutines of one event
+    loop, not thread safe.
+
+    Note: server executes requests of a connection one by one, a blocking
+    request such as get() on empty queue delays the following ones, it's
+    sent on a connection checked out, see AsyncConnectionPool.
+    """
+
+    def __init__(
+        self,
+        host,
+        port,
+        auth_key=None,
+        socket_connect_timeout=None,
+        log_level=logging.DEBUG,
+        logger=None,
+    ):
+        self.server_addr = (host, port)
+        self.auth_key = auth_key
+        self.socket_connect_timeout = socket_connect_timeout
+        self._logger = logger or get_logger(self, log_level)
+        self.proto_version = PROTO_V1
+        self._reader = None
+        self._writer = None
+        self._read_task = None
+        self._drain_lock = None
+        # futures of requests in flight, in order of writing
+        self._pending = deque()
+        # called with msgs pushed by server while no requests are in
+        # flight, and with the invalid msg once disconnected, it's set by
+        # a subscribed connection, see AsyncSubscription
+        self.on_push = None
+
+    def __repr__(self):
+        identity_kv = [("server_addr", self.server_addr), ("id", id(self))]
+        repr_str = ",".join(["%s=%s" % (k, v) for k, v in identity_kv])
+        return "%s<%s>" % (type(self).__name__, repr_str)
+
+    @property
+    def connected(self) -> bool:
+        return self._writer is not None
+
+    @property
+    def in_flight(self) -> int:
+        """number of requests waiting for reply"""
+        return len(self._pending)
+
+    async def connect(self):
+        if self._writer is not None:
+            return
+        try:
+            self._reader, self._writer = await asyncio.wait_for(
+                asyncio.open_connection(*self.server_addr),
+                self.socket_connect_timeout,
+            )
+        except asyncio.TimeoutError:
+            raise ConnectionTimeout("Timeout connecting to server")
+        except OSError as e:
+            raise ConnectionError(
+                "Error to connect %s, %s" % (self.server_addr, e.args)
+            )
+
+        try:
+            await self._handshake()
+        except WuKongError:
+            self.close()
+            raise
+        self._drain_lock = asyncio.Lock()
+        self._read_task = asyncio.ensure_future(self._read_replies())
+        self._logger.info("successfully connect to %s!" % str(self.server_addr))
+
+    async def _handshake(self):
+        """same as Connection: QUEUE_HI, authentication, then upgrade to
+        the latest protocol if the server advertised it"""
+        pkg = await self._read()
+        if pkg.err:
+            raise ConnectionError(pkg.err)
+        elif pkg.is_socket_closed:
+            raise ClientsFull(
+                "The WuKongQueue server %s is full" % str(self.server_addr)
+            )
+        elif pkg.cmd != QUEUE_HI:
+            raise UnknownResponse("_connect Unknown response:%s" % pkg.raw_data)
+
+        if self.auth_key is not None:
+            reply_msg = await self._talk(
+                QUEUE_AUTH_KEY, args={"auth_key": self.auth_key}
+            )
+            if not reply_msg.is_valid():
+                raise ConnectionError
+            if reply_msg.cmd != QUEUE_OK:
+                raise AuthenticationError(
+                    "WuKongQueue server-addr:%s "
+                    "authentication failed" % str(self.server_addr)
+                )
+
+        if pkg.advertised_proto < PROTO_V2:
+            return
+        reply_msg = await self._talk(
+            QUEUE_PROTO, args={"version": PROTO_LATEST}
+        )
+        if not reply_msg.is_valid():
+            raise ConnectionError
+        if reply_msg.cmd != QUEUE_DATA:
+            raise UnknownResponse(
+                "_negotiate_proto Unknown response:%s" % reply_msg.raw_data
+            )
+        self.proto_version = reply_msg.queue_params_object.data
+
+    async def _talk(self, queue_cmd: bytes, args=None) -> WuKongPkg:
+        """talk without pipelining, only used while setting up"""
+        self._write(self._wrap_msg(queue_cmd, args=args))
+        await self._writer.drain()
+        return await self._read()
+
+    def _wrap_msg(self, queue_cmd: bytes, args=None, data=None):
+        try:
+            return wrap_queue_msg_parts(
+                queue_cmd, args=args, data=data, proto_version=self.proto_version
+            )
+        except Exception as e:
+            raise NotYetSupportType(
+                "%s is not supported yet, wrapping err:%s %s"
+                % (type(data), e, e.args)
+            )
+
+    def _write(self, msg):
+        self._writer.writelines(frame_msgs([msg], self.proto_version))
+
+    async def _read(self) -> WuKongPkg:
+        return await read_wukong_stream(self._reader, self.proto_version)
+
+    async def _read_replies(self):
+        """resolve requests in flight with replies, in order"""
+        while True:
+            reply_msg = await self._read()
+            if not reply_msg.is_valid():
+                self._close(reply_msg)
+                if self.on_push is not None:
+                    self.on_push(reply_msg)
+                return
+            if not self._pending and self.on_push is not None:
+                reply_msg.unwrap()
+                self.on_push(reply_msg)
+                continue
+            if not self._pending:
+                # nobody is waiting, it should never happen
+                self._close(WuKongPkg(err="unexpected reply from server"))
+                return
+            fut = self._pending.popleft()
+            if fut.done():
+                # waiter was cancelled, the reply is dropped
+                continue
+            try:
+                reply_msg.unwrap()
+            except Exception as e:
+                fut.set_exception(e)
+            else:
+                fut.set_result(reply_msg)
+
+    def send(self, queue_cmd: bytes, args=None):
+        """write a queue msg without waiting for reply, only used by a
+        subscribed connection, the msg is flushed by the transport"""
+        if self._writer is not None:
+            self._write(self._wrap_msg(queue_cmd, args=args))
+
+    async def talk_with_svr(
+        self, queue_cmd: bytes, args=None, data=None
+    ) -> WuKongPkg:
+        """send a queue msg then wait for its reply, other coroutines can
+        talk meanwhile"""
+        if self._writer is None:
+            await self.connect()
+        msg = self._wrap_msg(queue_cmd, args=args, data=data)
+
+        fut = asyncio.get_event_loop().create_future()
+        # no await between appending and writing, so the order of
+        # `_pending` is the order of requests on the wire
+        self._pending.append(fut)
+        self._write(msg)
+        # concurrent drain() is not allowed before python3.10
+        async with self._drain_lock:
+            await self._writer.drain()
+        return await fut
+
+    def _close(self, pkg: WuKongPkg):
+        """close the connection, requests in flight get `pkg` as reply"""
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+            self._reader = None
+        while self._pending:
+            fut = self._pending.popleft()
+            if not fut.done():
+                fut.set_result(pkg)
+
+    def close(self):
+        if self._read_task is not None:
+            self._read_task.cancel()
+            self._read_task = None
+        self._close(WuKongPkg(is_socket_closed=True))
+
+
+class AsyncConnectionPool:
+    """
+    Connections are shared by coroutines rather than checked out, see also
+    ConnectionPool. Requests which may block, such as get() on an empty
+    queue, check out connections of their own instead, so they never delay
+    requests sharing a connection, see `checkout`.
+
+    connection_cls: tcp connection management class
+
+    max_connections: at most max_connections connections are shared, then
+    coroutines share the least busy one, and at most max_connections more
+    are checked out, then coroutines wait for one checked in. It's 4 by
+    default, 0 means no limits
+
+    connection_kwargs: constructed from the outside, it will be
+    passed to connection_cls.__init__
+    """
+
+    def __init__(
+        self,
+        connection_cls=AsyncConnection,
+        max_connections=4,
+        **connection_kwargs
+    ):
+        self.max_connections = 0
+        if isinstance(max_connections, int) and max_connections >= 0:
+            self.max_connections = max_connections
+
+        self.connection_cls = connection_cls
+        self.connection_kwargs = connection_kwargs
+
+        self.server_addr = (
+            connection_kwargs["host"],
+            connection_kwargs["port"],
+        )
+
+        self._connections = []
+        self._connecting = []
+        # number of connections for blocking requests, idle ones are kept
+        # in `_idle`, and futures of coroutines waiting for one
+        self._checked_out = 0
+        self._idle = []
+        self._checkout_waiters = deque()
+        self.closed = False
+
+    def __repr__(self):
+        return "%s<server_addr=%s, connections=%s>" % (
+            type(self).__name__,
+            self.server_addr,
+            len(self._connections),
+        )
+
+    async def get_connection(self) -> AsyncConnection:
+        """returns an idle connection, or a new one if the limit is not
+        reached, otherwise the connection with fewest requests in flight"""
+        if self.closed:
+            raise ConnectionError("The pool is closed")
+        self._connections = [c for c in self._connections if c.connected]
+        for conn in self._connections:
+            if conn.in_flight == 0:
+                return conn
+
+        created = len(self._connections) + len(self._connecting)
+        if self.max_connections == 0 or created < self.max_connections:
+            conn = self.connection_cls(**self.connection_kwargs)
+            connecting = asyncio.ensure_future(conn.connect())
+            self._connecting.append(connecting)
+            try:
+                await connecting
+            finally:
+                self._connecting.remove(connecting)
+            self._connections.append(conn)
+            return conn
+        if not self._connections:
+            # all allowed connections are connecting, wait for any of them
+            await asyncio.wait(
+                self._connecting, return_when=asyncio.FIRST_COMPLETED
+            )
+            return await self.get_connection()
+        return min(self._connections, key=lambda c: c.in_flight)
+
+    async def checkout(self) -> AsyncConnection:
+        """returns an idle connection only used by the caller until
+        `checkin`, a new one if the limit is not reached, otherwise waits
+        for one checked in"""
+        while True:
+            if self.closed:
+                raise ConnectionError("The pool is closed")
+            while self._idle:
+                conn = self._idle.pop()
+                if conn.connected:
+                    return conn
+                self._checked_out -= 1
+            if (
+                self.max_connections == 0
+                or self._checked_out < self.max_connections
+            ):
+                self._checked_out += 1
+                conn = self.connection_cls(**self.connection_kwargs)
+                try:
+                    await conn.connect()
+                except BaseException:
+                    self.checkin(conn, reuse=False)
+                    raise
+                return conn
+            waiter = asyncio.get_event_loop().create_future()
+            self._checkout_waiters.append(waiter)
+            try:
+                await waiter
+            except asyncio.CancelledError:
+                if waiter.done() and not waiter.cancelled():
+                    # woken but cancelled, pass the wakeup on
+                    self._wakeup_checkout()
+                raise
+            finally:
+                if waiter in self._checkout_waiters:
+                    self._checkout_waiters.remove(waiter)
+
+    def checkin(self, conn: AsyncConnection, reuse=True):
+        """give back a connection returned by `checkout`, it's closed
+        unless `reuse`, e.g. a request is still in flight"""
+        if reuse and conn.connected and not self.closed:
+            self._idle.append(conn)
+        else:
+            conn.close()
+            self._checked_out -= 1
+        self._wakeup_checkout()
+
+    def _wakeup_checkout(self):
+        while self._checkout_waiters:
+            waiter = self._checkout_waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+
+    def close(self):
+        for conn in self._connections + self._idle:
+            conn.close()
+        self._checked_out -= len(self._idle)
+        self._connections = []
+        self._idle = []
+        self.closed = True
+        while self._checkout_waiters:
+            waiter = self._checkout_waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+
+
+class AsyncWuKongQueueClient(_ReplyParser):
+    def __init__(
+        self,
+        host="localhost",
+        port=8848,
+        auth_key=None,
+        socket_connect_timeout=None,
+        connection_pool=None,
+        silence_err=False,
+        **kwargs
+    ):
+        """
+        asyncio version of WuKongQueueClient, its apis are coroutines, see
+        also WuKongQueueClient for the meaning of args.
+
+        A number of optional keyword arguments may be specified, which
+        can alter the default behaviour
+
+        log_level: pass with stdlib logging.DEBUG/INFO/WARNING.., to
+        control the WuKongQueue's logging level that output to stderr
+
+        max_connections: max connections shared by coroutines of this
+        client, and max connections checked out by requests which may block
+        (get, get_many and lease with block=True, join), see also
+        AsyncConnectionPool. It's 4 by default, 0 means no limits
+
+        encoding: unified encoding standard
+
+        encoding_error: set a different error handling scheme
+
+        serializer, compression, compress_threshold, queue, group: see also
+        WuKongQueueClient
+        """
+        self._logger = get_logger(self, kwargs.pop("log_level", logging.DEBUG))
+        self.server_addr = (host, port)
+        self.queue = kwargs.pop("queue", None)
+        self.group = kwargs.pop("group", None)
+        self.serializer = get_serializer(kwargs.pop("serializer", "pickle"))
+        self.compressor = get_compressor(kwargs.pop("compression", None))
+        self.compress_threshold = kwargs.pop("compress_threshold", 1024)
+        self._silence_err = silence_err
+
+        encoding = kwargs.pop("encoding", Unify_encoding)
+        encoding_err = kwargs.pop("encoding_err", "strict")
+
+        self._is_new_pool = True
+        if connection_pool is None:
+            auth_key = (
+                auth_key
+                if auth_key is None
+                else md5(
+                    auth_key.encode(encoding=encoding, errors=encoding_err)
+                )
+            )
+            self._is_new_pool = False
+            connection_pool = AsyncConnectionPool(
+                host=host,
+                port=port,
+                auth_key=auth_key,
+                socket_connect_timeout=socket_connect_timeout,
+                logger=self._logger,
+                max_connections=kwargs.pop("max_connections", 4),
+            )
+        else:
+            self.server_addr = connection_pool.server_addr
+        self.connection_pool = connection_pool
+
+    async def put(
+        self,
+        item,
+        block=True,
+        timeout=None,
+        priority=None,
+        delay=None,
+        not_before=None,
+        ttl=None,
+    ):
+        """see also WuKongQueueClient.put"""
+        assert type(timeout) in [int, float, type(None)], (
+            "invalid timeout %s" % timeout
+        )
+        reply_msg = await self._send_command(
+            QUEUE_PUT,
+            args={
+                "block": block,
+                "timeout": timeout,
+                "priority": priority,
+                "delay": _delay_arg(delay, not_before),
+                "ttl": ttl,
+            },
+            data=self._serialize(item),
+        )
+        if reply_msg is None:
+            return
+        return self._reply_put(reply_msg)
+
+    async def get(self, block=True, timeout=None, convert_method=None):
+        """see also WuKongQueueClient.get"""
+        if convert_method:
+            assert callable(convert_method), (
+                "not a callable obj:%s" % convert_method
+            )
+        assert type(timeout) in [int, float, type(None)], (
+            "invalid timeout %s" % timeout
+        )
+        reply_msg = await self._send_command(
+            QUEUE_GET, args={"block": block, "timeout": timeout},
+            blocking=block,
+        )
+        if reply_msg is None:
+            return
+        return self._reply_get(reply_msg, convert_method)
+
+    async def put_many(
+        self,
+        items,
+        block=True,
+        timeout=None,
+        priority=None,
+        delay=None,
+        not_before=None,
+        ttl=None,
+    ) -> int:
+        """see also WuKongQueueClient.put_many"""
+        assert type(timeout) in [int, float, type(None)], (
+            "invalid timeout %s" % timeout
+        )
+        reply_msg = await self._send_command(
+            QUEUE_PUT_MANY,
+            args={
+                "block": block,
+                "timeout": timeout,
+                "priority": priority,
+                "delay": _delay_arg(delay, not_before),
+                "ttl": ttl,
+            },
+            data=self._serialize_many(items),
+        )
+        if reply_msg is None:
+            return 0
+        return self._reply_data(reply_msg)
+
+    async def get_many(
+        self, max_items, block=True, timeout=None, convert_method=None
+    ) -> list:
+        """see also WuKongQueueClient.get_many"""
+        if convert_method:
+            assert callable(convert_method), (
+                "not a callable obj:%s" % convert_method
+            )
+        assert type(timeout) in [int, float, type(None)], (
+            "invalid timeout %s" % timeout
+        )
+        assert isinstance(max_items, int) and max_items > 0, (
+            "invalid max_items %s" % max_items
+        )
+        reply_msg = await self._send_command(
+            QUEUE_GET_MANY,
+            args={"block": block, "timeout": timeout, "max_items": max_items},
+            blocking=block,
+        )
+        if reply_msg is None:
+            return []
+        return self._reply_get_many(reply_msg, convert_method)
+
+    async def full(self):
+        """Whether the queue is full"""
+        reply_msg = await self._send_command(QUEUE_QUERY_STATUS)
+        if reply_msg is None:
+            return False
+        return reply_msg.cmd == QUEUE_FULL
+
+    async def empty(self):
+        """Whether the queue is empty"""
+        reply_msg = await self._send_command(QUEUE_QUERY_STATUS)
+        if reply_msg is None:
+            return True
+        return reply_msg.cmd == QUEUE_EMPTY
+
+    async def lease(
+        self,
+        block=True,
+        timeout=None,
+        visibility_timeout=None,
+        convert_method=None,
+    ):
+        """see also WuKongQueueClient.lease"""
+        if convert_method:
+            assert callable(convert_method), (
+                "not a callable obj:%s" % convert_method
+            )
+        assert type(timeout) in [int, float, type(None)], (
+            "invalid timeout %s" % timeout
+        )
+        reply_msg = await self._send_command(
+            QUEUE_LEASE,
+            args={
+                "block": block,
+                "timeout": timeout,
+                "visibility_timeout": visibility_timeout,
+            },
+            blocking=block,
+        )
+        if reply_msg is None:
+            return
+        return self._reply_lease(reply_msg, convert_method)
+
+    async def ack(self, receipt):
+        """see also WuKongQueueClient.ack"""
+        reply_msg = await self._send_command(
+            QUEUE_ACK, args={"receipt": receipt}
+        )
+        if reply_msg is None:
+            return
+        return self._reply_task_done(reply_msg)
+
+    async def nack(self, receipt):
+        """see also WuKongQueueClient.nack"""
+        reply_msg = await self._send_command(
+            QUEUE_NACK, args={"receipt": receipt}
+        )
+        if reply_msg is None:
+            return
+        return self._reply_task_done(reply_msg)
+
+    async def task_done(self):
+        """see also WuKongQueueClient.task_done"""
+        reply_msg = await self._send_command(QUEUE_TASK_DONE)
+        if reply_msg is None:
+            return
+        return self._reply_task_done(reply_msg)
+
+    async def join(self):
+        """see also WuKongQueueClient.join"""
+        await self._send_command(QUEUE_JOIN, blocking=True)
+
+    async def subscribe(self, prefetch=100, auto_ack=True):
+        """Returns an AsyncSubscription, see also
+        WuKongQueueClient.subscribe"""
+        sub = AsyncSubscription(self, prefetch, auto_ack)
+        await sub._subscribe()
+        return sub
+
+    async def realtime_qsize(self):
+        reply_msg = await self._send_command(QUEUE_SIZE)
+        if reply_msg is None:
+            return 0
+        return self._reply_data(reply_msg)
+
+    async def realtime_maxsize(self):
+        reply_msg = await self._send_command(QUEUE_MAXSIZE)
+        if reply_msg is None:
+            return 0
+        return self._reply_data(reply_msg)
+
+    async def stats(self) -> dict:
+        """see also WuKongQueueClient.stats"""
+        reply_msg = await self._send_command(QUEUE_STATS)
+        if reply_msg is None:
+            return {}
+        return self._reply_data(reply_msg)
+
+    async def reset(self, maxsize=0):
+        """reset clear queue server and reset maxsize"""
+        reply_msg = await self._send_command(
+            QUEUE_RESET, args={"maxsize": maxsize}
+        )
+        if reply_msg is None:
+            return False
+        return reply_msg.cmd == QUEUE_OK
+
+    async def connected_clients(self):
+        reply_msg = await self._send_command(QUEUE_CLIENTS)
+        if reply_msg is None:
+            return 0
+        return self._reply_data(reply_msg)
+
+    async def connected(self):
+        try:
+            reply_msg = await self._send_command(QUEUE_PING)
+        except ConnectionError:
+            return False
+        if reply_msg is None:
+            return False
+        return reply_msg.cmd == QUEUE_PONG
+
+    def _on_disconnected(self, exception=None, err_msg=""):
+        err_msg = "%s%s" % (", " if err_msg != "" else "", err_msg)
+        m = "WuKongQueue server-addr:%s is disconnected%s" % (
+            str(self.server_addr),
+            err_msg,
+        )
+        if self._silence_err:
+            self._logger.warning(m)
+        else:
+            if exception:
+                raise exception
+            raise ConnectionError(m)
+
+    async def _send_command(
+        self, queue_cmd, args=None, data=None, blocking=False
+    ):
+        """a `blocking` request is sent on a connection checked out, so it
+        doesn't delay requests of other coroutines"""
+        try:
+            if not blocking:
+                conn = await self.connection_pool.get_connection()
+                reply_msg = await conn.talk_with_svr(
+                    queue_cmd, args=self._queue_args(args), data=data
+                )
+            else:
+                reply_msg = await self._send_checked_out(
+                    queue_cmd, args=self._queue_args(args), data=data
+                )
+        except NotYetSupportType:
+            raise
+        except WuKongError as e:
+            self._on_disconnected(exception=e, err_msg=str(e.args))
+            return
+
+        if not reply_msg.is_valid():
+            self._on_disconnected(err_msg=reply_msg.err or "")
+            return
+        self._reply_queue(reply_msg)
+        return reply_msg
+
+    async def _send_checked_out(self, queue_cmd, args=None, data=None):
+        pool = self.connection_pool
+        conn = await pool.checkout()
+        reuse = False
+        try:
+            reply_msg = await conn.talk_with_svr(queue_cmd, args=args, data=data)
+            reuse = True
+        finally:
+            # a request cancelled may still be served, e.g. get an item,
+            # the connection is closed then
+            pool.checkin(conn, reuse=reuse)
+        return reply_msg
+
+    def close(self):
+        """close the connections to server, not off server"""
+        if not self._is_new_pool:
+            self.connection_pool.close()
+
+    def __repr__(self):
+        return "%s<pool:%s>" % (type(self).__name__, self.connection_pool)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+class AsyncSubscription:
+    """asyncio version of Subscription, items are pushed to a connection of
+    its own and buffered by its read task, see also Subscription.
+
+    async with await client.subscribe(prefetch=100) as sub:
+        async for item in sub:
+            print(item)
+    """
+
+    def __init__(self, client: AsyncWuKongQueueClient, prefetch, auto_ack):
+        if prefetch < 1:
+            raise ValueError("'prefetch' must be a positive number")
+        self.client = client
+        self.prefetch = prefetch
+        self.auto_ack = auto_ack
+        self._items = deque()
+        self._unacked = 0
+        self._credit = 0
+        # the invalid msg once disconnected
+        self._lost = None
+        # future of the coroutine waiting for items pushed
+        self._waiter = None
+        pool = client.connection_pool
+        self._conn = pool.connection_cls(**pool.connection_kwargs)
+
+    def __repr__(self):
+        return "%s<client:%s, prefetch:%s>" % (
+            type(self).__name__,
+            self.client,
+            self.prefetch,
+        )
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        return await self.get()
+
+    async def _subscribe(self):
+        # set before subscribing, items may be pushed with the reply
+        self._conn.on_push = self._on_push
+        await self._conn.connect()
+        reply_msg = await self._conn.talk_with_svr(
+            QUEUE_SUBSCRIBE,
+            args=self.client._queue_args({"prefetch": self.prefetch}),
+        )
+        try:
+            if not reply_msg.is_valid():
+                raise ConnectionError(
+                    "WuKongQueue server-addr:%s is disconnected, %s"
+                    % (str(self.client.server_addr), reply_msg.err or "closed")
+                )
+            self.client._reply_queue(reply_msg)
+        except WuKongError:
+            self._conn.close()
+            raise
+
+    def _on_push(self, pkg):
+        if pkg.is_valid():
+            self._items.extend(pkg.queue_params_object.data)
+        else:
+            self._lost = pkg
+        if self._waiter is not None and not self._waiter.done():
+            self._waiter.set_result(None)
+
+    async def get(self, block=True, timeout=None, convert_method=None):
+        """see also Subscription.get"""
+        if not self._items:
+            self._send_credit()
+            await self._receive(block, timeout)
+        item = self._items.popleft()
+        self._unacked += 1
+        if self.auto_ack:
+            self.ack()
+        return convert_method(item) if convert_method else item
+
+    def ack(self, n=1):
+        """see also Subscription.ack"""
+        n = min(n, self._unacked)
+        self._unacked -= n
+        self._credit += n
+        if self._credit >= max(self.prefetch // 2, 1):
+            self._send_credit()
+
+    def _send_credit(self):
+        if self._credit and self._lost is None:
+            self._conn.send(QUEUE_CREDIT, args={"credit": self._credit})
+            self._credit = 0
+
+    async def _receive(self, block, timeout):
+        if block and timeout is not None and timeout < 0:
+            raise ValueError("'timeout' must be a non-negative number")
+        endtime = None if timeout is None else time.monotonic() + timeout
+        while not self._items:
+            if self._lost is not None:
+                raise ConnectionError(
+                    "WuKongQueue server-addr:%s is disconnected, %s"
+                    % (str(self.client.server_addr), self._lost.err or "closed")
+                )
+            remaining = None
+            if not block:
+                remaining = 0
+            elif endtime is not None:
+                remaining = max(endtime - time.monotonic(), 0)
+            if remaining == 0:
+                raise Empty(
+                    "WuKongQueue server-addr:%s pushed nothing"
+                    % str(self.client.server_addr)
+                )
+            self._waiter = asyncio.get_event_loop().create_future()
+            try:
+                await asyncio.wait_for(self._waiter, remaining)
+            except asyncio.TimeoutError:
+                pass
+            finally:
+                self._waiter = None
+
+    def close(self):
+        """see also Subscription.close"""
+        self._send_credit()
+        self._conn.on_push = None
+        self._conn.close()
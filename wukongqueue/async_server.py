@@ -0,0 +1,637 @@
+# -*- coding: utf-8 -*-
+"""
+asyncio engine of WuKongQueue, all connections are multiplexed on one event
+loop rather than served by a thread each. Blocking GET/PUT/JOIN of clients
+are parked as waiters of the loop, the wire protocol is the same.
+"""
+import asyncio
+import threading
+from collections import deque
+from time import monotonic
+
+from ._commu_proto import *
+from ._item_wrapper import ItemBatch
+from .exceptions import Empty, Full
+from .server import WuKongQueue, _ClientStatistic, _Hosted, MODE_TOPIC
+from .utils import new_thread
+
+
+class _AsyncConn:
+    """server side connection on asyncio streams, it has the same
+    `write_msg` and `proto_version` as TcpConn, see WuKongQueue._reply_cmd.
+    Msgs are buffered until `flush`, so a reply can wait for the
+    write-ahead log.
+    """
+
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        self.proto_version = PROTO_V1
+        self._buffers = []
+
+    def write_msg(self, queue_cmd: bytes, args=None, data=None, exception=None):
+        msg = wrap_queue_msg_parts(
+            queue_cmd,
+            args=args,
+            data=data,
+            exception=exception,
+            proto_version=self.proto_version,
+        )
+        # framed now, the protocol may be switched by the msg
+        self._buffers.extend(frame_msgs([msg], self.proto_version))
+        return True
+
+    def write_hi(self):
+        """greet a new connection, see `frame_hi`"""
+        self._buffers.extend(frame_hi())
+
+    def flush(self):
+        self.writer.writelines(self._buffers)
+        self._buffers = []
+
+    async def read(self) -> WuKongPkg:
+        return await read_wukong_stream(self.reader, self.proto_version)
+
+    def close(self):
+        self.writer.close()
+
+
+class AsyncWuKongQueue(WuKongQueue):
+    def __init__(
+        self, host="localhost", port=8848, name="", maxsize=0, **kwargs
+    ):
+        """
+        same as WuKongQueue, but clients are served by an event loop running
+        in a daemon thread, so thousands of clients don't cost thousands of
+        threads. Apis of the server side are still blocking, they can be
+        called from any thread except the event loop's.
+        """
+        self._loop = None
+        self._loop_thread_id = None
+        self._stopped = None
+        # set when the event loop exits
+        self._loop_exited = threading.Event()
+        # futures of parked clients, in order of parking
+        self._getters = deque()
+        self._putters = deque()
+        self._joiners = deque()
+        super().__init__(
+            host=host, port=port, name=name, maxsize=maxsize, **kwargs
+        )
+
+    def run(self):
+        if self.closed:
+            self._tcp_svrs = self._listen()
+            self._loop = asyncio.new_event_loop()
+            self._stopped = self._loop.create_future()
+            self._loop_exited.clear()
+            self.on_running()
+            new_thread(self._run, kw={"loop": self._loop})
+
+    def close(self):
+        """see also WuKongQueue.close, it waits for the event loop to exit"""
+        self.closed = True
+        loop, self._loop = self._loop, None
+        if loop is not None:
+            loop.call_soon_threadsafe(self._stop_serving)
+            self._loop_exited.wait()
+        for tcp_svr in self._tcp_svrs:
+            tcp_svr.close()
+        self._tcp_svrs = []
+        for queue in self._hosted_queues():
+            queue.close()
+        if self._wal is not None:
+            self._wal.close()
+        self._close_storage()
+
+        self._logger.debug(
+            "<WuKongQueue [{}] listened {} was closed>".format(
+                self.name, self.addr
+            )
+        )
+
+    def _stop_serving(self):
+        if not self._stopped.done():
+            self._stopped.set_result(None)
+
+    def _run(self, loop):
+        asyncio.set_event_loop(loop)
+        self._loop_thread_id = threading.get_ident()
+        try:
+            loop.run_until_complete(self._serve())
+        finally:
+            loop.close()
+            self._loop_exited.set()
+
+    async def _serve(self):
+        tasks = set()
+
+        def on_connected(reader, writer):
+            task = asyncio.ensure_future(self._process_conn(reader, writer))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+
+        # all acceptors are served by the loop
+        servers = [
+            await asyncio.start_server(on_connected, sock=tcp_svr.sock)
+            for tcp_svr in self._tcp_svrs
+        ]
+        await self._stopped
+        for server in servers:
+            server.close()
+        with self._statistic_lock:
+            for client_stat in self.client_stats.values():
+                client_stat.conn.close()
+            self.client_stats.clear()
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        for server in servers:
+            await server.wait_closed()
+
+    #
+    # Wake parked clients whenever the queue is changed, it is done by the
+    # loop, so the local apis can be called from other threads.
+    #
+
+    def _wakeup(self, waiters, n=None):
+        """wake `n` waiters, or all if `n` is None"""
+        if threading.get_ident() == self._loop_thread_id:
+            self._notify(waiters, n)
+            return
+        loop = self._loop
+        if loop is not None:
+            try:
+                loop.call_soon_threadsafe(self._notify, waiters, n)
+            except RuntimeError:
+                # loop is closed
+                pass
+
+    @staticmethod
+    def _notify(waiters, n):
+        while waiters and (n is None or n > 0):
+            fut = waiters.popleft()
+            if not fut.done():
+                fut.set_result(None)
+                if n is not None:
+                    n -= 1
+
+    def _wake_getters(self, n):
+        """wake getters for `n` items added, all of them in mode "topic"
+        since every group reads the items"""
+        self._wakeup(self._getters, None if self.mode == MODE_TOPIC else n)
+
+    def _get(self, block, timeout, group=None):
+        ret = super()._get(block, timeout, group)
+        self._wakeup(self._putters, 1)
+        return ret
+
+    def _lease(self, block, timeout, visibility_timeout):
+        ret = super()._lease(block, timeout, visibility_timeout)
+        self._wakeup(self._putters, 1)
+        # a parked getter may have to wake earlier for the lease
+        self._wakeup(self._getters, 1)
+        return ret
+
+    def ack(self, receipt):
+        super().ack(receipt)
+        if not self.unfinished_tasks:
+            self._wakeup(self._joiners)
+
+    def nack(self, receipt):
+        super().nack(receipt)
+        self._wakeup(self._getters, 1)
+
+    def _new_hosted(self, name, maxsize, kwargs):
+        return _AsyncHostedQueue(self, name, maxsize=maxsize, **kwargs)
+
+    def _release_track(self, track, me):
+        super()._release_track(track, me)
+        self._wakeup(self._getters)
+        if not self.unfinished_tasks:
+            self._wakeup(self._joiners)
+
+    def _get_many(self, max_items, block, timeout, group=None):
+        items, priorities = super()._get_many(max_items, block, timeout, group)
+        self._wakeup(self._putters, len(items))
+        return items, priorities
+
+    def _ack_pushed(self, pushed, n):
+        super()._ack_pushed(pushed, n)
+        if not self.unfinished_tasks:
+            self._wakeup(self._joiners)
+
+    def _put_back(self, entries):
+        super()._put_back(entries)
+        if entries:
+            self._wake_getters(len(entries))
+
+    def _count_read(self, n):
+        super()._count_read(n)
+        if n:
+            self._wakeup(self._putters, n)
+            if not self.unfinished_tasks:
+                self._wakeup(self._joiners)
+
+    def _count_expired(self, n) -> int:
+        lsn = super()._count_expired(n)
+        if n:
+            self._wakeup(self._putters, n)
+            if not self.unfinished_tasks:
+                self._wakeup(self._joiners)
+        return lsn
+
+    def _move_due(self) -> int:
+        n = super()._move_due()
+        if n:
+            self._wake_getters(n)
+        return n
+
+    def put(
+        self,
+        item,
+        block=True,
+        timeout=None,
+        priority=None,
+        delay=None,
+        not_before=None,
+        ttl=None,
+    ):
+        super().put(
+            item,
+            block=block,
+            timeout=timeout,
+            priority=priority,
+            delay=delay,
+            not_before=not_before,
+            ttl=ttl,
+        )
+        # a delayed item wakes a getter to park until it's due
+        self._wake_getters(1)
+
+    def put_many(
+        self,
+        items,
+        block=True,
+        timeout=None,
+        priority=None,
+        delay=None,
+        not_before=None,
+        ttl=None,
+    ) -> int:
+        put = super().put_many(
+            items,
+            block=block,
+            timeout=timeout,
+            priority=priority,
+            delay=delay,
+            not_before=not_before,
+            ttl=ttl,
+        )
+        if put:
+            self._wake_getters(put)
+        return put
+
+    def reset(self, maxsize=None):
+        super().reset(maxsize)
+        self._wakeup(self._putters)
+
+    def _finish_task(self, client_stat):
+        super()._finish_task(client_stat)
+        if not self.unfinished_tasks:
+            self._wakeup(self._joiners)
+
+    def _sync_wal(self, lsn):
+        if threading.get_ident() == self._loop_thread_id:
+            # never fsync on the loop, see _sync_wal_async
+            return
+        super()._sync_wal(lsn)
+
+    async def _sync_wal_async(self):
+        """fsync by the default executor before replying, coroutines
+        syncing meanwhile share one fsync"""
+        if self._wal is not None and self._wal.needs_sync():
+            await asyncio.get_event_loop().run_in_executor(
+                None, self._wal.sync
+            )
+
+    #
+    # Serve clients on the event loop
+    #
+
+    async def _park(self, waiters, endtime):
+        """wait until woken or `endtime` reached, getters wait at most
+        until the next delayed item is due"""
+        fut = asyncio.get_event_loop().create_future()
+        waiters.append(fut)
+        timeout = None if endtime is None else max(endtime - monotonic(), 0)
+        if waiters is self._getters:
+            with self.mutex:
+                due = self._next_due()
+            if due is not None:
+                timeout = due if timeout is None else min(timeout, due)
+        try:
+            await asyncio.wait_for(fut, timeout)
+        except asyncio.TimeoutError:
+            try:
+                waiters.remove(fut)
+            except ValueError:
+                pass
+
+    async def _retry(self, attempt, waiters, block, timeout):
+        """call `attempt` until it doesn't raise Empty/Full, parking on
+        `waiters` between tries, see also WuKongQueue.get/put"""
+        if block and timeout is not None and timeout < 0:
+            raise ValueError("'timeout' must be a non-negative number")
+        endtime = None if timeout is None else monotonic() + timeout
+        while True:
+            try:
+                return attempt()
+            except (Empty, Full):
+                if not block:
+                    raise
+                if endtime is not None and endtime <= monotonic():
+                    raise
+            await self._park(waiters, endtime)
+
+    async def _put_many(
+        self, items, block, timeout, priority=None, delay=None, ttl=None
+    ) -> int:
+        items = list(items)
+        put = 0
+
+        def attempt():
+            nonlocal put
+            put += self.put_many(
+                items[put:],
+                block=False,
+                priority=priority,
+                delay=delay,
+                ttl=ttl,
+            )
+            if put < len(items):
+                raise Full
+
+        try:
+            await self._retry(attempt, self._putters, block, timeout)
+        except Full:
+            pass
+        return put
+
+    async def _join(self):
+        while self.unfinished_tasks:
+            await self._park(self._joiners, None)
+
+    async def _push_async(self, conn: _AsyncConn, credit, group):
+        """like WuKongQueue._push, but reading credit and getting items
+        are tasks of the loop waited together"""
+        pushed = deque()
+        read = asyncio.ensure_future(self._read_msg(conn))
+        get = None
+        try:
+            while True:
+                if get is None and credit:
+                    # credit is read by each attempt, so credit given
+                    # meanwhile is taken
+                    get = asyncio.ensure_future(
+                        self._retry(
+                            lambda: self._get_many(credit, False, None, group),
+                            self._getters,
+                            True,
+                            None,
+                        )
+                    )
+                done, _ = await asyncio.wait(
+                    [t for t in (read, get) if t is not None],
+                    return_when=asyncio.FIRST_COMPLETED,
+                )
+                if get in done:
+                    (items, priorities), get = get.result(), None
+                    if self.mode != MODE_TOPIC:
+                        pushed.extend(zip(items, priorities))
+                    credit -= len(items)
+                    conn.write_msg(QUEUE_DATA, data=ItemBatch(items))
+                    await self._sync_wal_async()
+                    conn.flush()
+                    await conn.writer.drain()
+                if read in done:
+                    msg = read.result()
+                    if msg is None:
+                        return
+                    if msg.queue_params_object.cmd != QUEUE_CREDIT:
+                        conn.close()
+                        return
+                    n = msg.queue_params_object.args.get("credit", 0)
+                    self._ack_pushed(pushed, n)
+                    await self._sync_wal_async()
+                    credit += n
+                    read = asyncio.ensure_future(self._read_msg(conn))
+        finally:
+            if get is not None:
+                get.cancel()
+            if read.done() and not read.cancelled() and not read.exception():
+                # credit sent before the connection was lost acks items
+                msg = read.result()
+                if msg is not None and msg.cmd == QUEUE_CREDIT:
+                    self._ack_pushed(
+                        pushed, msg.queue_params_object.args.get("credit", 0)
+                    )
+            read.cancel()
+            self._put_back(list(pushed))
+
+    async def _reply_cmd_async(self, conn: _AsyncConn, params, client_stat):
+        """like WuKongQueue._reply_cmd, but blocking cmds are parked"""
+        cmd = params.cmd
+        args = params.args
+        data = params.data
+        block = args.get("block", True)
+        timeout = args.get("timeout")
+
+        # GET
+        if cmd == QUEUE_GET:
+            try:
+                item, priority = await self._retry(
+                    lambda: self._get(False, None, args.get("group")),
+                    self._getters,
+                    block,
+                    timeout,
+                )
+            except Empty:
+                conn.write_msg(QUEUE_EMPTY)
+            else:
+                self._track_taken(client_stat, (item,), (priority,))
+                conn.write_msg(QUEUE_DATA, data=item)
+
+        # LEASE
+        elif cmd == QUEUE_LEASE:
+            try:
+                receipt, item = await self._retry(
+                    lambda: self._lease(
+                        False, None, args.get("visibility_timeout")
+                    ),
+                    self._getters,
+                    block,
+                    timeout,
+                )
+            except Empty:
+                conn.write_msg(QUEUE_EMPTY)
+            except ValueError as e:
+                conn.write_msg(QUEUE_FAIL, exception=e)
+            else:
+                client_stat.track(self).receipts.add(receipt)
+                conn.write_msg(
+                    QUEUE_DATA, args={"receipt": receipt}, data=item
+                )
+
+        # PUT
+        elif cmd == QUEUE_PUT:
+            try:
+                await self._retry(
+                    lambda: self.put(
+                        data,
+                        block=False,
+                        priority=args.get("priority"),
+                        delay=args.get("delay"),
+                        ttl=args.get("ttl"),
+                    ),
+                    self._putters,
+                    block,
+                    timeout,
+                )
+            except Full:
+                conn.write_msg(QUEUE_FULL)
+            else:
+                conn.write_msg(QUEUE_OK)
+
+        # PUT_MANY, reply number of items put
+        elif cmd == QUEUE_PUT_MANY:
+            put = await self._put_many(
+                data or [],
+                block,
+                timeout,
+                args.get("priority"),
+                args.get("delay"),
+                args.get("ttl"),
+            )
+            conn.write_msg(QUEUE_DATA, data=put)
+
+        # GET_MANY
+        elif cmd == QUEUE_GET_MANY:
+            max_items = args.get("max_items", 1)
+            try:
+                items, priorities = await self._retry(
+                    lambda: self._get_many(
+                        max_items, False, None, args.get("group")
+                    ),
+                    self._getters,
+                    block,
+                    timeout,
+                )
+            except Empty:
+                conn.write_msg(QUEUE_EMPTY)
+            else:
+                self._track_taken(client_stat, items, priorities)
+                conn.write_msg(QUEUE_DATA, data=ItemBatch(items))
+
+        # JOIN
+        elif cmd == QUEUE_JOIN:
+            await self._join()
+            conn.write_msg(QUEUE_OK)
+
+        # SUBSCRIBE
+        elif cmd == QUEUE_SUBSCRIBE:
+            conn.write_msg(QUEUE_OK)
+            conn.flush()
+            await self._push_async(
+                conn, args.get("prefetch", 1), args.get("group")
+            )
+
+        else:
+            self._reply_cmd(conn, params, client_stat)
+
+    async def _read_msg(self, conn: _AsyncConn, timeout=None):
+        try:
+            msg = await asyncio.wait_for(conn.read(), timeout)
+        except asyncio.TimeoutError:
+            return
+        if not msg.is_valid():
+            return
+        msg.unwrap(passthrough=True)
+        return msg
+
+    async def _auth_async(self, conn: _AsyncConn):
+        if self._auth_key is None:
+            return True
+        msg = await self._read_msg(conn, self.socket_connect_timeout)
+        if msg is None or msg.cmd != QUEUE_AUTH_KEY:
+            return False
+        if msg.queue_params_object.args.get("auth_key") == self._auth_key:
+            conn.write_msg(QUEUE_OK)
+            conn.flush()
+            return True
+        conn.write_msg(QUEUE_FAIL)
+        conn.flush()
+        return False
+
+    async def _process_conn(self, reader, writer):
+        conn = _AsyncConn(reader, writer)
+        addr = writer.get_extra_info("peername")
+        client_stat = _ClientStatistic(client_addr=addr, conn=conn)
+        if not self._begin_handshake():
+            conn.close()
+            return
+
+        start = monotonic()
+        ok = False
+        try:
+            conn.write_hi()
+            conn.flush()
+            ok = await self._auth_async(conn)
+        finally:
+            self._end_handshake(start, ok)
+        if not ok:
+            conn.close()
+            return
+        with self._statistic_lock:
+            self.client_stats[client_stat.me] = client_stat
+        self._logger.info(
+            "[server:%s] new client from %s" % (self.addr, str(addr))
+        )
+
+        try:
+            while True:
+                msg = await self._read_msg(conn)
+                if msg is None:
+                    return
+                params = msg.queue_params_object
+                queue = self._route(conn, params)
+                if queue is not None:
+                    await queue._reply_cmd_async(conn, params, client_stat)
+                    await queue._sync_wal_async()
+                conn.flush()
+                await writer.drain()
+        except (ConnectionError, OSError):
+            return
+        finally:
+            self._release_client(client_stat)
+            self.remove_client(client_stat.me)
+
+
+class _AsyncHostedQueue(_Hosted, AsyncWuKongQueue):
+    """parked clients of the queue are woken on the server's event loop"""
+
+    @property
+    def _loop(self):
+        return self._server._loop
+
+    @_loop.setter
+    def _loop(self, loop):
+        pass
+
+    @property
+    def _loop_thread_id(self):
+        return self._server._loop_thread_id
+
+    @_loop_thread_id.setter
+    def _loop_thread_id(self, thread_id):
+        pass
@@ -1,8 +1,12 @@
 # -*- coding: utf-8 -*-
 
 import logging
+import time
+from collections import deque
+from functools import partial
 
 from ._commu_proto import *
+from ._item_wrapper import ItemBatch, item_wrapper_parts, SerializedParts
 from .connection import ConnectionPool
 from .exceptions import (
     NotYetSupportType,
@@ -10,11 +14,96 @@ from .exceptions import (
     Full,
     ConnectionError,
     WuKongError,
+    UnknownQueue,
 )
+from .serializer import get_serializer, get_compressor
 from .utils import Unify_encoding, get_logger, md5, helper
 
 
-class WuKongQueueClient:
+def _delay_arg(delay, not_before):
+    """`not_before` is converted into a delay by the clock of client, so
+    it doesn't matter if clocks of client and server differ"""
+    if not_before is not None:
+        return not_before - time.time()
+    return delay
+
+
+class _ReplyParser:
+    """parse replies of queue cmds and serialize items, shared by all kinds
+    of clients, the client must have attributes `server_addr`, `queue`,
+    `group`, `serializer`, `compressor` and `compress_threshold`"""
+
+    def _queue_args(self, args):
+        """args of a cmd with the queue and consumer group selected"""
+        if not self.queue and self.group is None:
+            return args
+        args = dict(args) if args else {}
+        if self.queue:
+            args["queue"] = self.queue
+        if self.group is not None:
+            args["group"] = self.group
+        return args
+
+    @staticmethod
+    def _reply_queue(reply_msg):
+        """raises UnknownQueue if the queue selected is not hosted"""
+        if reply_msg.cmd == QUEUE_FAIL and isinstance(
+            reply_msg.queue_params_object.exception, UnknownQueue
+        ):
+            raise reply_msg.queue_params_object.exception
+
+    def _serialize(self, item) -> SerializedParts:
+        return SerializedParts(
+            item_wrapper_parts(
+                item,
+                self.serializer,
+                self.compressor,
+                self.compress_threshold,
+            )
+        )
+
+    def _serialize_many(self, items) -> ItemBatch:
+        return ItemBatch(self._serialize(item) for item in items)
+
+    def _reply_put(self, reply_msg):
+        if reply_msg.cmd == QUEUE_FULL:
+            raise Full(
+                "WuKongQueue server-addr:%s is full" % str(self.server_addr)
+            )
+
+    def _reply_get(self, reply_msg, convert_method=None):
+        if reply_msg.cmd == QUEUE_EMPTY:
+            raise Empty(
+                "WuKongQueue server-addr:%s is empty" % str(self.server_addr)
+            )
+        item = reply_msg.queue_params_object.data
+        if convert_method:
+            return convert_method(item)
+        return item
+
+    def _reply_lease(self, reply_msg, convert_method=None):
+        if reply_msg.cmd == QUEUE_FAIL:
+            raise reply_msg.queue_params_object.exception
+        item = self._reply_get(reply_msg, convert_method)
+        return reply_msg.queue_params_object.args["receipt"], item
+
+    def _reply_get_many(self, reply_msg, convert_method=None):
+        items = self._reply_get(reply_msg)
+        if convert_method:
+            return [convert_method(item) for item in items]
+        return items
+
+    @staticmethod
+    def _reply_data(reply_msg):
+        return reply_msg.queue_params_object.data
+
+    @staticmethod
+    def _reply_task_done(reply_msg):
+        if reply_msg.cmd != QUEUE_OK:
+            raise reply_msg.queue_params_object.exception
+
+
+class WuKongQueueClient(_ReplyParser):
     def __init__(
         self,
         host="localhost",
@@ -69,10 +158,37 @@ class WuKongQueueClient:
         encoding: unified encoding standard
 
         encoding_error: set a different error handling scheme
+
+        serializer: name of a serializer registered in
+        wukongqueue.serializer (pickle by default, bytes, json, marshal,
+        msgpack if installed) or an instance of Serializer, items put are
+        serialized by it. Items got are deserialized by the serializer of
+        their producers whatever this one is
+
+        compression: name of a compressor registered in
+        wukongqueue.serializer (zlib, lzma, zstd/lz4 if installed) or an
+        instance of Compressor, None (the default) means no compression.
+        Items are compressed one by one, server stores them compressed,
+        consumers decompress them whatever compression they use
+
+        compress_threshold: in bytes, a serialized item smaller than it is
+        not compressed, 1024 by default
+
+        queue: name of the queue to use among those hosted by the server,
+        see WuKongQueue.declare_queue, None (the default) means the queue
+        of the server itself. Raises UnknownQueue if not hosted
+
+        group: name of the consumer group getting items of a queue in mode
+        "topic", see WuKongQueue.get
         """
 
         self._logger = get_logger(self, kwargs.pop("log_level", logging.DEBUG))
         self.server_addr = (host, port)
+        self.queue = kwargs.pop("queue", None)
+        self.group = kwargs.pop("group", None)
+        self.serializer = get_serializer(kwargs.pop("serializer", "pickle"))
+        self.compressor = get_compressor(kwargs.pop("compression", None))
+        self.compress_threshold = kwargs.pop("compress_threshold", 1024)
 
         encoding = kwargs.pop("encoding", Unify_encoding)
         encoding_err = kwargs.pop("encoding_err", "strict")
@@ -125,34 +241,42 @@ class WuKongQueueClient:
         if single_connection_client:
             self.connection = self.connection_pool.get_connection()
 
-    def put(self, item, block=True, timeout=None):
+    def put(
+        self,
+        item,
+        block=True,
+        timeout=None,
+        priority=None,
+        delay=None,
+        not_before=None,
+        ttl=None,
+    ):
         """
         :param item: put an item to queue server
         :param block: see also WuKongQueue.put
         :param timeout: see also WuKongQueue.put
+        :param priority: see also WuKongQueue.put
+        :param delay: see also WuKongQueue.put
+        :param not_before: see also WuKongQueue.put
+        :param ttl: see also WuKongQueue.put
         """
         assert type(timeout) in [int, float, type(None)], (
             "invalid timeout %s" % timeout
         )
-        try:
-            cmd = wrap_queue_msg(
-                queue_cmd=QUEUE_PUT,
-                args={"block": block, "timeout": timeout},
-                data=item,
-            )
-        except Exception as e:
-            raise NotYetSupportType(
-                "%s is not supported yet, wrapping err:%s %s"
-                % (type(item), e, e.args)
-            )
-
-        reply_msg = self._send_command(cmd)
+        reply_msg = self._send_command(
+            QUEUE_PUT,
+            args={
+                "block": block,
+                "timeout": timeout,
+                "priority": priority,
+                "delay": _delay_arg(delay, not_before),
+                "ttl": ttl,
+            },
+            data=self._serialize(item),
+        )
         if reply_msg is None:
             return
-        elif reply_msg.raw_data == QUEUE_FULL:
-            raise Full(
-                "WuKongQueue server-addr:%s is full" % str(self.server_addr)
-            )
+        return self._reply_put(reply_msg)
 
     def get(self, block=True, timeout=None, convert_method=None):
         """
@@ -172,22 +296,84 @@ class WuKongQueueClient:
             "invalid timeout %s" % timeout
         )
 
-        cmd = wrap_queue_msg(
-            queue_cmd=QUEUE_GET, args={"block": block, "timeout": timeout}
+        reply_msg = self._send_command(
+            QUEUE_GET, args={"block": block, "timeout": timeout}
         )
-        reply_msg = self._send_command(cmd)
         if reply_msg is None:
             return
-        elif reply_msg.raw_data == QUEUE_EMPTY:
-            raise Empty(
-                "WuKongQueue server-addr:%s is empty" % str(self.server_addr)
-            )
-        reply_msg.unwrap()
-        item = reply_msg.queue_params_object.data
+        return self._reply_get(reply_msg, convert_method)
 
+    def put_many(
+        self,
+        items,
+        block=True,
+        timeout=None,
+        priority=None,
+        delay=None,
+        not_before=None,
+        ttl=None,
+    ) -> int:
+        """
+        :param items: put items to queue server within one round trip
+        :param block: see also WuKongQueue.put_many
+        :param timeout: see also WuKongQueue.put_many
+        :param priority: see also WuKongQueue.put_many
+        :param delay: see also WuKongQueue.put_many
+        :param not_before: see also WuKongQueue.put_many
+        :param ttl: see also WuKongQueue.put_many
+        :return: number of items put, less than len(items) only if the
+        queue is full
+
+        Note: if self.silence_err is set to True, return 0 when disconnected
+        """
+        assert type(timeout) in [int, float, type(None)], (
+            "invalid timeout %s" % timeout
+        )
+        reply_msg = self._send_command(
+            QUEUE_PUT_MANY,
+            args={
+                "block": block,
+                "timeout": timeout,
+                "priority": priority,
+                "delay": _delay_arg(delay, not_before),
+                "ttl": ttl,
+            },
+            data=self._serialize_many(items),
+        )
+        if reply_msg is None:
+            return 0
+        return reply_msg.queue_params_object.data
+
+    def get_many(
+        self, max_items, block=True, timeout=None, convert_method=None
+    ) -> list:
+        """
+        :param max_items: get up to `max_items` items within one round trip
+        :param block: see also WuKongQueue.get_many
+        :param timeout: see also WuKongQueue.get_many
+        :param convert_method: callable object to convert each item
+        :return: list of items
+
+        Note: if self.silence_err is set to True, return [] when disconnected
+        """
         if convert_method:
-            return convert_method(item)
-        return item
+            assert callable(convert_method), (
+                "not a callable obj:%s" % convert_method
+            )
+        assert type(timeout) in [int, float, type(None)], (
+            "invalid timeout %s" % timeout
+        )
+        assert isinstance(max_items, int) and max_items > 0, (
+            "invalid max_items %s" % max_items
+        )
+
+        reply_msg = self._send_command(
+            QUEUE_GET_MANY,
+            args={"block": block, "timeout": timeout, "max_items": max_items},
+        )
+        if reply_msg is None:
+            return []
+        return self._reply_get_many(reply_msg, convert_method)
 
     def full(self):
         """Whether the queue is full"""
@@ -195,7 +381,7 @@ class WuKongQueueClient:
         reply_msg = self._send_command(QUEUE_QUERY_STATUS)
         if reply_msg is None:
             return default_ret
-        return reply_msg.raw_data == QUEUE_FULL
+        return reply_msg.cmd == QUEUE_FULL
 
     def empty(self):
         """Whether the queue is empty"""
@@ -203,7 +389,57 @@ class WuKongQueueClient:
         reply_msg = self._send_command(QUEUE_QUERY_STATUS)
         if reply_msg is None:
             return default_ret
-        return reply_msg.raw_data == QUEUE_EMPTY
+        return reply_msg.cmd == QUEUE_EMPTY
+
+    def lease(
+        self,
+        block=True,
+        timeout=None,
+        visibility_timeout=None,
+        convert_method=None,
+    ):
+        """
+        :param block: see also WuKongQueue.lease
+        :param timeout: see also WuKongQueue.lease
+        :param visibility_timeout: see also WuKongQueue.lease
+        :param convert_method: callable object to convert item
+        :return: (receipt, item), finish the lease by ack(receipt) or
+        nack(receipt)
+
+        Note: if self.silence_err is set to True, return None when disconnected
+        """
+        if convert_method:
+            assert callable(convert_method), (
+                "not a callable obj:%s" % convert_method
+            )
+        assert type(timeout) in [int, float, type(None)], (
+            "invalid timeout %s" % timeout
+        )
+        reply_msg = self._send_command(
+            QUEUE_LEASE,
+            args={
+                "block": block,
+                "timeout": timeout,
+                "visibility_timeout": visibility_timeout,
+            },
+        )
+        if reply_msg is None:
+            return
+        return self._reply_lease(reply_msg, convert_method)
+
+    def ack(self, receipt):
+        """see also WuKongQueue.ack"""
+        reply_msg = self._send_command(QUEUE_ACK, args={"receipt": receipt})
+        if reply_msg is None:
+            return
+        return self._reply_task_done(reply_msg)
+
+    def nack(self, receipt):
+        """see also WuKongQueue.nack"""
+        reply_msg = self._send_command(QUEUE_NACK, args={"receipt": receipt})
+        if reply_msg is None:
+            return
+        return self._reply_task_done(reply_msg)
 
     def task_done(self):
         """Indicates that a formerly enqueued task is complete.
@@ -222,11 +458,7 @@ class WuKongQueueClient:
         reply_msg = self._send_command(QUEUE_TASK_DONE)
         if reply_msg is None:
             return
-        reply_msg.unwrap()
-        if reply_msg.queue_params_object.cmd == QUEUE_OK:
-            return
-        else:
-            raise reply_msg.queue_params_object.exception
+        return self._reply_task_done(reply_msg)
 
     def join(self):
         """Blocks until all items in the Queue have been gotten and processed.
@@ -255,14 +487,23 @@ class WuKongQueueClient:
         reply_msg.unwrap()
         return reply_msg.queue_params_object.data
 
+    def stats(self) -> dict:
+        """see also WuKongQueue.stats
+
+        Note: if self.silence_err is set to True, return {} when disconnected
+        """
+        reply_msg = self._send_command(QUEUE_STATS)
+        if reply_msg is None:
+            return {}
+        return self._reply_data(reply_msg)
+
     def reset(self, maxsize=0):
         """reset clear queue server and reset maxsize"""
         default_ret = False
-        msg = wrap_queue_msg(queue_cmd=QUEUE_RESET, args={"maxsize": maxsize})
-        reply_msg = self._send_command(msg)
+        reply_msg = self._send_command(QUEUE_RESET, args={"maxsize": maxsize})
         if reply_msg is None:
             return default_ret
-        return reply_msg.raw_data == QUEUE_OK
+        return reply_msg.cmd == QUEUE_OK
 
     def connected_clients(self):
         default_ret = 0
@@ -279,20 +520,41 @@ class WuKongQueueClient:
             return False
         if reply_msg is None:
             return False
-        return reply_msg.raw_data == QUEUE_PONG
+        return reply_msg.cmd == QUEUE_PONG
+
+    def pipeline(self):
+        """Returns a Pipeline which buffers commands and sends them within
+        one write, see also wukongqueue.Pipeline
+        """
+        return Pipeline(self)
+
+    def subscribe(self, prefetch=100, auto_ack=True):
+        """Returns a Subscription, server pushes items to it as soon as
+        they're available instead of being polled by get, see also
+        wukongqueue.Subscription
+        :param prefetch: max number of items pushed but not acked
+        :param auto_ack: whether an item is acked once it's got from the
+        subscription, otherwise call Subscription.ack after processing it
+        """
+        return Subscription(self, prefetch, auto_ack)
 
     def _release_conn(self, conn):
         # release connection except single connection
         if self.connection is None:
             self.connection_pool.release_connection(conn)
 
-    def _send_command(self, cmd_bytes):
+    def _send_command(self, queue_cmd, args=None, data=None):
         conn = self.connection or self.connection_pool.get_connection()
         if conn is None:
             # it's released, no need to release again
             return
         try:
-            reply_msg = conn.talk_with_svr(cmd_bytes)
+            reply_msg = conn.talk_with_svr(
+                queue_cmd, args=self._queue_args(args), data=data
+            )
+        except NotYetSupportType:
+            self._release_conn(conn)
+            raise
         except WuKongError as e:
             self._release_conn(conn)
             conn.on_disconnected(exception=e, err_msg=str(e.args))
@@ -304,8 +566,35 @@ class WuKongQueueClient:
             return
 
         self._release_conn(conn)
+        self._reply_queue(reply_msg)
         return reply_msg
 
+    def _send_commands(self, commands):
+        """send commands within one write, see Connection.talk_pipeline"""
+        conn = self.connection or self.connection_pool.get_connection()
+        if conn is None:
+            return
+        try:
+            replies = conn.talk_pipeline(
+                [
+                    (queue_cmd, self._queue_args(args), data)
+                    for queue_cmd, args, data in commands
+                ]
+            )
+        except NotYetSupportType:
+            self._release_conn(conn)
+            raise
+        except WuKongError as e:
+            self._release_conn(conn)
+            conn.on_disconnected(exception=e, err_msg=str(e.args))
+            return
+
+        self._release_conn(conn)
+        if not replies[-1].is_valid():
+            conn.on_disconnected(err_msg=replies[-1].err)
+            return
+        return replies
+
     def close(self):
         """close the connection to server, not off server"""
         if self.connection:
@@ -335,3 +624,324 @@ class WuKongQueueClient:
 
     def __exit__(self, exc_type, exc_val, exc_tb):
         self.close()
+
+
+class Pipeline:
+    """Buffers commands of WuKongQueueClient, then `execute` sends them all
+    within one write and reads their replies in order, so a connection
+    can have many requests in flight instead of idling on each round trip.
+
+    with client.pipeline() as pipe:
+        pipe.put(1).put(2).get()
+        pipe.realtime_qsize()
+        print(pipe.execute())  # [None, None, 1, 1]
+
+    Note: server executes commands of a connection one by one, a blocking
+    command delays the following ones, use block=False or timeout if needed.
+    """
+
+    def __init__(self, client: WuKongQueueClient):
+        self.client = client
+        # (queue_cmd, args, data)
+        self._commands = []
+        # parse reply of each command to its result
+        self._reply_handlers = []
+
+    def __len__(self):
+        return len(self._commands)
+
+    def __repr__(self):
+        return "%s<client:%s, commands:%s>" % (
+            type(self).__name__,
+            self.client,
+            len(self),
+        )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.reset()
+
+    def reset(self):
+        """discard buffered commands"""
+        self._commands = []
+        self._reply_handlers = []
+
+    def _append(self, reply_handler, queue_cmd, args=None, data=None):
+        self._commands.append((queue_cmd, args, data))
+        self._reply_handlers.append(reply_handler)
+        return self
+
+    def put(
+        self,
+        item,
+        block=True,
+        timeout=None,
+        priority=None,
+        delay=None,
+        not_before=None,
+        ttl=None,
+    ):
+        """see also WuKongQueueClient.put"""
+        return self._append(
+            self.client._reply_put,
+            QUEUE_PUT,
+            args={
+                "block": block,
+                "timeout": timeout,
+                "priority": priority,
+                "delay": _delay_arg(delay, not_before),
+                "ttl": ttl,
+            },
+            data=self.client._serialize(item),
+        )
+
+    def get(self, block=True, timeout=None, convert_method=None):
+        """see also WuKongQueueClient.get"""
+        return self._append(
+            partial(self.client._reply_get, convert_method=convert_method),
+            QUEUE_GET,
+            args={"block": block, "timeout": timeout},
+        )
+
+    def put_many(
+        self,
+        items,
+        block=True,
+        timeout=None,
+        priority=None,
+        delay=None,
+        not_before=None,
+        ttl=None,
+    ):
+        """see also WuKongQueueClient.put_many"""
+        return self._append(
+            self.client._reply_data,
+            QUEUE_PUT_MANY,
+            args={
+                "block": block,
+                "timeout": timeout,
+                "priority": priority,
+                "delay": _delay_arg(delay, not_before),
+                "ttl": ttl,
+            },
+            data=self.client._serialize_many(items),
+        )
+
+    def get_many(
+        self, max_items, block=True, timeout=None, convert_method=None
+    ):
+        """see also WuKongQueueClient.get_many"""
+        return self._append(
+            partial(
+                self.client._reply_get_many, convert_method=convert_method
+            ),
+            QUEUE_GET_MANY,
+            args={"block": block, "timeout": timeout, "max_items": max_items},
+        )
+
+    def lease(
+        self,
+        block=True,
+        timeout=None,
+        visibility_timeout=None,
+        convert_method=None,
+    ):
+        """see also WuKongQueueClient.lease"""
+        return self._append(
+            partial(self.client._reply_lease, convert_method=convert_method),
+            QUEUE_LEASE,
+            args={
+                "block": block,
+                "timeout": timeout,
+                "visibility_timeout": visibility_timeout,
+            },
+        )
+
+    def ack(self, receipt):
+        """see also WuKongQueueClient.ack"""
+        return self._append(
+            self.client._reply_task_done, QUEUE_ACK, args={"receipt": receipt}
+        )
+
+    def nack(self, receipt):
+        """see also WuKongQueueClient.nack"""
+        return self._append(
+            self.client._reply_task_done, QUEUE_NACK, args={"receipt": receipt}
+        )
+
+    def task_done(self):
+        """see also WuKongQueueClient.task_done"""
+        return self._append(self.client._reply_task_done, QUEUE_TASK_DONE)
+
+    def realtime_qsize(self):
+        """see also WuKongQueueClient.realtime_qsize"""
+        return self._append(self.client._reply_data, QUEUE_SIZE)
+
+    def stats(self):
+        """see also WuKongQueueClient.stats"""
+        return self._append(self.client._reply_data, QUEUE_STATS)
+
+    def execute(self, raise_on_error=True) -> list:
+        """Send buffered commands, then returns their results in order.
+        :param raise_on_error: if True, raises the first error such as
+        Full/Empty, otherwise the error is returned as result of its command
+
+        Note: if client's silence_err is set to True, return [] when
+        disconnected
+        """
+        commands, reply_handlers = self._commands, self._reply_handlers
+        self.reset()
+        if not commands:
+            return []
+        replies = self.client._send_commands(commands)
+        if replies is None:
+            return []
+
+        results = []
+        for reply_handler, reply_msg in zip(reply_handlers, replies):
+            try:
+                self.client._reply_queue(reply_msg)
+                results.append(reply_handler(reply_msg))
+            except (WuKongError, ValueError) as e:
+                if raise_on_error:
+                    raise
+                results.append(e)
+        return results
+
+
+class Subscription:
+    """Items pushed by server, returned by WuKongQueueClient.subscribe. It
+    has a connection of its own, server pushes items down it as soon as
+    they're available, at most `prefetch` items not acked, so consuming
+    costs no request round trips. Acks are sent back as credit for more
+    items, batched by half of `prefetch`.
+
+    with client.subscribe(prefetch=100) as sub:
+        for item in sub:
+            print(item)
+
+    An ack of an item does its task_done on server. Items pushed but not
+    acked, including those not got yet, are put back to the tail of queue
+    once the subscription is closed or its connection is lost, except in
+    mode "topic" where they were read by the group. Not thread safe.
+
+    A subscription of WuKongQueue keeps a server thread like any other
+    connection, it sleeps until items are put, credit is given or the
+    connection is lost. Only AsyncWuKongQueue serves subscriptions without
+    a thread of each.
+    """
+
+    def __init__(self, client: WuKongQueueClient, prefetch, auto_ack=True):
+        if prefetch < 1:
+            raise ValueError("'prefetch' must be a positive number")
+        self.client = client
+        self.prefetch = prefetch
+        self.auto_ack = auto_ack
+        # items pushed but not got yet
+        self._items = deque()
+        # number of items got but not acked
+        self._unacked = 0
+        # number of items acked, but not sent to server as credit yet
+        self._credit = 0
+        self._closed = False
+        pool = client.connection_pool
+        self._conn = pool.connection_cls(**pool.connection_kwargs)
+        self._conn.connect()
+        reply_msg = self._conn.talk_with_svr(
+            QUEUE_SUBSCRIBE,
+            args=client._queue_args({"prefetch": prefetch}),
+            check_health=False,
+        )
+        try:
+            if not reply_msg.is_valid():
+                raise ConnectionError(
+                    "WuKongQueue server-addr:%s is disconnected, %s"
+                    % (str(client.server_addr), reply_msg.err or "closed")
+                )
+            client._reply_queue(reply_msg)
+        except WuKongError:
+            self._conn.close()
+            raise
+
+    def __repr__(self):
+        return "%s<client:%s, prefetch:%s>" % (
+            type(self).__name__,
+            self.client,
+            self.prefetch,
+        )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def __iter__(self):
+        """items got one by one, it blocks while no items are pushed"""
+        while True:
+            yield self.get()
+
+    def get(self, block=True, timeout=None, convert_method=None):
+        """Return the next item pushed, 'block' and 'timeout' are the same
+        as WuKongQueueClient.get, raises Empty if no item was pushed. The
+        item is acked at once if auto_ack
+        """
+        if not self._items:
+            # nothing to do, so send credit rather than holding it
+            self._send_credit()
+            self._receive(block, timeout)
+        item = self._items.popleft()
+        self._unacked += 1
+        if self.auto_ack:
+            self.ack()
+        return convert_method(item) if convert_method else item
+
+    def ack(self, n=1):
+        """ack `n` items got earliest but not acked yet"""
+        n = min(n, self._unacked)
+        self._unacked -= n
+        self._credit += n
+        if self._credit >= max(self.prefetch // 2, 1):
+            self._send_credit()
+
+    def _send_credit(self):
+        if self._credit and self._conn.send(
+            QUEUE_CREDIT, args={"credit": self._credit}
+        ):
+            self._credit = 0
+
+    def _receive(self, block, timeout):
+        """read items pushed until some are got"""
+        if block and timeout is not None and timeout < 0:
+            raise ValueError("'timeout' must be a non-negative number")
+        endtime = None if timeout is None else time.monotonic() + timeout
+        while not self._items:
+            if not block:
+                remaining = 0
+            elif endtime is None:
+                remaining = None
+            else:
+                remaining = max(endtime - time.monotonic(), 0)
+            pkg = self._conn.receive(remaining)
+            if pkg is None:
+                raise Empty(
+                    "WuKongQueue server-addr:%s pushed nothing"
+                    % str(self.client.server_addr)
+                )
+            if not pkg.is_valid():
+                self._closed = True
+                self._conn.close()
+                raise ConnectionError(
+                    "WuKongQueue server-addr:%s is disconnected, %s"
+                    % (str(self.client.server_addr), pkg.err or "closed")
+                )
+            self._items.extend(pkg.queue_params_object.data)
+
+    def close(self):
+        """send credit of items acked, then close the connection"""
+        if not self._closed:
+            self._closed = True
+            self._send_credit()
+            self._conn.close()
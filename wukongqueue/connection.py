@@ -1,6 +1,7 @@
 # -*- coding: utf-8 -*-
 
 import logging
+import select
 import socket
 import threading
 import time
@@ -13,6 +14,7 @@ from .exceptions import (
     ClientsFull,
     UnknownResponse,
     AuthenticationError,
+    NotYetSupportType,
 )
 from .utils import get_logger
 
@@ -52,6 +54,8 @@ class Connection:
         self._logger = logger or get_logger(self, log_level)
         self._silence_err = silence_err
         self._tcp_client = None
+        # latest protocol advertised by the server in QUEUE_HI
+        self._server_proto = PROTO_V1
         self._last_check_health_time = int(time.time())
         self._lock = threading.Lock()
 
@@ -112,7 +116,8 @@ class Connection:
                 raise ClientsFull(
                     "The WuKongQueue server %s is full" % str(self.server_addr)
                 )
-            elif wukong_pkg.raw_data == QUEUE_HI:
+            elif wukong_pkg.cmd == QUEUE_HI:
+                self._server_proto = wukong_pkg.advertised_proto
                 return tcp_client
             else:
                 raise UnknownResponse(
@@ -125,17 +130,38 @@ class Connection:
 
     def on_connected(self):
         if self.auth_key is not None:
-            msg = wrap_queue_msg(
-                queue_cmd=QUEUE_AUTH_KEY, args={"auth_key": self.auth_key}
+            reply_msg = self._talk(
+                QUEUE_AUTH_KEY, args={"auth_key": self.auth_key}
             )
-            reply_msg = self.talk_with_svr(msg)
             if not reply_msg.is_valid():
                 raise ConnectionError
-            if reply_msg.raw_data != QUEUE_OK:
+            if reply_msg.cmd != QUEUE_OK:
                 raise AuthenticationError(
                     "WuKongQueue server-addr:%s "
                     "authentication failed" % str(self.server_addr)
                 )
+        self._negotiate_proto()
+
+    def _negotiate_proto(self):
+        """upgrade the connection to the latest wire protocol the server
+        supports, the connection keeps PROTO_V1 until server replies, or
+        if the server advertised nothing newer in QUEUE_HI"""
+        if self._server_proto < PROTO_V2:
+            return
+        reply_msg = self._talk(QUEUE_PROTO, args={"version": PROTO_LATEST})
+        if not reply_msg.is_valid():
+            raise ConnectionError
+        if reply_msg.cmd != QUEUE_DATA:
+            raise UnknownResponse(
+                "_negotiate_proto Unknown response:%s" % reply_msg.raw_data
+            )
+        self._tcp_client.proto_version = reply_msg.queue_params_object.data
+
+    def _talk(self, queue_cmd: bytes, args=None) -> WuKongPkg:
+        """talk without lock, only used while setting up the connection,
+        which may happen inside `talk_with_svr` on reconnecting"""
+        self._tcp_client.write_msg(queue_cmd, args=args)
+        return self._tcp_client.read()
 
     def on_disconnected(self, exception=None, err_msg=""):
         err_msg = "%s%s" % (", " if err_msg != "" else "", err_msg)
@@ -162,7 +188,7 @@ class Connection:
             if not reply_msg.is_valid():
                 self.connect(force=True)
                 return True
-            if reply_msg.raw_data != QUEUE_PONG:
+            if reply_msg.cmd != QUEUE_PONG:
                 raise UnknownResponse(
                     "check_health, Unknown response:%s" % reply_msg.raw_data
                 )
@@ -170,7 +196,7 @@ class Connection:
         self.connect()
         return True
 
-    def talk_with_svr(self, msg: bytes, check_health=True) -> WuKongPkg:
+    def _prepare_talk(self, check_health):
         if (
             int(time.time()) - self._last_check_health_time
             >= self.check_health_interval
@@ -181,6 +207,23 @@ class Connection:
         if self._tcp_client is None:
             self.connect()
 
+    def _wrap_msg(self, queue_cmd: bytes, args=None, data=None):
+        try:
+            return self._tcp_client.wrap_msg(queue_cmd, args=args, data=data)
+        except Exception as e:
+            raise NotYetSupportType(
+                "%s is not supported yet, wrapping err:%s %s"
+                % (type(data), e, e.args)
+            )
+
+    def talk_with_svr(
+        self, queue_cmd: bytes, args=None, data=None, check_health=True
+    ) -> WuKongPkg:
+        """send a queue msg then return the reply, the msg is wrapped
+        according to the protocol negotiated by current connection"""
+        self._prepare_talk(check_health)
+        msg = self._wrap_msg(queue_cmd, args=args, data=data)
+
         acquired = self._lock.acquire(blocking=True, timeout=0.1)
         retry_on_disconnect = self.retry_on_disconnect
         try:
@@ -188,11 +231,15 @@ class Connection:
                 if acquired:
                     self._tcp_client.write(msg)
                     reply_msg = self._tcp_client.read()
-                    if not reply_msg.is_valid():
-                        if retry_on_disconnect:
-                            self.connect(force=True)
-                            retry_on_disconnect = False
-                            continue
+                    if reply_msg.is_valid():
+                        # reply is a view into the connection's buffer,
+                        # unwrap it before others reuse the connection
+                        reply_msg.unwrap()
+                    elif retry_on_disconnect:
+                        self.connect(force=True)
+                        msg = self._wrap_msg(queue_cmd, args=args, data=data)
+                        retry_on_disconnect = False
+                        continue
                     return reply_msg
                 # if has only single connection,
                 # Do not call blocking method concurrently
@@ -201,6 +248,55 @@ class Connection:
             if acquired:
                 self._lock.release()
 
+    def send(self, queue_cmd: bytes, args=None) -> bool:
+        """write a queue msg without waiting for reply, only used by a
+        subscribed connection, see Subscription"""
+        with self._lock:
+            return self._tcp_client.write_msg(queue_cmd, args=args)
+
+    def receive(self, timeout=None) -> WuKongPkg:
+        """read a msg pushed by server to a subscribed connection, None if
+        nothing arrives within `timeout` seconds. The msg is unwrapped"""
+        readable, _, _ = select.select(
+            [self._tcp_client.sock], [], [], timeout
+        )
+        if not readable:
+            return
+        with self._lock:
+            pkg = self._tcp_client.read(ignore_socket_timeout=True)
+            if pkg.is_valid():
+                pkg.unwrap()
+            return pkg
+
+    def talk_pipeline(self, commands: list, check_health=True) -> list:
+        """send all commands within one write, then read their replies in
+        order, so that many requests are in flight on this connection.
+        :param commands: list of (queue_cmd, args, data)
+        :return: list of replies, if a reply is invalid, it is the last one
+        of the list. Pipeline is never retried on disconnect, commands
+        may have been executed partly.
+        """
+        self._prepare_talk(check_health)
+        msgs = [
+            self._wrap_msg(queue_cmd, args=args, data=data)
+            for queue_cmd, args, data in commands
+        ]
+
+        if not self._lock.acquire(blocking=True, timeout=0.1):
+            raise ConnectionError("No available connection")
+        try:
+            self._tcp_client.write_many(msgs)
+            replies = []
+            for _ in msgs:
+                reply_msg = self._tcp_client.read()
+                replies.append(reply_msg)
+                if not reply_msg.is_valid():
+                    break
+                reply_msg.unwrap()
+            return replies
+        finally:
+            self._lock.release()
+
 
 class ConnectionPool:
     """
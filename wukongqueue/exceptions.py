@@ -40,3 +40,11 @@ class UnknownResponse(ConnectionError):
 
 class UnknownCmd(ConnectionError):
     pass
+
+
+class InvalidReceipt(WuKongError, ValueError):
+    """the lease of receipt was acked, nacked or timed out"""
+
+
+class UnknownQueue(WuKongError):
+    """the queue named by a cmd is not hosted by the server"""
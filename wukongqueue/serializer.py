@@ -0,0 +1,464 @@
+# -*- coding: utf-8 -*-
+"""
+Serializers and compressors of queue items, a client picks them by
+`WuKongQueueClient(serializer=..., compression=...)`.
+
+A serialized item is:
+    codec id(1 byte) | payload
+except pickle whose payload starts with PROTO opcode 0x80, which is used as
+its codec id, so items pickled by old versions are still valid. The codec
+id travels with the item, consumers decode an item by the serializer of its
+producer, whatever serializer they use for putting.
+
+A compressed item is:
+    codec id of compressor(1 byte) | compressed serialized item
+server stores it as is, it's decompressed only when deserialized.
+
+An item pickled with out-of-band buffers (see PickleSerializer) is:
+    codec id(1 byte) | count(4 bytes) | pickle size(8 bytes)
+    | buffer size(8 bytes) * count | pickle | buffer | buffer | ...
+"""
+import json
+import lzma
+import marshal
+import pickle
+import struct
+import zlib
+
+from .exceptions import NotYetSupportType
+from .utils import Unify_encoding
+
+__all__ = [
+    "Serializer",
+    "PickleSerializer",
+    "BytesSerializer",
+    "JsonSerializer",
+    "MarshalSerializer",
+    "MsgpackSerializer",
+    "register_serializer",
+    "get_serializer",
+    "serializers",
+    "Compressor",
+    "ZlibCompressor",
+    "LzmaCompressor",
+    "ZstdCompressor",
+    "Lz4Compressor",
+    "register_compressor",
+    "get_compressor",
+    "compressors",
+]
+
+# codec ids of users start from it, builtin serializers use 1~7 (and 0x80
+# of pickle), builtin compressors use 8~15
+USER_CODEC_MIN = 16
+
+# codec id of pickle with out-of-band buffers
+OUT_OF_BAND_CODEC_ID = 5
+_OOB_HEADER = struct.Struct("!IQ")
+_OOB_SIZE = struct.Struct("!Q")
+
+# a received buffer smaller than it may be in a RecvBuffer reused by the
+# next msg, so it's copied when loaded out-of-band, see RecvBuffer
+ZERO_COPY_MIN_SIZE = 4 * 1024 * 1024
+
+
+class Serializer:
+    """subclass and register it by `register_serializer` to add a codec,
+    `dumps`/`loads` are called without the codec id"""
+
+    # unique name used by `WuKongQueueClient(serializer=name)`
+    name = None
+    # unique in [USER_CODEC_MIN, 0x7f] for serializers of users
+    codec_id = None
+
+    def dumps(self, item) -> bytes:
+        raise NotImplementedError
+
+    def loads(self, payload: memoryview):
+        """`payload` may be a memoryview or any bytes-like object"""
+        raise NotImplementedError
+
+    def encode(self, item) -> bytes:
+        return bytes((self.codec_id,)) + self.dumps(item)
+
+    def encode_parts(self, item) -> list:
+        """like `encode`, but returns buffers to be sent in order without
+        joining them"""
+        return [self.encode(item)]
+
+    def __repr__(self):
+        return "<%s name=%s codec_id=%d>" % (
+            self.__class__.__name__,
+            self.name,
+            self.codec_id,
+        )
+
+
+class _BufferItem:
+    """a bytes/bytearray/memoryview item pickled by reference to its
+    buffer, which may be out-of-band, pickle always copies bytes and
+    bytearray into the pickle. memoryview items are got as 1-D memoryviews
+    """
+
+    __slots__ = ("obj",)
+
+    def __init__(self, obj):
+        self.obj = obj
+
+    def __reduce_ex__(self, protocol):
+        cls = type(self.obj)
+        if cls not in (bytes, bytearray):
+            cls = memoryview
+        return cls, (pickle.PickleBuffer(self.obj),)
+
+
+class PickleSerializer(Serializer):
+    """any picklable object, the default one.
+
+    With protocol 5+, buffers of at least `oob_threshold` bytes are left
+    out of the pickle, i.e. bytes/bytearray/memoryview items and buffers
+    supporting protocol 5 in items like numpy arrays. They are sent as
+    they are by scatter-gather io, and loaded from the received msg without
+    copying if possible.
+    """
+
+    name = "pickle"
+    # PROTO opcode, the first byte of a pickle of protocol 2+
+    codec_id = 0x80
+
+    def __init__(
+        self, protocol=pickle.HIGHEST_PROTOCOL, oob_threshold=64 * 1024
+    ):
+        """
+        :param protocol: pickle protocol, at least 2
+        :param oob_threshold: min size in bytes of out-of-band buffers,
+        None to disable it
+        """
+        self.protocol = max(protocol, 2)
+        self.oob_threshold = oob_threshold if self.protocol >= 5 else None
+
+    def dumps(self, item) -> bytes:
+        return pickle.dumps(item, protocol=self.protocol)
+
+    def loads(self, payload):
+        return pickle.loads(payload, encoding=Unify_encoding)
+
+    def encode(self, item) -> bytes:
+        parts = self.encode_parts(item)
+        return parts[0] if len(parts) == 1 else b"".join(parts)
+
+    def encode_parts(self, item) -> list:
+        if self.oob_threshold is None:
+            return [self.dumps(item)]
+        if isinstance(item, memoryview) or (
+            isinstance(item, (bytes, bytearray))
+            and len(item) >= self.oob_threshold
+        ):
+            item = _BufferItem(item)
+
+        buffers = []
+
+        def buffer_callback(buffer):
+            """returns True to keep `buffer` in the pickle"""
+            try:
+                raw = buffer.raw()
+            except BufferError:
+                # not contiguous
+                return True
+            if raw.nbytes < self.oob_threshold:
+                return True
+            buffers.append(raw)
+            return False
+
+        data = pickle.dumps(
+            item, protocol=self.protocol, buffer_callback=buffer_callback
+        )
+        if not buffers:
+            return [data]
+        header = [
+            bytes((OUT_OF_BAND_CODEC_ID,)),
+            _OOB_HEADER.pack(len(buffers), len(data)),
+        ]
+        header.extend(_OOB_SIZE.pack(b.nbytes) for b in buffers)
+        return [b"".join(header), data] + buffers
+
+
+class _OutOfBandPickle(Serializer):
+    """loads items pickled with out-of-band buffers by PickleSerializer,
+    it's not selectable by name"""
+
+    name = "pickle-oob"
+    codec_id = OUT_OF_BAND_CODEC_ID
+
+    def loads(self, payload):
+        payload = memoryview(payload)
+        count, size = _OOB_HEADER.unpack_from(payload)
+        offset = _OOB_HEADER.size + _OOB_SIZE.size * count
+        data = payload[offset : offset + size]
+        offset += size
+        # buffers in bytes are immutable, a big msg has a one-off buffer
+        zero_copy = isinstance(payload.obj, bytes)
+        buffers = []
+        for i in range(count):
+            (size,) = _OOB_SIZE.unpack_from(
+                payload, _OOB_HEADER.size + _OOB_SIZE.size * i
+            )
+            buffer = payload[offset : offset + size]
+            offset += size
+            if not zero_copy and size < ZERO_COPY_MIN_SIZE:
+                buffer = bytearray(buffer)
+            buffers.append(buffer)
+        return pickle.loads(data, buffers=buffers, encoding=Unify_encoding)
+
+
+class BytesSerializer(Serializer):
+    """bytes-like items only, they are got as bytes"""
+
+    name = "bytes"
+    codec_id = 1
+
+    def dumps(self, item) -> bytes:
+        if not isinstance(item, (bytes, bytearray, memoryview)):
+            raise NotYetSupportType(
+                "serializer bytes does not support type:%s" % type(item)
+            )
+        return bytes(item)
+
+    def loads(self, payload):
+        return bytes(payload)
+
+
+class JsonSerializer(Serializer):
+    """json-compatible items, tuples are got as lists"""
+
+    name = "json"
+    codec_id = 2
+
+    def dumps(self, item) -> bytes:
+        return json.dumps(
+            item, ensure_ascii=False, separators=(",", ":")
+        ).encode("utf-8")
+
+    def loads(self, payload):
+        return json.loads(bytes(payload).decode("utf-8"))
+
+
+class MarshalSerializer(Serializer):
+    """builtin types only, the format may change between python versions,
+    so producers and consumers should run the same version"""
+
+    name = "marshal"
+    codec_id = 3
+
+    def dumps(self, item) -> bytes:
+        try:
+            return marshal.dumps(item)
+        except ValueError as e:
+            raise NotYetSupportType(str(e))
+
+    def loads(self, payload):
+        return marshal.loads(payload)
+
+
+class MsgpackSerializer(Serializer):
+    """requires package msgpack, registered only if it's installed"""
+
+    name = "msgpack"
+    codec_id = 4
+
+    def __init__(self):
+        import msgpack
+
+        self._msgpack = msgpack
+
+    def dumps(self, item) -> bytes:
+        return self._msgpack.packb(item, use_bin_type=True)
+
+    def loads(self, payload):
+        return self._msgpack.unpackb(payload, raw=False)
+
+
+class Compressor:
+    """subclass and register it by `register_compressor` to add a codec,
+    it shares codec ids with serializers"""
+
+    name = None
+    codec_id = None
+
+    def compress(self, data: bytes) -> bytes:
+        raise NotImplementedError
+
+    def decompress(self, payload: memoryview) -> bytes:
+        """`payload` may be a memoryview or any bytes-like object"""
+        raise NotImplementedError
+
+    def encode(self, data: bytes) -> bytes:
+        return bytes((self.codec_id,)) + self.compress(data)
+
+    def __repr__(self):
+        return "<%s name=%s codec_id=%d>" % (
+            self.__class__.__name__,
+            self.name,
+            self.codec_id,
+        )
+
+
+class ZlibCompressor(Compressor):
+    name = "zlib"
+    codec_id = 8
+
+    def __init__(self, level=6):
+        self.level = level
+
+    def compress(self, data: bytes) -> bytes:
+        return zlib.compress(data, self.level)
+
+    def decompress(self, payload) -> bytes:
+        return zlib.decompress(payload)
+
+
+class LzmaCompressor(Compressor):
+    """better ratio than zlib, but much slower"""
+
+    name = "lzma"
+    codec_id = 9
+
+    def __init__(self, preset=1):
+        self.preset = preset
+
+    def compress(self, data: bytes) -> bytes:
+        return lzma.compress(data, preset=self.preset)
+
+    def decompress(self, payload) -> bytes:
+        return lzma.decompress(payload)
+
+
+class ZstdCompressor(Compressor):
+    """requires package zstandard, registered only if it's installed"""
+
+    name = "zstd"
+    codec_id = 10
+
+    def __init__(self, level=3):
+        import zstandard
+
+        self._compressor = zstandard.ZstdCompressor(level=level)
+        self._decompressor = zstandard.ZstdDecompressor()
+
+    def compress(self, data: bytes) -> bytes:
+        return self._compressor.compress(data)
+
+    def decompress(self, payload) -> bytes:
+        return self._decompressor.decompress(payload)
+
+
+class Lz4Compressor(Compressor):
+    """requires package lz4, registered only if it's installed"""
+
+    name = "lz4"
+    codec_id = 11
+
+    def __init__(self):
+        import lz4.frame
+
+        self._lz4 = lz4.frame
+
+    def compress(self, data: bytes) -> bytes:
+        return self._lz4.compress(data)
+
+    def decompress(self, payload) -> bytes:
+        return self._lz4.decompress(payload)
+
+
+_serializers = {}
+_compressors = {}
+_by_codec_id = {}
+
+
+def _register(codec, by_name, builtin):
+    codec_id = codec.codec_id
+    if not builtin and not (
+        isinstance(codec_id, int) and USER_CODEC_MIN <= codec_id < 0x80
+    ):
+        raise ValueError(
+            "codec id must be in [%d, 127]: %s" % (USER_CODEC_MIN, codec_id)
+        )
+    if codec.name in by_name or codec_id in _by_codec_id:
+        raise ValueError("duplicate codec: %s" % codec)
+    by_name[codec.name] = codec
+    _by_codec_id[codec_id] = codec
+
+
+def register_serializer(serializer: Serializer, builtin=False):
+    """register an instance of Serializer, its name and codec id must not
+    be used by others"""
+    _register(serializer, _serializers, builtin)
+
+
+def register_compressor(compressor: Compressor, builtin=False):
+    """register an instance of Compressor like `register_serializer`"""
+    _register(compressor, _compressors, builtin)
+
+
+def get_serializer(serializer) -> Serializer:
+    """returns the registered one of name `serializer`, an instance of
+    Serializer is returned as is"""
+    if isinstance(serializer, Serializer):
+        return serializer
+    try:
+        return _serializers[serializer]
+    except KeyError:
+        raise ValueError("unknown serializer: %s" % serializer)
+
+
+def get_compressor(compressor) -> Compressor:
+    """like `get_serializer`, None is returned as is"""
+    if compressor is None or isinstance(compressor, Compressor):
+        return compressor
+    try:
+        return _compressors[compressor]
+    except KeyError:
+        raise ValueError("unknown compressor: %s" % compressor)
+
+
+def codec_of(codec_id):
+    """returns the Serializer or Compressor of `codec_id`"""
+    try:
+        return _by_codec_id[codec_id]
+    except KeyError:
+        raise ValueError("unknown codec id of item: %s" % codec_id)
+
+
+def serializers() -> list:
+    """names of registered serializers"""
+    return list(_serializers)
+
+
+def compressors() -> list:
+    """names of registered compressors"""
+    return list(_compressors)
+
+
+for _cls in (
+    PickleSerializer,
+    BytesSerializer,
+    JsonSerializer,
+    MarshalSerializer,
+):
+    register_serializer(_cls(), builtin=True)
+
+try:
+    register_serializer(MsgpackSerializer(), builtin=True)
+except ImportError:
+    pass
+
+# decoding only
+_by_codec_id[OUT_OF_BAND_CODEC_ID] = _OutOfBandPickle()
+
+for _cls in (ZlibCompressor, LzmaCompressor, ZstdCompressor, Lz4Compressor):
+    try:
+        register_compressor(_cls(), builtin=True)
+    except ImportError:
+        pass
+
+DEFAULT_SERIALIZER = _serializers[PickleSerializer.name]
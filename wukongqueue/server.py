@@ -2,14 +2,28 @@
 A small and convenient cross process FIFO queue service based on
 TCP protocol.
 """
+import heapq
 import logging
+import select
+import socket
 import threading
-from collections import deque
+from collections import deque, OrderedDict
+from itertools import count
 from queue import Full, Empty
-from time import monotonic
+from time import monotonic, time
 
 from ._commu_proto import *
-from .exceptions import UnknownCmd, Empty, Full
+from ._item_wrapper import item_value, ItemBatch
+from ._storage import (
+    Expiring,
+    FifoQueue,
+    SpillQueue,
+    PriorityQueue,
+    LifoQueue,
+    TopicQueue,
+)
+from ._wal import WriteAheadLog, FSYNC_ALWAYS
+from .exceptions import UnknownCmd, Empty, Full, InvalidReceipt, UnknownQueue
 from .utils import (
     Unify_encoding,
     md5,
@@ -19,12 +33,84 @@ from .utils import (
     helper,
 )
 
+# modes of WuKongQueue, the order of getting items
+MODE_FIFO = "fifo"
+MODE_PRIORITY = "priority"
+MODE_LIFO = "lifo"
+# fifo bounded by maxsize, put on a full queue drops the oldest item
+MODE_RING = "ring"
+# fan-out, every consumer group reads all items, see TopicQueue
+MODE_TOPIC = "topic"
+
+# consumer group of getters not selecting a group in mode "topic"
+DEFAULT_GROUP = ""
+
+# what to do with items got by a connection without task_done once the
+# connection is lost, see kwarg `on_disconnect` of WuKongQueue
+DISCONNECT_RELEASE = "release"
+DISCONNECT_REQUEUE = "requeue"
+
+
+class _Track:
+    """items got and leases of a connection on one queue"""
+
+    __slots__ = ("taken", "receipts")
+
+    def __init__(self):
+        # ids of items got without task_done in order of getting, see
+        # WuKongQueue._taken
+        self.taken = OrderedDict()
+        # receipts of leases not finished
+        self.receipts = set()
+
 
 class _ClientStatistic:
     def __init__(self, client_addr, conn: TcpConn):
         self.client_addr = client_addr
         self.me = str(client_addr)
         self.conn = conn
+        # queue -> `_Track` of the queues used by the connection
+        self.tracks = {}
+
+    def track(self, queue) -> _Track:
+        track = self.tracks.get(queue)
+        if track is None:
+            track = self.tracks[queue] = _Track()
+        return track
+
+
+class _HandshakeStatistic:
+    """latency and results of handshakes (QUEUE_HI + authentication),
+    must be accessed with `_statistic_lock` held"""
+
+    def __init__(self):
+        self.pending = 0
+        self.completed = 0
+        self.failed = 0
+        # rejected because of too many pending handshakes
+        self.rejected = 0
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+
+    def record(self, latency, ok):
+        self.pending -= 1
+        if ok:
+            self.completed += 1
+        else:
+            self.failed += 1
+        self.total_latency += latency
+        self.max_latency = max(self.max_latency, latency)
+
+    def as_dict(self) -> dict:
+        finished = self.completed + self.failed
+        return {
+            "pending": self.pending,
+            "completed": self.completed,
+            "failed": self.failed,
+            "rejected": self.rejected,
+            "avg_latency": self.total_latency / finished if finished else 0.0,
+            "max_latency": self.max_latency,
+        }
 
 
 class _WkSvrHelper:
@@ -54,6 +140,16 @@ class WuKongQueue:
 
         max_clients: max number of clients
 
+        backlog: max number of connections not accepted yet, 128 by default
+
+        acceptors: number of threads accepting connections, if it's more
+        than 1, each has its own socket listening to the same port with
+        SO_REUSEPORT, which is not supported on every platform
+
+        max_pending_handshakes: max number of connections doing handshake
+        and authentication at the same time, new connections beyond it are
+        closed immediately. It's 128 by default, 0 means no limits
+
         log_level: pass with stdlib logging.DEBUG/INFO/WARNING.., to control
         the WuKongQueue's logging level that output to stderr
 
@@ -67,11 +163,86 @@ class WuKongQueue:
         socket_timeout: maximum socket operations time allowed after successful
         connection, prevent the client from disconnecting in a way that the
         server cannot sense, thus making the resources unable to be released.
+
+        persist_dir: if set, the queue is durable, every change is appended
+        to a write-ahead log in this directory, the queue and its unfinished
+        tasks are recovered from it on start. maxsize is not persisted
+
+        fsync: fsync policy of persist_dir, "always" (default) fsync before
+        a change returns, concurrent changes share one fsync; "interval"
+        fsync every fsync_interval seconds (0.1 by default); "never"
+
+        segment_size: size in bytes of a log segment, 64MiB by default
+
+        spill_dir: if set, at most memory_items (100000 by default) items
+        are kept in memory, the middle of a bigger queue is spilled to
+        memory-mapped files of spill_segment_size (64MiB by default) bytes
+        in this directory, see SpillQueue. The files are removed by close
+        or at exit, items spilled are not kept
+
+        mode: "fifo" (default); "priority": items of the lowest priority
+        are got first, items of the same priority in order of put, see the
+        arg `priority` of put; "lifo": the item put last is got first;
+        "ring": fifo requiring maxsize, put never blocks, putting on a full
+        queue drops the oldest item, see attribute `dropped`; "topic":
+        fan-out, every consumer group reads all items in order, getters of
+        the same group compete for them, see the arg `group` of get. An
+        item is stored once, it's a task until read by all groups, so
+        there are no task_done, leases and on_disconnect, and a slow group
+        blocks put on a full queue. persist_dir and spill_dir are only
+        supported by "fifo" and "ring"
+
+        groups: names of consumer groups to add on start in mode "topic",
+        others are added by their first get, even if it waits. A new group
+        starts at the oldest item kept, see remove_group
+
+        Items put with a delay wait in a timer heap in memory, they are not
+        counted by qsize/maxsize until due. They are logged to persist_dir
+        with their due time as a unix timestamp once put, items due while
+        the server was down are due on start, see the args `delay` and
+        `not_before` of put
+
+        ttl: seconds an item can wait in the queue before it expires, None
+        (default) means forever, it's overridden by the arg `ttl` of put.
+        Expired items are never got, they are dropped by getters and by a
+        reaper thread every reap_interval (1.0 by default) seconds once
+        they reach the head of queue, see attribute `expired`. Items
+        recovered from persist_dir get a new ttl
+
+        visibility_timeout: default seconds of the lease of an item got by
+        `lease`, 30 by default, the item is put back to the queue unless
+        it's acked in time. Leases are kept in memory, items leased are lost
+        if the server crashes like items got
+
+        on_disconnect: what to do with items got by a client connection
+        without task_done once the connection is lost, None (default) does
+        nothing, their tasks are done by task_done of any client like
+        before; "release" does their tasks as if task_done was called, so
+        join() doesn't hang on crashed consumers; "requeue" puts the items
+        back to the queue, items got are kept until task_done then. A
+        task_done of a connection finishes the earliest item it got, or the
+        earliest item got by any connection if it got none, so tasks got by
+        one client can be done by another, and only items not finished yet
+        are released or requeued. Items got by get() of the server itself
+        are not tracked. Leases of the connection are nacked anyway
+
+        queues: named queues hosted besides this one, a dict of name ->
+        dict of kwargs (maxsize, mode, ttl, persist_dir...) to declare them
+        on start, see declare_queue. Clients select a queue by the arg
+        `queue` of WuKongQueueClient, this one is used if not selected
+
+        create_queues: whether a queue named by a client is created on
+        demand with default kwargs if not declared, True by default,
+        otherwise the client gets UnknownQueue
         """
         self.name = name or get_builtin_name()
         self.addr = (host, port)
-        self._tcp_svr = None
+        # listening TcpSvr of each acceptor
+        self._tcp_svrs = []
+        self.backlog = kwargs.pop("backlog", 128)
+        self.acceptors = kwargs.pop("acceptors", 1)
         self.max_clients = kwargs.pop("max_clients", 0)
+        self.max_pending_handshakes = kwargs.pop("max_pending_handshakes", 128)
         log_level = kwargs.pop("log_level", logging.DEBUG)
         self._logger = get_logger(self, log_level)
         self.socket_connect_timeout = kwargs.pop("socket_connect_timeout", 30)
@@ -84,7 +255,52 @@ class WuKongQueue:
         self.client_stats = {}
 
         self.maxsize = maxsize
-        self.queue = deque()
+        self.mode = kwargs.pop("mode", MODE_FIFO)
+        if self.mode not in (
+            MODE_FIFO,
+            MODE_PRIORITY,
+            MODE_LIFO,
+            MODE_RING,
+            MODE_TOPIC,
+        ):
+            raise ValueError("invalid mode:%s" % self.mode)
+        if self.mode == MODE_RING and maxsize <= 0:
+            raise ValueError("mode ring requires a positive maxsize")
+        # number of items dropped by put in mode "ring"
+        self.dropped = 0
+        self.ttl = kwargs.pop("ttl", None)
+        self.reap_interval = kwargs.pop("reap_interval", 1.0)
+        # number of items expired
+        self.expired = 0
+        # True once any item has a ttl
+        self._ttl_used = self.ttl is not None
+        self._reaping = False
+        spill_dir = kwargs.pop("spill_dir", None)
+        if self.mode in (MODE_PRIORITY, MODE_LIFO, MODE_TOPIC) and (
+            spill_dir is not None or kwargs.get("persist_dir") is not None
+        ):
+            raise ValueError(
+                "persist_dir and spill_dir are not supported in mode %s"
+                % self.mode
+            )
+        if self.mode == MODE_PRIORITY:
+            self.queue = PriorityQueue()
+        elif self.mode == MODE_LIFO:
+            self.queue = LifoQueue()
+        elif self.mode == MODE_TOPIC:
+            self.queue = TopicQueue()
+            for group in kwargs.pop("groups", ()):
+                self.queue.add_group(group)
+        elif spill_dir is not None:
+            self.queue = SpillQueue(
+                spill_dir,
+                memory_items=kwargs.pop("memory_items", 100000),
+                segment_size=kwargs.pop(
+                    "spill_segment_size", 64 * 1024 * 1024
+                ),
+            )
+        else:
+            self.queue = FifoQueue()
 
         # mutex must be held whenever the queue is mutating.  All methods
         # that acquire mutex must release it before returning.  mutex
@@ -105,11 +321,80 @@ class WuKongQueue:
         self.all_tasks_done = threading.Condition(self.mutex)
         self.unfinished_tasks = 0
 
+        # timer heap of delayed items, entries are
+        # (due time, seq, item, priority, id of write-ahead log or None),
+        # due items are moved into the queue by getters, see _move_due
+        self._delayed = []
+        self._delayed_seq = count()
+
+        # leases of items got by `lease`, receipt -> (deadline, item,
+        # priority), priority is None unless mode "priority", and a
+        # heap of (deadline, receipt) in order of timeout, entries of leases
+        # acked or nacked are skipped when popped
+        self.visibility_timeout = kwargs.pop("visibility_timeout", 30)
+        self._leases = {}
+        self._lease_heap = []
+        self._receipts = count(1)
+        # items got by connections without task_done, id -> (`_Track` of
+        # the connection, (item, priority) if on_disconnect is "requeue"),
+        # in order of
+        # getting, ids are unique like receipts
+        self._taken = OrderedDict()
+        self._taken_ids = count(1)
+        self.on_disconnect = kwargs.pop("on_disconnect", None)
+        if self.on_disconnect not in (
+            DISCONNECT_RELEASE,
+            DISCONNECT_REQUEUE,
+            None,
+        ):
+            raise ValueError("invalid on_disconnect:%s" % self.on_disconnect)
+        if self.mode == MODE_TOPIC:
+            # items are finished once read by all groups, not by getters
+            self.on_disconnect = None
+        # number of leases timed out
+        self.lease_timeouts = 0
+        # socket -> whether a wakeup was sent, of each subscribed
+        # connection, see _push
+        self._subscribers = {}
+
+        self._wal = None
+        persist_dir = kwargs.pop("persist_dir", None)
+        if persist_dir is not None:
+            self._wal = WriteAheadLog(
+                persist_dir,
+                fsync=kwargs.pop("fsync", FSYNC_ALWAYS),
+                fsync_interval=kwargs.pop("fsync_interval", 0.1),
+                segment_size=kwargs.pop("segment_size", 64 * 1024 * 1024),
+            )
+            items, delayed, self.unfinished_tasks = self._wal.recover()
+            self.queue.extend(self._expiring(items, None))
+            for due, delay_id, item in delayed:
+                due = monotonic() + max(due - time(), 0)
+                heapq.heappush(
+                    self._delayed,
+                    (
+                        due,
+                        next(self._delayed_seq),
+                        self._expiring((item,), None, due)[0],
+                        None,
+                        delay_id,
+                    ),
+                )
+
         self._statistic_lock = threading.Lock()
+        self._handshake_stat = _HandshakeStatistic()
         # if closed is True, server would not to listen connection request
         # from network until execute self.run() again.
         self.closed = True
 
+        # name -> queue hosted besides this one, the accept loop,
+        # connections and auth are shared with it
+        self.queues = {}
+        self._queues_lock = threading.Lock()
+        self.create_queues = kwargs.pop("create_queues", True)
+        for queue_name, queue_kwargs in kwargs.pop("queues", {}).items():
+            self.declare_queue(queue_name, **queue_kwargs)
+
         auth_key = kwargs.pop("auth_key", None)
         self._prepare_process(auth_key=auth_key)
         self.run()
@@ -126,9 +411,82 @@ class WuKongQueue:
         is still available
         """
         if self.closed:
-            self._tcp_svr = TcpSvr(*self.addr)
+            self._tcp_svrs = self._listen()
             self.on_running()
-            new_thread(self._run)
+            for tcp_svr in self._tcp_svrs:
+                new_thread(self._run, kw={"tcp_svr": tcp_svr})
+
+    def declare_queue(self, name, maxsize=0, **kwargs):
+        """Return the queue named `name` hosted by this server, it's created
+        with `maxsize` and kwargs of WuKongQueue about the queue (mode,
+        ttl, persist_dir...) if not hosted yet, or kwargs are ignored.
+        The queue has the same apis as WuKongQueue, it's closed with the
+        server
+        """
+        if not name:
+            raise ValueError("queue name must not be empty")
+        with self._queues_lock:
+            queue = self.queues.get(name)
+            if queue is None:
+                queue = self._new_hosted(name, maxsize, kwargs)
+                self.queues[name] = queue
+            return queue
+
+    def _close_storage(self):
+        """remove files of the storage if it has any, see SpillQueue"""
+        close = getattr(self.queue, "close", None)
+        if close is not None:
+            with self.mutex:
+                close()
+
+    def _new_hosted(self, name, maxsize, kwargs):
+        return _HostedQueue(self, name, maxsize=maxsize, **kwargs)
+
+    def _hosted_queues(self) -> list:
+        with self._queues_lock:
+            return list(self.queues.values())
+
+    def _queue_of(self, name):
+        """returns the queue named by a cmd, this one if not named, or None
+        if not hosted and create_queues is False"""
+        if not name:
+            return self
+        queue = self.queues.get(name)
+        if queue is None and self.create_queues:
+            queue = self.declare_queue(name)
+        return queue
+
+    def _route(self, conn, params):
+        """returns the queue to execute a cmd of client, or None once
+        UnknownQueue is replied"""
+        name = params.args.get("queue")
+        queue = self._queue_of(name)
+        if queue is None:
+            conn.write_msg(
+                QUEUE_FAIL,
+                exception=UnknownQueue(
+                    "WuKongQueue server-addr:%s has no queue %s"
+                    % (str(self.addr), name)
+                ),
+            )
+        return queue
+
+    def _listen(self) -> list:
+        """returns listening TcpSvr of each acceptor"""
+        reuse_port = self.acceptors > 1
+        tcp_svrs = []
+        try:
+            for _ in range(max(self.acceptors, 1)):
+                tcp_svrs.append(
+                    TcpSvr(
+                        *self.addr, backlog=self.backlog, reuse_port=reuse_port
+                    )
+                )
+        except OSError:
+            for tcp_svr in tcp_svrs:
+                tcp_svr.close()
+            raise
+        return tcp_svrs
 
     def close(self):
         """
@@ -138,13 +496,18 @@ class WuKongQueue:
         disconnected immediately
         """
         self.closed = True
-        if self._tcp_svr:
-            self._tcp_svr.close()
-            self._tcp_svr = None
+        for tcp_svr in self._tcp_svrs:
+            tcp_svr.close()
+        self._tcp_svrs = []
         with self._statistic_lock:
             for client_stat in self.client_stats.values():
                 client_stat.conn.close()
             self.client_stats.clear()
+        for queue in self._hosted_queues():
+            queue.close()
+        if self._wal is not None:
+            self._wal.close()
+        self._close_storage()
 
         self._logger.debug(
             "<WuKongQueue [{}] listened {} was closed>".format(
@@ -179,7 +542,219 @@ class WuKongQueue:
     def _qsize(self):
         return len(self.queue)
 
-    def get(self, block=True, timeout=None, convert_method=None):
+    def _expiring(self, items, ttl, start=None) -> list:
+        """wrap items as Expiring if they have a ttl, `start` is the
+        monotonic time the ttl starts, now by default"""
+        if ttl is None:
+            ttl = self.ttl
+            if ttl is None:
+                return items
+        deadline = (monotonic() if start is None else start) + ttl
+        return [Expiring(item, deadline) for item in items]
+
+    def _start_reaper(self):
+        """must be called with mutex held"""
+        self._ttl_used = True
+        if not self._reaping and not self.closed:
+            self._reaping = True
+            new_thread(self._reap_periodically)
+
+    def _reap_periodically(self, batch=1000):
+        """drop expired items every reap_interval seconds, the mutex is
+        released every `batch` items, so getters aren't delayed long. It
+        exits once closed"""
+        while not self.closed:
+            threading.Event().wait(self.reap_interval)
+            while True:
+                with self.mutex:
+                    n = self._drop_expired(batch)
+                if n < batch:
+                    break
+        with self.mutex:
+            self._reaping = False
+
+    def _drop_expired(self, limit=None) -> int:
+        """must be called with mutex held, drop expired items at the head
+        of queue, returns number of items dropped"""
+        now = monotonic()
+        queue = self.queue
+        n = 0
+        while queue and (limit is None or n < limit):
+            item = queue.peek()
+            if type(item) is not Expiring or item.deadline > now:
+                break
+            queue.popleft()
+            n += 1
+        self._count_expired(n)
+        return n
+
+    def _count_expired(self, n) -> int:
+        """must be called with mutex held, `n` expired items were removed
+        from the queue, they are not tasks any more, returns lsn of the
+        write-ahead log or 0"""
+        if not n:
+            return 0
+        self.expired += n
+        self.unfinished_tasks -= n
+        if not self.unfinished_tasks:
+            self.all_tasks_done.notify_all()
+        self.not_full.notify(n)
+        return self._wal.log_drop(n) if self._wal else 0
+
+    def _ready(self, group=None) -> int:
+        """must be called with mutex held, number of items can be got now,
+        by `group` if it's not None in mode "topic", due items are moved
+        into the queue and expired ones are dropped"""
+        self._move_due()
+        if self._ttl_used:
+            self._drop_expired()
+        if group is not None:
+            return self.queue.lag(group)
+        return self._qsize()
+
+    @staticmethod
+    def _due_time(delay, not_before):
+        """monotonic time an item put with `delay` seconds or at the unix
+        timestamp `not_before` is due, None if it's due now"""
+        if not_before is not None:
+            delay = not_before - time()
+        if delay is None or delay <= 0:
+            return None
+        return monotonic() + delay
+
+    def _schedule(self, due, items, priority, records) -> int:
+        """must be called with mutex held, push items into the timer heap,
+        `items` are wrapped by `_expiring` already. They are logged with
+        the due time by the clock of wall, returns lsn of the write-ahead
+        log or 0"""
+        ids, lsn = None, 0
+        if records:
+            ids, lsn = self._wal.log_delay(time() + due - monotonic(), records)
+        for i, item in enumerate(items):
+            heapq.heappush(
+                self._delayed,
+                (
+                    due,
+                    next(self._delayed_seq),
+                    item,
+                    priority,
+                    ids[i] if ids else None,
+                ),
+            )
+        self.unfinished_tasks += len(items)
+        # a waiter may have to wake earlier
+        self._notify_getters(1)
+        return lsn
+
+    def _next_due(self):
+        """must be called with mutex held, seconds until the first delayed
+        item is due or the first lease times out, None if there are no
+        delayed items and leases"""
+        due = self._delayed[0][0] if self._delayed else None
+        if self._lease_heap and (due is None or self._lease_heap[0][0] < due):
+            due = self._lease_heap[0][0]
+        return None if due is None else max(due - monotonic(), 0)
+
+    def _move_due(self) -> int:
+        """must be called with mutex held, move due items from the timer
+        heap into the queue, and put back items whose lease timed out,
+        returns number of items moved. Their ids are logged now without
+        waiting for fsync, nobody waits for them, they are moved again on
+        recovery if lost"""
+        if not self._delayed and not self._lease_heap:
+            return 0
+        now = monotonic()
+        n = 0
+        delayed = self._delayed
+        if delayed and delayed[0][0] <= now:
+            ids = []
+            while delayed and delayed[0][0] <= now:
+                _, _, item, priority, delay_id = heapq.heappop(delayed)
+                self._put_items((item,), priority)
+                if delay_id is not None:
+                    ids.append(delay_id)
+                n += 1
+            if self._wal:
+                self._wal.log_due(ids)
+        lease_heap = self._lease_heap
+        if lease_heap and lease_heap[0][0] <= now:
+            items = []
+            while lease_heap and lease_heap[0][0] <= now:
+                _, receipt = heapq.heappop(lease_heap)
+                lease = self._leases.pop(receipt, None)
+                if lease is not None:
+                    items.append(lease[1:])
+            self.lease_timeouts += len(items)
+            self._requeue(items)
+            n += len(items)
+        if n:
+            self._drop_overflow()
+            self._notify_getters(n)
+        return n
+
+    def _notify_getters(self, n):
+        """must be called with mutex held, `n` items were added to the
+        queue, all getters are notified in mode "topic" since every group
+        reads them. Subscribed connections are woken too, each is sent a
+        byte unless it's not awake yet, see _push"""
+        if self.mode == MODE_TOPIC:
+            self.not_empty.notify_all()
+        else:
+            self.not_empty.notify(n)
+        subscribers = self._subscribers
+        for waker, woken in subscribers.items():
+            if not woken:
+                subscribers[waker] = True
+                try:
+                    waker.send(b"\0")
+                except OSError:
+                    pass
+
+    def _requeue(self, entries) -> int:
+        """must be called with mutex held, put back items got, `entries`
+        are (item, priority) got, they are still unfinished tasks, returns
+        lsn of the write-ahead log or 0. They are put to the tail of queue,
+        with the priority they were got with in mode "priority" and a new
+        ttl"""
+        if not entries:
+            return 0
+        items = [item for item, _ in entries]
+        if self.mode == MODE_PRIORITY:
+            for item, priority in entries:
+                self._put_items(self._expiring([item], None), priority)
+        else:
+            self._put_items(self._expiring(items, None), None)
+        return self._wal.log_requeue(items) if self._wal else 0
+
+    def _put_items(self, items, priority):
+        """must be called with mutex held"""
+        if self.mode == MODE_PRIORITY:
+            self.queue.extend(items, 0 if priority is None else priority)
+        else:
+            self.queue.extend(items)
+
+    def _drop_overflow(self) -> int:
+        """must be called with mutex held, drop the oldest items beyond
+        maxsize in mode "ring", returns lsn of the write-ahead log or 0"""
+        if self.mode != MODE_RING:
+            return 0
+        n = self._qsize() - self.maxsize
+        if n <= 0:
+            return 0
+        for _ in range(n):
+            self.queue.popleft()
+        self.dropped += n
+        self.unfinished_tasks -= n
+        return self._wal.log_drop(n) if self._wal else 0
+
+    def _sync_wal(self, lsn):
+        """wait for the write-ahead log to be durable up to `lsn` (returned
+        by `WriteAheadLog.log_*`), must be called without mutex held, so
+        that concurrent changes share one fsync"""
+        if lsn:
+            self._wal.sync(lsn)
+
+    def get(self, block=True, timeout=None, convert_method=None, group=None):
         """Remove and return an item from the queue.
         :param block
         :param timeout
@@ -191,42 +766,406 @@ class WuKongQueue:
         available, else raise the Empty exception ('timeout' is ignored
         in that case).
         :param convert_method: eventually, `get` returns convert_method(item)
+        :param group: name of the consumer group reading the next item it
+        hasn't read in mode "topic", DEFAULT_GROUP if None, ignored by
+        other modes
         """
+        item, _ = self._get(block, timeout, group)
+        item = item_value(item)
+        return convert_method(item) if convert_method is not None else item
+
+    def _get(self, block, timeout, group=None):
+        """returns (item, priority), the item is returned as stored, it's
+        Serialized if put by client, see _popleft for priority"""
+        if self.mode == MODE_TOPIC:
+            return self._read(group, 1, block, timeout)[0], None
+        with self.not_empty:
+            item, priority, lsn = self._pop(block, timeout)
+        self._sync_wal(lsn)
+        return item, priority
+
+    def _pop(self, block, timeout):
+        """must be called with mutex held, wait for an item and remove it
+        from the queue, returns (item, priority, lsn of the write-ahead log
+        or 0), see _popleft"""
+        self._wait_not_empty(block, timeout)
+        # the head isn't expired, see _ready
+        item, priority = self._popleft()
+        lsn = self._wal.log_get() if self._wal else 0
+        self.not_full.notify()
+        return item.item if type(item) is Expiring else item, priority, lsn
+
+    def _popleft(self):
+        """must be called with mutex held, pop the head, returns (item as
+        stored, priority), priority is None unless in mode priority"""
+        if self.mode == MODE_PRIORITY:
+            return self.queue.popleft_with_priority()
+        return self.queue.popleft(), None
+
+    def lease(
+        self,
+        block=True,
+        timeout=None,
+        visibility_timeout=None,
+        convert_method=None,
+    ):
+        """Remove an item from the queue like get(), but lease it for
+        'visibility_timeout' seconds (attribute visibility_timeout by
+        default). Returns (receipt, item), the lease is finished by
+        ack(receipt), otherwise the item is put back to the queue once
+        nack(receipt) is called or the lease times out, so it's got again.
+        :param block: see get()
+        :param timeout: see get()
+        :param visibility_timeout
+        :param convert_method: see get()
+        """
+        receipt, item = self._lease(block, timeout, visibility_timeout)
+        item = item_value(item)
+        if convert_method is not None:
+            item = convert_method(item)
+        return receipt, item
+
+    def _lease(self, block, timeout, visibility_timeout):
+        """the item is returned as stored like `_get`"""
+        if self.mode == MODE_TOPIC:
+            raise ValueError("lease is not supported in mode topic")
+        if visibility_timeout is None:
+            visibility_timeout = self.visibility_timeout
+        with self.not_empty:
+            item, priority, lsn = self._pop(block, timeout)
+            receipt = next(self._receipts)
+            deadline = monotonic() + visibility_timeout
+            self._leases[receipt] = (deadline, item, priority)
+            heapq.heappush(self._lease_heap, (deadline, receipt))
+            # a waiter may have to wake earlier
+            self._notify_getters(1)
+        self._sync_wal(lsn)
+        return receipt, item
+
+    def ack(self, receipt):
+        """Finish the lease of receipt, the task of item is done like
+        task_done(). Raises InvalidReceipt if the lease was finished or
+        timed out
+        """
+        with self.mutex:
+            if self._leases.pop(receipt, None) is None:
+                raise InvalidReceipt("invalid receipt:%s" % receipt)
+            lsn = self._task_done()
+        self._sync_wal(lsn)
+
+    def nack(self, receipt):
+        """Finish the lease of receipt, and put the item back to the queue.
+        Raises InvalidReceipt if the lease was finished or timed out
+        """
+        with self.mutex:
+            lease = self._leases.pop(receipt, None)
+            if lease is None:
+                raise InvalidReceipt("invalid receipt:%s" % receipt)
+            lsn = self._requeue([lease[1:]])
+            lsn = max(lsn, self._drop_overflow())
+            self._notify_getters(1)
+        self._sync_wal(lsn)
+
+    def get_many(
+        self,
+        max_items,
+        block=True,
+        timeout=None,
+        convert_method=None,
+        group=None,
+    ) -> list:
+        """Remove and return up to 'max_items' items from the queue, the
+        mutex is taken once for the whole batch.
+        :param max_items: max number of items returned
+        :param block
+        :param timeout
+        'block' and 'timeout' apply to the first item like get(), then
+        it returns as many items as immediately available
+        :param convert_method: eventually, `get_many` returns
+        [convert_method(item), ...]
+        :param group: see get()
+        """
+        items, _ = self._get_many(max_items, block, timeout, group)
+        items = [item_value(item) for item in items]
+        if convert_method is not None:
+            return [convert_method(item) for item in items]
+        return items
+
+    def _get_many(self, max_items, block, timeout, group=None):
+        """returns (items, priorities), items are returned as stored like
+        `_get`, and priorities of them"""
+        if max_items < 1:
+            raise ValueError("'max_items' must be a positive number")
+        if self.mode == MODE_TOPIC:
+            items = self._read(group, max_items, block, timeout)
+            return items, [None] * len(items)
+        endtime = self._endtime(block, timeout)
+        lsn = 0
+        with self.not_empty:
+            while True:
+                self._wait_not_empty(block, timeout)
+                n = min(max_items, self._qsize())
+                entries = [self._popleft() for _ in range(n)]
+                items = [item for item, _ in entries]
+                priorities = [priority for _, priority in entries]
+                expired = 0
+                if self._ttl_used:
+                    items, expired = self._unwrap_expiring(items, priorities)
+                if self._wal and n > expired:
+                    lsn = self._wal.log_get(n - expired)
+                lsn = max(lsn, self._count_expired(expired))
+                self.not_full.notify(n)
+                if items:
+                    break
+                # all expired since checked by _ready, wait for the rest
+                # of timeout
+                if endtime is not None:
+                    timeout = max(endtime - monotonic(), 0)
+        self._sync_wal(lsn)
+        return items, priorities
+
+    @staticmethod
+    def _endtime(block, timeout):
+        """monotonic time a blocking wait of `timeout` ends, None if it
+        doesn't block or never times out"""
+        if not block or timeout is None:
+            return None
+        return monotonic() + timeout
+
+    def _read(self, group, max_items, block, timeout) -> list:
+        """read up to `max_items` items not read by `group` in mode
+        "topic", 'block' and 'timeout' apply like _get_many. Items are
+        returned as stored like `_get`"""
+        if group is None:
+            group = DEFAULT_GROUP
+        endtime = self._endtime(block, timeout)
         with self.not_empty:
-            if not block:
-                if not self._qsize():
+            # the group reads items put from now on even if it waits
+            self.queue.add_group(group)
+            while True:
+                self._wait_not_empty(block, timeout, group)
+                items, n = self.queue.read(group, max_items)
+                self._count_read(n)
+                if self._ttl_used:
+                    # expired items are skipped, they are dropped once
+                    # reaching the head of queue
+                    items, _ = self._unwrap_expiring(items)
+                if items:
+                    return items
+                if endtime is not None:
+                    timeout = max(endtime - monotonic(), 0)
+
+    def _push(self, conn, credit, group):
+        """run by the thread of a subscribed connection, push items to it
+        as soon as they're available while it has `credit`, the client
+        gives more credit by QUEUE_CREDIT once it acks items pushed, see
+        _ack_pushed. The thread waits for credit, the loss of connection
+        and a wakeup by _notify_getters with one select, so it never polls.
+        It returns once the connection is lost, then items pushed but not
+        acked are put back, see _put_back"""
+        # items pushed but not acked, in order of pushing
+        pushed = deque()
+        wakeup, waker = socket.socketpair()
+        wakeup.setblocking(False)
+        waker.setblocking(False)
+        with self.mutex:
+            self._subscribers[waker] = False
+        try:
+            while True:
+                items = None
+                timeout = None
+                if credit:
+                    with self.mutex:
+                        # items put from now on wake it again
+                        self._subscribers[waker] = False
+                        try:
+                            wakeup.recv(64)
+                        except BlockingIOError:
+                            pass
+                    try:
+                        items, priorities = self._get_many(
+                            credit, False, None, group
+                        )
+                    except Empty:
+                        with self.mutex:
+                            timeout = self._next_due()
+                if items:
+                    if self.mode != MODE_TOPIC:
+                        pushed.extend(zip(items, priorities))
+                    if not conn.write_msg(QUEUE_DATA, data=ItemBatch(items)):
+                        return
+                    credit -= len(items)
+                    # only take credit already sent
+                    timeout = 0
+                waiting = [conn.sock, wakeup] if credit else [conn.sock]
+                if conn.sock in select.select(waiting, [], [], timeout)[0]:
+                    n = self._take_credit(conn, pushed)
+                    if n is None:
+                        return
+                    credit += n
+        except (OSError, ValueError):
+            # the connection is closed by server
+            return
+        finally:
+            with self.mutex:
+                del self._subscribers[waker]
+            wakeup.close()
+            waker.close()
+            try:
+                # credit sent before the connection was lost acks items
+                if pushed and select.select([conn.sock], [], [], 0)[0]:
+                    self._take_credit(conn, pushed)
+            except (OSError, ValueError):
+                pass
+            self._put_back(list(pushed))
+
+    def _take_credit(self, conn, pushed):
+        """read QUEUE_CREDIT msgs of a subscribed connection until none is
+        readable, items acked by them are done, see _ack_pushed. Returns
+        the credit given, None once the connection is lost"""
+        credit = 0
+        while True:
+            msg = self._parse_socket_msg(conn=conn, ignore_socket_timeout=True)
+            if msg is None:
+                return
+            if msg.queue_params_object.cmd != QUEUE_CREDIT:
+                # no replies to other cmds on a subscribed connection
+                conn.close()
+                return
+            n = msg.queue_params_object.args.get("credit", 0)
+            self._ack_pushed(pushed, n)
+            credit += n
+            if not select.select([conn.sock], [], [], 0)[0]:
+                return credit
+
+    def _ack_pushed(self, pushed, n):
+        """the earliest `n` items of `pushed` were acked, their tasks are
+        done. Items of mode "topic" are never kept in `pushed`"""
+        n = min(n, len(pushed))
+        if not n:
+            return
+        for _ in range(n):
+            pushed.popleft()
+        with self.mutex:
+            n = min(n, self.unfinished_tasks)
+            self.unfinished_tasks -= n
+            if not self.unfinished_tasks:
+                self.all_tasks_done.notify_all()
+            lsn = self._wal.log_task_done(n) if self._wal and n else 0
+        self._sync_wal(lsn)
+
+    def _put_back(self, entries):
+        """put back items pushed to a subscribed connection but not acked
+        once it's lost, like nack, `entries` are (item, priority) pushed"""
+        if not entries:
+            return
+        with self.mutex:
+            lsn = self._requeue(entries)
+            lsn = max(lsn, self._drop_overflow())
+            self._notify_getters(len(entries))
+        self._sync_wal(lsn)
+
+    def _count_read(self, n):
+        """must be called with mutex held, `n` items were dropped since all
+        groups have read them, they are not tasks any more"""
+        if not n:
+            return
+        self.unfinished_tasks -= n
+        if not self.unfinished_tasks:
+            self.all_tasks_done.notify_all()
+        self.not_full.notify(n)
+
+    def remove_group(self, group):
+        """Remove the consumer group in mode "topic", items only it hadn't
+        read are dropped. It's added again by its next get
+        """
+        if self.mode != MODE_TOPIC:
+            raise ValueError("consumer groups are only in mode topic")
+        with self.mutex:
+            self._count_read(self.queue.remove_group(group))
+
+    @staticmethod
+    def _unwrap_expiring(items, priorities=None) -> (list, int):
+        """returns items not expired, and number of expired ones.
+        `priorities` of items are kept for items not expired only"""
+        now = monotonic()
+        ret = []
+        kept = []
+        for i, item in enumerate(items):
+            if type(item) is Expiring:
+                if item.deadline <= now:
+                    continue
+                item = item.item
+            ret.append(item)
+            kept.append(i)
+        if priorities is not None and len(kept) < len(items):
+            priorities[:] = [priorities[i] for i in kept]
+        return ret, len(items) - len(ret)
+
+    def _wait_not_empty(self, block, timeout, group=None):
+        """must be called with mutex held, raises Empty on failure, it
+        wakes up when the next delayed item is due. It waits for items not
+        read by `group` if it's not None, see _ready"""
+        if not block:
+            if not self._ready(group):
+                raise Empty
+        elif timeout is None:
+            while not self._ready(group):
+                self.not_empty.wait(self._next_due())
+        elif timeout < 0:
+            raise ValueError("'timeout' must be a non-negative number")
+        else:
+            endtime = monotonic() + timeout
+            while not self._ready(group):
+                remaining = endtime - monotonic()
+                if remaining <= 0.0:
                     raise Empty
-            elif timeout is None:
-                while not self._qsize():
-                    self.not_empty.wait()
-            elif timeout < 0:
-                raise ValueError("'timeout' must be a non-negative number")
-            else:
-                endtime = monotonic() + timeout
-                while not self._qsize():
-                    remaining = endtime - monotonic()
-                    if remaining <= 0.0:
-                        raise Empty
-                    self.not_empty.wait(remaining)
-            item = self.queue.popleft()
-            self.not_full.notify()
-            return convert_method(item) if convert_method is not None else item
-
-    def put(self, item, block=True, timeout=None):
+                due = self._next_due()
+                self.not_empty.wait(
+                    remaining if due is None else min(remaining, due)
+                )
+
+    def put(
+        self,
+        item,
+        block=True,
+        timeout=None,
+        priority=None,
+        delay=None,
+        not_before=None,
+        ttl=None,
+    ):
         """Put an item into the queue.
         :param item: value for put
         :param block
         :param timeout
+        :param priority: an int, 0 by default, items of the lowest priority
+        are got first in mode "priority", ignored by other modes
+        :param delay: seconds before the item can be got
+        :param not_before: unix timestamp before which the item can't be
+        got, it overrides `delay`
+        A delayed item never blocks or raises Full, it's moved into the
+        queue when due even if the queue is full
+        :param ttl: seconds before the item expires, the ttl of queue by
+        default, it starts when the item is due if it's delayed
         If optional args 'block' is true and 'timeout' is None (the default),
         block if necessary until a free slot is available. If 'timeout' is
         a non-negative number, it blocks at most 'timeout' seconds and raises
         the Full exception if no free slot was available within that time.
         Otherwise ('block' is false), put an item on the queue if a free slot
         is immediately available, else raise the Full exception ('timeout'
-        is ignored in that case)
+        is ignored in that case). In mode "ring", it never blocks or raises
+        Full, but drops the oldest item
         """
+        due = self._due_time(delay, not_before)
+        records = self._wal.encode_items([item]) if self._wal else None
+        items = self._expiring((item,), ttl, due)
         with self.not_full:
-            if self.maxsize > 0:
+            if ttl is not None:
+                self._start_reaper()
+            if due is not None:
+                lsn = self._schedule(due, items, priority, records)
+            elif self.maxsize > 0 and self.mode != MODE_RING:
                 if not block:
                     if self._qsize() >= self.maxsize:
                         raise Full
@@ -242,9 +1181,79 @@ class WuKongQueue:
                         if remaining <= 0.0:
                             raise Full
                         self.not_full.wait(remaining)
-            self.queue.append(item)
-            self.unfinished_tasks += 1
-            self.not_empty.notify()
+            if due is None:
+                self._put_items(items, priority)
+                lsn = self._wal.log_put(records) if self._wal else 0
+                self.unfinished_tasks += 1
+                lsn = max(lsn, self._drop_overflow())
+                self._notify_getters(1)
+        self._sync_wal(lsn)
+
+    def put_many(
+        self,
+        items,
+        block=True,
+        timeout=None,
+        priority=None,
+        delay=None,
+        not_before=None,
+        ttl=None,
+    ) -> int:
+        """Put items into the queue in order, the mutex is taken once for
+        the whole batch.
+        :param items: list of values for put
+        :param block
+        :param timeout
+        :param priority: priority of all items, see put()
+        :param delay: see put()
+        :param not_before: see put()
+        :param ttl: see put()
+        Like put(), it blocks while the queue is full, and other threads can
+        get the items already put meanwhile. If 'block' is false or 'timeout'
+        expires, it stops putting and returns.
+        :return: number of items put, less than len(items) only if the queue
+        is full
+        """
+        if block and timeout is not None and timeout < 0:
+            raise ValueError("'timeout' must be a non-negative number")
+        items = list(items)
+        total = len(items)
+        put = 0
+        lsn = 0
+        due = self._due_time(delay, not_before)
+        records = self._wal.encode_items(items) if self._wal else None
+        items = self._expiring(items, ttl, due)
+        with self.not_full:
+            if ttl is not None:
+                self._start_reaper()
+            if due is not None:
+                lsn = self._schedule(due, items, priority, records)
+                put = total
+            endtime = None if timeout is None else monotonic() + timeout
+            while put < total:
+                free = total - put
+                if self.maxsize > 0 and self.mode != MODE_RING:
+                    free = min(free, self.maxsize - self._qsize())
+                    if free <= 0:
+                        if not block:
+                            break
+                        if endtime is None:
+                            self.not_full.wait()
+                            continue
+                        remaining = endtime - monotonic()
+                        if remaining <= 0.0:
+                            break
+                        self.not_full.wait(remaining)
+                        continue
+                self._put_items(items[put : put + free], priority)
+                if self._wal:
+                    lsn = self._wal.log_put(records[put : put + free])
+                put += free
+                self.unfinished_tasks += free
+                lsn = max(lsn, self._drop_overflow())
+                self._notify_getters(free)
+        self._sync_wal(lsn)
+        return put
 
     def put_nowait(self, item):
         """
@@ -272,19 +1281,27 @@ class WuKongQueue:
         """Return True if the queue is full, False otherwise
         """
         with self.mutex:
-            return 0 < self.maxsize <= self._qsize()
+            return 0 < self.maxsize <= self._ready()
 
     def empty(self) -> bool:
         """Return True if the queue is empty, False otherwise
         """
         with self.mutex:
-            return not self._qsize()
+            return not self._ready()
 
     def qsize(self) -> int:
-        """Return the approximate size of the queue
+        """Return the approximate size of the queue, delayed items are
+        not counted until due
         """
         with self.mutex:
-            return self._qsize()
+            return self._ready()
+
+    def delayed_qsize(self) -> int:
+        """Return the number of delayed items not due yet
+        """
+        with self.mutex:
+            self._move_due()
+            return len(self._delayed)
 
     def reset(self, maxsize=None):
         """reset clears current queue and creates a new queue with
@@ -293,6 +1310,34 @@ class WuKongQueue:
         with self.mutex:
             self.maxsize = maxsize if maxsize else self.maxsize
             self.queue.clear()
+            self._delayed.clear()
+            self._leases.clear()
+            self._lease_heap.clear()
+            lsn = self._wal.log_reset() if self._wal else 0
+        self._sync_wal(lsn)
+
+    def stats(self) -> dict:
+        """Return counters of the queue: qsize, maxsize, delayed items,
+        leased items, leases timed out, unfinished tasks, items dropped in
+        mode "ring", items expired and connected clients. In mode "topic",
+        "groups" is a dict of group -> {"lag": number of items not read,
+        "read": number of items read}
+        """
+        with self.mutex:
+            stats = {
+                "qsize": self._ready(),
+                "maxsize": self.maxsize,
+                "delayed": len(self._delayed),
+                "leased": len(self._leases),
+                "lease_timeouts": self.lease_timeouts,
+                "unfinished_tasks": self.unfinished_tasks,
+                "dropped": self.dropped,
+                "expired": self.expired,
+            }
+            if self.mode == MODE_TOPIC:
+                stats["groups"] = self.queue.groups()
+        stats["clients"] = self.connected_clients()
+        return stats
 
     def task_done(self):
         """Indicate that a formerly enqueued task is complete.
@@ -306,15 +1351,105 @@ class WuKongQueue:
          for every item that had been put() into the queue).
 
          Raises a ValueError if called more times than there were items
-         placed in the queue.
+         placed in the queue, or in mode "topic".
          """
+        self._finish_task(None)
+
+    def _finish_task(self, client_stat):
+        """task_done called by the connection of `client_stat`, or by the
+        server itself if it's None"""
+        if self.mode == MODE_TOPIC:
+            raise ValueError("task_done() is not supported in mode topic")
         with self.all_tasks_done:
-            unfinished = self.unfinished_tasks - 1
-            if unfinished <= 0:
-                if unfinished < 0:
-                    raise ValueError("task_done() called too many times")
-                self.all_tasks_done.notify_all()
-            self.unfinished_tasks = unfinished
+            lsn = self._task_done()
+            self._untrack_done(client_stat)
+        self._sync_wal(lsn)
+
+    def _track_taken(self, client_stat, items, priorities):
+        """`items` were got with `priorities` by the connection of
+        `client_stat`"""
+        if client_stat is None or self.on_disconnect is None:
+            return
+        keep = self.on_disconnect == DISCONNECT_REQUEUE
+        with self.mutex:
+            track = client_stat.track(self)
+            for entry in zip(items, priorities):
+                taken_id = next(self._taken_ids)
+                track.taken[taken_id] = None
+                self._taken[taken_id] = (track, entry if keep else None)
+
+    def _untrack_done(self, client_stat):
+        """must be called with mutex held, a task was done by the
+        connection of `client_stat`, or by the server if it's None. The
+        earliest item the connection got is finished, or the earliest item
+        got by any connection if it got none. The server's items aren't
+        tracked, its task_done finishes a connection's item only if there
+        are more items tracked than unfinished tasks"""
+        taken = self._taken
+        if not taken:
+            return
+        track = client_stat and client_stat.tracks.get(self)
+        if track is not None and track.taken:
+            taken_id, _ = track.taken.popitem(last=False)
+            del taken[taken_id]
+        elif client_stat is not None or len(taken) > self.unfinished_tasks:
+            taken_id, (track, _) = taken.popitem(last=False)
+            del track.taken[taken_id]
+
+    def _release_client(self, client_stat):
+        """called once the connection of `client_stat` is lost, items it
+        got without task_done are released or requeued, and its leases are
+        nacked, on each queue it used, see kwarg `on_disconnect`"""
+        tracks, client_stat.tracks = client_stat.tracks, {}
+        for queue, track in tracks.items():
+            queue._release_track(track, client_stat.me)
+
+    def _release_track(self, track, me):
+        """release items and leases of `track` on this queue, `me` is the
+        identity of the connection lost"""
+        with self.mutex:
+            leased = [
+                self._leases.pop(receipt)[1:]
+                for receipt in track.receipts
+                if receipt in self._leases
+            ]
+            track.receipts.clear()
+            # items finished by task_done of other connections are not
+            # tracked any more
+            taken = [self._taken.pop(taken_id)[1] for taken_id in track.taken]
+            track.taken.clear()
+            if self.on_disconnect == DISCONNECT_REQUEUE:
+                leased.extend(taken)
+            lsn = self._requeue(leased)
+            if leased:
+                lsn = max(lsn, self._drop_overflow())
+                self._notify_getters(len(leased))
+            released = 0
+            if self.on_disconnect == DISCONNECT_RELEASE and taken:
+                released = len(taken)
+                self.unfinished_tasks -= released
+                if not self.unfinished_tasks:
+                    self.all_tasks_done.notify_all()
+                if self._wal:
+                    lsn = max(lsn, self._wal.log_task_done(released))
+        self._sync_wal(lsn)
+        if leased or released:
+            self._logger.debug(
+                "[server:%s] lost client %s, %d items of queue [%s] "
+                "requeued, %d tasks released"
+                % (self.addr, me, len(leased), self.name, released)
+            )
+
+    def _task_done(self) -> int:
+        """must be called with mutex held, returns lsn of the write-ahead
+        log or 0"""
+        unfinished = self.unfinished_tasks - 1
+        if unfinished <= 0:
+            if unfinished < 0:
+                raise ValueError("task_done() called too many times")
+            self.all_tasks_done.notify_all()
+        self.unfinished_tasks = unfinished
+        return self._wal.log_task_done() if self._wal else 0
 
     def join(self):
         """Blocks until all items in the Queue have been gotten and processed.
@@ -333,6 +1468,13 @@ class WuKongQueue:
         with self._statistic_lock:
             return len(self.client_stats)
 
+    def handshake_stats(self) -> dict:
+        """Return statistic of handshakes: number of pending, completed,
+        failed and rejected ones, average and max latency in seconds
+        """
+        with self._statistic_lock:
+            return self._handshake_stat.as_dict()
+
     def remove_client(self, client_key):
         with self._statistic_lock:
             try:
@@ -347,7 +1489,8 @@ class WuKongQueue:
         reply_msg = conn.read(ignore_socket_timeout=ignore_socket_timeout)
         if not reply_msg.is_valid():
             return
-        reply_msg.unwrap()
+        # items put by client are kept as Serialized
+        reply_msg.unwrap(passthrough=True)
         return reply_msg
 
     def _auth(self, conn: TcpConn, client_stat: _ClientStatistic):
@@ -359,11 +1502,11 @@ class WuKongQueue:
                 cmd = reply_msg.queue_params_object.cmd
                 args = reply_msg.queue_params_object.args
                 if cmd == QUEUE_AUTH_KEY:
-                    if args["auth_key"] == self._auth_key:
-                        conn.write(QUEUE_OK)
+                    if args.get("auth_key") == self._auth_key:
+                        conn.write_msg(QUEUE_OK)
                         return True
                     else:
-                        conn.write(QUEUE_FAIL)
+                        conn.write_msg(QUEUE_FAIL)
                         return False
             return False
 
@@ -377,154 +1520,313 @@ class WuKongQueue:
     def on_running(self):
         if self.closed:
             self.closed = False
+            if self._ttl_used:
+                with self.mutex:
+                    self._start_reaper()
+            for queue in self._hosted_queues():
+                queue.run()
             self._logger.debug(
                 "<WuKongQueue [%s] is listening to %s" % (self.name, self.addr)
             )
 
-    def _run(self):
+    def _begin_handshake(self) -> bool:
+        """check limits before handshake of a new connection,
+        returns False if the connection should be closed"""
+        with self._statistic_lock:
+            stat = self._handshake_stat
+            if self.max_clients > 0:
+                if self.max_clients <= len(self.client_stats) + stat.pending:
+                    # client will receive a empty byte, that represents
+                    # clients fulled!
+                    return False
+            if 0 < self.max_pending_handshakes <= stat.pending:
+                stat.rejected += 1
+                self._logger.warning(
+                    "[server:%s] too many pending handshakes" % str(self.addr)
+                )
+                return False
+            stat.pending += 1
+            return True
+
+    def _end_handshake(self, start, ok):
+        latency = monotonic() - start
+        with self._statistic_lock:
+            self._handshake_stat.record(latency, ok)
+        self._logger.debug(
+            "[server:%s] handshake %s in %.3fs"
+            % (self.addr, "succeeded" if ok else "failed", latency)
+        )
+
+    def _run(self, tcp_svr: TcpSvr):
+        """accept loop, handshake is done by the thread of connection, so a
+        slow client never delays others"""
         while True:
             try:
-                sock, addr = self._tcp_svr.accept()
+                sock, addr = tcp_svr.accept()
                 sock.settimeout(self.socket_connect_timeout)
             except OSError:
                 return
 
             tcp_conn = TcpConn(sock=sock)
-            client_stat = _ClientStatistic(client_addr=addr, conn=tcp_conn)
-            with self._statistic_lock:
-                if self.max_clients > 0:
-                    if self.max_clients <= len(self.client_stats):
-                        # client will receive a empty byte, that represents
-                        # clients fulled!
-                        tcp_conn.close()
-                        continue
-
-            # send hi message on connected
-            ok = tcp_conn.write(QUEUE_HI)
-            if ok:
-                # it's a must to authenticate firstly
-                if self._auth(conn=tcp_conn, client_stat=client_stat):
-                    new_thread(
-                        self.process_conn,
-                        kw={"conn": tcp_conn, "me": client_stat.me},
-                    )
-                    self._logger.info(
-                        "[server:%s] new client from %s"
-                        % (self.addr, str(addr))
-                    )
-                    continue
-                # auth failed!
+            if not self._begin_handshake():
                 tcp_conn.close()
                 continue
-            else:
-                # please report this problem with your python version and
-                # wukongqueue package version on
-                # https://github.com/chaseSpace/wukongqueue/issues
-                self._logger.fatal("write_wukong_data err:%s" % tcp_conn.err)
-                return
+            client_stat = _ClientStatistic(client_addr=addr, conn=tcp_conn)
+            new_thread(
+                self._handshake_and_process,
+                kw={"client_stat": client_stat, "start": monotonic()},
+            )
+
+    def _handshake_and_process(self, client_stat: _ClientStatistic, start):
+        """run as thread of a new connection"""
+        tcp_conn = client_stat.conn
+        ok = False
+        try:
+            # send hi message on connected,
+            # then it's a must to authenticate firstly
+            ok = tcp_conn.write_hi() and self._auth(
+                conn=tcp_conn, client_stat=client_stat
+            )
+        finally:
+            self._end_handshake(start, ok)
+        if not ok:
+            if tcp_conn.err:
+                self._logger.warning(
+                    "write_wukong_data err:%s" % tcp_conn.err
+                )
+            tcp_conn.close()
+            return
+        self._logger.info(
+            "[server:%s] new client from %s"
+            % (self.addr, str(client_stat.client_addr))
+        )
+        self.process_conn(me=client_stat.me, conn=tcp_conn)
 
     def process_conn(self, me, conn: TcpConn):
         """run as thread at all"""
+        with self._statistic_lock:
+            client_stat = self.client_stats.get(me)
         with _WkSvrHelper(wk_inst=self, client_key=me):
-            while True:
-                reply_msg = self._parse_socket_msg(
-                    conn=conn, ignore_socket_timeout=True
+            try:
+                while True:
+                    reply_msg = self._parse_socket_msg(
+                        conn=conn, ignore_socket_timeout=True
+                    )
+                    if reply_msg is None:
+                        return
+                    params = reply_msg.queue_params_object
+                    queue = self._route(conn, params)
+                    if queue is not None:
+                        queue._reply_cmd(conn, params, client_stat)
+            finally:
+                # before the client is removed
+                if client_stat is not None:
+                    self._release_client(client_stat)
+
+    def _reply_cmd(self, conn, params, client_stat=None):
+        """execute a queue cmd of client and reply it, `conn` is TcpConn
+        or any object with the same `write_msg` and `proto_version`,
+        items got and tasks done are tracked by `client_stat`"""
+        cmd = params.cmd
+        args = params.args
+        data = params.data
+
+        # Instruction for cmd and data interaction:
+        #   always reply with conn.write_msg(queue_cmd, ...), it
+        #   wraps msg according to the protocol of connection
+
+        #
+        # Communicate with client normally
+        #
+
+        # GET
+        if cmd == QUEUE_GET:
+            try:
+                item, priority = self._get(
+                    block=args.get("block", True),
+                    timeout=args.get("timeout"),
+                    group=args.get("group"),
                 )
-                if reply_msg is None:
-                    return
-                cmd = reply_msg.queue_params_object.cmd
-                args = reply_msg.queue_params_object.args
-                data = reply_msg.queue_params_object.data
+            except Empty:
+                conn.write_msg(QUEUE_EMPTY)
+            else:
+                self._track_taken(client_stat, (item,), (priority,))
+                conn.write_msg(QUEUE_DATA, data=item)
+
+        # PUT
+        elif cmd == QUEUE_PUT:
+            try:
+                self.put(
+                    data,
+                    block=args.get("block", True),
+                    timeout=args.get("timeout"),
+                    priority=args.get("priority"),
+                    delay=args.get("delay"),
+                    ttl=args.get("ttl"),
+                )
+            except Full:
+                conn.write_msg(QUEUE_FULL)
+            else:
+                conn.write_msg(QUEUE_OK)
+
+        # PUT_MANY, reply number of items put
+        elif cmd == QUEUE_PUT_MANY:
+            put = self.put_many(
+                data or [],
+                block=args.get("block", True),
+                timeout=args.get("timeout"),
+                priority=args.get("priority"),
+                delay=args.get("delay"),
+                ttl=args.get("ttl"),
+            )
+            conn.write_msg(QUEUE_DATA, data=put)
 
-                # Instruction for cmd and data interaction:
-                #   1. if only queue_cmd, just send WukongPkg(QUEUE_OK)
-                #   2. if there's arg or data besides queue_cmd, use
-                #      wrap_queue_msg(queue_cmd=QUEUE_CMD, arg={}, data=b'')
+        # GET_MANY
+        elif cmd == QUEUE_GET_MANY:
+            try:
+                items, priorities = self._get_many(
+                    args.get("max_items", 1),
+                    block=args.get("block", True),
+                    timeout=args.get("timeout"),
+                    group=args.get("group"),
+                )
+            except Empty:
+                conn.write_msg(QUEUE_EMPTY)
+            else:
+                self._track_taken(client_stat, items, priorities)
+                conn.write_msg(QUEUE_DATA, data=ItemBatch(items))
+
+        # STATUS QUERY
+        elif cmd == QUEUE_QUERY_STATUS:
+            # FULL | EMPTY | NORMAL
+            if self.full():
+                conn.write_msg(QUEUE_FULL)
+            elif self.empty():
+                conn.write_msg(QUEUE_EMPTY)
+            else:
+                conn.write_msg(QUEUE_NORMAL)
 
-                #
-                # Communicate with client normally
-                #
+        # PING -> PONG
+        elif cmd == QUEUE_PING:
+            conn.write_msg(QUEUE_PONG)
 
-                # GET
-                if cmd == QUEUE_GET:
-                    try:
-                        item = self.get(
-                            block=args["block"], timeout=args["timeout"]
-                        )
-                    except Empty:
-                        conn.write(QUEUE_EMPTY)
-                    else:
-                        conn.write(
-                            wrap_queue_msg(queue_cmd=QUEUE_DATA, data=item)
-                        )
+        # QSIZE
+        elif cmd == QUEUE_SIZE:
+            conn.write_msg(QUEUE_DATA, data=self.qsize())
 
-                # PUT
-                elif cmd == QUEUE_PUT:
-                    try:
-                        self.put(
-                            data, block=args["block"], timeout=args["timeout"]
-                        )
-                    except Full:
-                        conn.write(QUEUE_FULL)
-                    else:
-                        conn.write(QUEUE_OK)
-
-                # STATUS QUERY
-                elif cmd == QUEUE_QUERY_STATUS:
-                    # FULL | EMPTY | NORMAL
-                    if self.full():
-                        conn.write(QUEUE_FULL)
-                    elif self.empty():
-                        conn.write(QUEUE_EMPTY)
-                    else:
-                        conn.write(QUEUE_NORMAL)
+        # MAXSIZE
+        elif cmd == QUEUE_MAXSIZE:
+            conn.write_msg(QUEUE_DATA, data=self.maxsize)
 
-                # PING -> PONG
-                elif cmd == QUEUE_PING:
-                    conn.write(QUEUE_PONG)
+        # RESET
+        elif cmd == QUEUE_RESET:
+            self.reset(args.get("maxsize"))
+            conn.write_msg(QUEUE_OK)
 
-                # QSIZE
-                elif cmd == QUEUE_SIZE:
-                    conn.write(
-                        wrap_queue_msg(queue_cmd=QUEUE_DATA, data=self.qsize())
-                    )
+        # LEASE, the receipt is replied in args
+        elif cmd == QUEUE_LEASE:
+            try:
+                receipt, item = self._lease(
+                    block=args.get("block", True),
+                    timeout=args.get("timeout"),
+                    visibility_timeout=args.get("visibility_timeout"),
+                )
+            except Empty:
+                conn.write_msg(QUEUE_EMPTY)
+            except ValueError as e:
+                conn.write_msg(QUEUE_FAIL, exception=e)
+            else:
+                if client_stat is not None:
+                    client_stat.track(self).receipts.add(receipt)
+                conn.write_msg(
+                    QUEUE_DATA, args={"receipt": receipt}, data=item
+                )
 
-                # MAXSIZE
-                elif cmd == QUEUE_MAXSIZE:
-                    conn.write(
-                        wrap_queue_msg(queue_cmd=QUEUE_DATA, data=self.maxsize)
-                    )
+        # ACK/NACK
+        elif cmd in (QUEUE_ACK, QUEUE_NACK):
+            receipt = args.get("receipt")
+            try:
+                if cmd == QUEUE_ACK:
+                    self.ack(receipt)
+                else:
+                    self.nack(receipt)
+            except ValueError as e:
+                conn.write_msg(QUEUE_FAIL, exception=e)
+            else:
+                conn.write_msg(QUEUE_OK)
+            track = client_stat and client_stat.tracks.get(self)
+            if track is not None:
+                track.receipts.discard(receipt)
+
+        # STATS
+        elif cmd == QUEUE_STATS:
+            conn.write_msg(QUEUE_DATA, data=self.stats())
+
+        # SUBSCRIBE, then items are pushed until the connection is lost
+        elif cmd == QUEUE_SUBSCRIBE:
+            conn.write_msg(QUEUE_OK)
+            self._push(conn, args.get("prefetch", 1), args.get("group"))
+
+        # CLIENTS NUMBER
+        elif cmd == QUEUE_CLIENTS:
+            conn.write_msg(QUEUE_DATA, data=self.connected_clients())
+
+        # TASK_DONE
+        elif cmd == QUEUE_TASK_DONE:
+            try:
+                self._finish_task(client_stat)
+            except ValueError as e:
+                conn.write_msg(QUEUE_FAIL, exception=e)
+            else:
+                conn.write_msg(QUEUE_OK)
+
+        # JOIN
+        elif cmd == QUEUE_JOIN:
+            self.join()
+            conn.write_msg(QUEUE_OK)
+
+        # PROTO, reply with the accepted version in current
+        # protocol, then switch the connection to it
+        elif cmd == QUEUE_PROTO:
+            version = min(args.get("version", PROTO_V1), PROTO_LATEST)
+            conn.write_msg(QUEUE_DATA, data=version)
+            conn.proto_version = version
+        else:
+            raise UnknownCmd(cmd)
 
-                # RESET
-                elif cmd == QUEUE_RESET:
-                    self.reset(args["maxsize"])
-                    conn.write(QUEUE_OK)
-
-                # CLIENTS NUMBER
-                elif cmd == QUEUE_CLIENTS:
-                    with self._statistic_lock:
-                        clients = len(self.client_stats.keys())
-                    conn.write(
-                        wrap_queue_msg(queue_cmd=QUEUE_DATA, data=clients)
-                    )
 
-                # TASK_DONE
-                elif cmd == QUEUE_TASK_DONE:
-                    reply = {"cmd": QUEUE_OK, "err": ""}
-                    try:
-                        self.task_done()
-                    except ValueError as e:
-                        reply["cmd"] = QUEUE_FAIL
-                        reply["err"] = e
-                    conn.write(
-                        wrap_queue_msg(
-                            queue_cmd=reply["cmd"], exception=reply["err"]
-                        )
-                    )
+class _Hosted:
+    """mixin of a named queue hosted by a server, it doesn't listen, cmds
+    of the server's connections are routed to it, see declare_queue"""
 
-                # JOIN
-                elif cmd == QUEUE_JOIN:
-                    self.join()
-                    conn.write(QUEUE_OK)
-                else:
-                    raise UnknownCmd(cmd)
+    def __init__(self, server, name, maxsize=0, **kwargs):
+        self._server = server
+        kwargs.setdefault("log_level", server._logger.level)
+        super().__init__(
+            *server.addr, name=name, maxsize=maxsize, **kwargs
+        )
+
+    def run(self):
+        self.on_running()
+
+    def close(self):
+        self.closed = True
+        if self._wal is not None:
+            self._wal.close()
+        self._close_storage()
+
+    def declare_queue(self, name, maxsize=0, **kwargs):
+        return self._server.declare_queue(name, maxsize, **kwargs)
+
+    def _queue_of(self, name):
+        return self
+
+    def connected_clients(self):
+        return self._server.connected_clients()
+
+    def __repr__(self):
+        return "<WuKongQueue [%s] hosted by %s>" % (self.name, self._server)
+
+
+class _HostedQueue(_Hosted, WuKongQueue):
+    pass
@@ -25,6 +25,7 @@ def new_thread(f, kw={}):
     t = threading.Thread(target=f, kwargs=kw)
     t.setDaemon(True)
     t.start()
+    return t
 
 
 def singleton(f):